@@ -34,13 +34,13 @@ source venv/bin/activate
 python -m backend.fetch_ch_domains
 
 # 6. Vérifier le fichier
-if [ -f "domains_ch.txt" ]; then
-    DOMAIN_COUNT=$(grep -v '^#' domains_ch.txt | grep -v '^$' | wc -l)
+if [ -f "domains_ch.dset" ]; then
     echo ""
-    echo "✅ Fichier domains_ch.txt créé avec $DOMAIN_COUNT domaines"
+    echo "✅ Fichier domains_ch.dset créé"
+    python -m backend.domainset info domains_ch.dset
 else
     echo ""
-    echo "⚠️  Fichier domains_ch.txt non créé (AXFR a peut-être échoué)"
+    echo "⚠️  Fichier domains_ch.dset non créé (AXFR a peut-être échoué)"
     echo "   Vous pouvez créer le fichier manuellement"
 fi
 
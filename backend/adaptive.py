@@ -0,0 +1,121 @@
+"""
+Concurrence et timeouts adaptatifs du scanner.
+
+CONCURRENCY n'est qu'un point de départ: le contrôleur AIMD observe chaque
+fenêtre de ADAPTIVE_WINDOW scans (p95 de la latence des réponses, taux de
+timeouts et d'erreurs de connexion). Tant qu'ils restent proches des
+meilleures valeurs observées, la concurrence augmente de ADAPTIVE_STEP; dès
+qu'ils se dégradent (lien montant ou résolveur saturé), elle est multipliée
+par ADAPTIVE_BACKOFF. Le scanner converge ainsi vers le débit soutenable de
+la machine, entre CONCURRENCY_MIN et CONCURRENCY_MAX.
+
+Les timeouts suivent la distribution des latences: ADAPTIVE_TIMEOUT_FACTOR
+fois le p95, bornés par TIMEOUT_MIN / TIMEOUT_MAX, pour ne pas conclure
+« Inaccessible » quand c'est le scanner qui est ralenti.
+"""
+
+import asyncio
+from backend import config
+
+
+# Timeouts actifs (connexion, total) du process; None: valeurs de config
+_timeouts = None
+
+
+def timeouts():
+    """Timeouts (connexion, total) en secondes à utiliser pour une requête"""
+    if _timeouts is None:
+        return config.HEAD_TIMEOUT, config.PARTIAL_GET_TIMEOUT
+    return _timeouts
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class ConcurrencyController:
+    """
+    Limite de scans simultanés ajustée par AIMD.
+
+    Chaque worker appelle acquire() avant de prendre un domaine dans la file
+    (et donc de dépenser le jeton de son IP), record() avec le résultat du
+    scan (latence en ms, ou None en cas de timeout / erreur de connexion)
+    puis release(). close() (arrêt du scan) réveille les workers en attente:
+    acquire() retourne alors False sans prendre de créneau.
+    """
+
+    def __init__(self, initial=None, minimum=None, maximum=None):
+        global _timeouts
+        self.minimum = minimum or config.CONCURRENCY_MIN
+        self.maximum = maximum or config.CONCURRENCY_MAX
+        self.limit = max(self.minimum, min(self.maximum, initial or config.CONCURRENCY))
+        self.active = 0
+        self._peak = 0
+        self._samples = []
+        self._best_p95 = None
+        self._best_error_rate = None
+        self._released = asyncio.Event()
+        self._closed = False
+        _timeouts = None
+
+    async def acquire(self):
+        while self.active >= self.limit and not self._closed:
+            self._released.clear()
+            await self._released.wait()
+        if self._closed:
+            return False
+        self.active += 1
+        self._peak = max(self._peak, self.active)
+        return True
+
+    def close(self):
+        self._closed = True
+        self._released.set()
+
+    def release(self):
+        self.active -= 1
+        self._released.set()
+
+    def record(self, latency_ms):
+        self._samples.append(latency_ms)
+        if len(self._samples) >= config.ADAPTIVE_WINDOW:
+            self._adjust()
+
+    def _adjust(self):
+        """Décision AIMD sur la fenêtre écoulée et recalcul des timeouts"""
+        global _timeouts
+        samples, self._samples = self._samples, []
+        peak, self._peak = self._peak, self.active
+        latencies = [s for s in samples if s is not None]
+        error_rate = 1 - len(latencies) / len(samples)
+        p95 = _percentile(latencies, 0.95) if latencies else None
+
+        # Références: meilleures valeurs observées, relâchées lentement (le réseau varie)
+        if p95 is not None:
+            self._best_p95 = p95 if self._best_p95 is None else min(p95, self._best_p95 * 1.02)
+        if self._best_error_rate is None:
+            self._best_error_rate = error_rate
+        else:
+            self._best_error_rate = min(error_rate, self._best_error_rate + 0.005)
+
+        degraded = (
+            p95 is None
+            or p95 > self._best_p95 * config.ADAPTIVE_LATENCY_FACTOR
+            or error_rate > self._best_error_rate + config.ADAPTIVE_ERROR_MARGIN
+        )
+        previous = self.limit
+        if degraded:
+            self.limit = max(self.minimum, int(self.limit * config.ADAPTIVE_BACKOFF))
+        elif peak >= self.limit:
+            # N'augmenter que si la limite a été atteinte (sinon la file est le goulot)
+            self.limit = min(self.maximum, self.limit + config.ADAPTIVE_STEP)
+
+        if p95 is not None:
+            total = min(config.TIMEOUT_MAX, max(config.TIMEOUT_MIN, p95 / 1000 * config.ADAPTIVE_TIMEOUT_FACTOR))
+            _timeouts = (total * config.HEAD_TIMEOUT / config.PARTIAL_GET_TIMEOUT, total)
+
+        if self.limit != previous:
+            p95_text = f"{p95} ms" if p95 is not None else "-"
+            print(f"⚙️  Concurrence {previous} → {self.limit} (p95 {p95_text}, "
+                  f"erreurs {error_rate:.0%}, timeout {timeouts()[1]:.1f} s)")
@@ -5,12 +5,15 @@ import os
 import subprocess
 import shlex
 import datetime
+import hmac
 import signal
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from typing import Dict, List, Literal, Optional, Union
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from backend import db
+from pydantic import BaseModel
+from backend import config, coordinator, db, domainset, metrics, scoring
 
 app = FastAPI(
     title="Old .ch Scanner",
@@ -32,7 +35,7 @@ FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fronten
 # Configuration pour les jobs (fetch et scan)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))  # /opt/oldsite-scanner
 PYTHON_BIN = os.path.join(PROJECT_ROOT, "venv", "bin", "python")
-DOMAINS_FILE = os.path.join(PROJECT_ROOT, "domains_final.txt")
+DOMAINS_FILE = os.path.join(PROJECT_ROOT, "domains_final.dset")
 
 # État global des jobs
 JOB_STATE = {
@@ -46,8 +49,15 @@ JOB_STATE = {
 
 @app.on_event("startup")
 async def startup():
-    """Initialise la base de données au démarrage"""
+    """Initialise la base de données et les pools de connexions au démarrage"""
     await db.init_db()
+    await db.init_pools()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Ferme les pools de connexions"""
+    await db.close_pools()
 
 
 @app.get("/")
@@ -57,18 +67,19 @@ async def root():
 
 
 @app.get("/api/scans")
-async def list_scans(min_score: int = 0, limit: int = 200):
+async def list_scans(min_score: int = 0, limit: int = 200, history: bool = False):
     """
     Liste les scans avec un score minimum.
     
     Args:
         min_score: Score minimum pour filtrer les résultats (défaut: 0)
         limit: Nombre maximum de résultats (défaut: 200)
+        history: Inclure tous les scans et pas seulement le dernier par domaine (défaut: False)
     
     Returns:
         Liste des scans triés par score décroissant
     """
-    return {"items": await db.list_scans(limit, min_score)}
+    return {"items": await db.list_scans(limit, min_score, history)}
 
 
 @app.get("/api/scans/{scan_id}")
@@ -90,29 +101,152 @@ async def get_scan(scan_id: int):
 
 @app.get("/api/stats")
 async def get_stats():
-    """Retourne des statistiques globales sur les scans"""
-    # Cette fonction pourrait être étendue pour fournir plus de stats
-    scans = await db.list_scans(limit=10000, min_score=0)
-    
-    if not scans:
-        return {
-            "total_scans": 0,
-            "avg_score": 0,
-            "max_score": 0,
-            "domains_count": 0
-        }
-    
-    scores = [s["score"] for s in scans]
-    domains = set(s["domain"] for s in scans)
+    """Retourne des statistiques globales sur les scans (agrégées en SQL, mises en cache)"""
+    return await db.get_stats()
+
+
+@app.get("/api/scoring/rules")
+async def get_scoring_rules():
+    """Retourne la version et le nombre de règles de scoring actives"""
+    ruleset = scoring.current()
+    return {
+        "version": ruleset.version,
+        "path": ruleset.path,
+        "rules_count": len(ruleset.rules),
+    }
+
+
+@app.post("/api/scoring/reload")
+async def reload_scoring_rules():
+    """
+    Recharge le fichier de règles de scoring sans redémarrer l'API.
     
+    Returns:
+        Nouvelle version des règles (les règles actives sont conservées si le fichier est invalide)
+    """
+    try:
+        ruleset = scoring.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Règles invalides: {e}")
     return {
-        "total_scans": len(scans),
-        "avg_score": sum(scores) / len(scores) if scores else 0,
-        "max_score": max(scores) if scores else 0,
-        "domains_count": len(domains)
+        "status": "reloaded",
+        "version": ruleset.version,
+        "rules_count": len(ruleset.rules),
     }
 
 
+class ErrorResult(BaseModel):
+    """Domaine injoignable (erreur DNS: dns_error et dns_retry_at pour le cache négatif)"""
+    domain: str
+    error: str
+    seq: Optional[int] = None
+    dns_error: Optional[str] = None
+    dns_retry_at: Optional[int] = None
+
+
+class UnchangedResult(BaseModel):
+    """Contenu inchangé depuis le scan same_as (score repris)"""
+    domain: str
+    unchanged: Literal[True]
+    scheme: str
+    http_code: int
+    score: int
+    same_as: int
+    latency_ms: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    rules_version: Optional[str] = None
+    seq: Optional[int] = None
+
+
+class ScanResult(BaseModel):
+    """Scan complet (voir scan_ch_sites.scan_domain)"""
+    domain: str
+    scheme: str
+    http_code: int
+    headers: Dict[str, str]
+    sample_head: str
+    score: int
+    reasons: str
+    latency_ms: int
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    rules_version: Optional[str] = None
+    seq: Optional[int] = None
+
+
+class BatchResults(BaseModel):
+    """Résultats d'un lot renvoyés par un worker (422 si un résultat est mal formé)"""
+    worker: str
+    results: List[Union[ScanResult, UnchangedResult, ErrorResult]]
+
+
+async def require_worker_token(x_worker_token: Optional[str] = Header(None)):
+    """Refuse les requêtes des workers sans le jeton partagé WORK_TOKEN (header X-Worker-Token)"""
+    if not config.WORK_TOKEN:
+        raise HTTPException(status_code=403, detail="Scan distribué désactivé (WORK_TOKEN non configuré)")
+    if x_worker_token is None or not hmac.compare_digest(x_worker_token.encode(), config.WORK_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Jeton de worker invalide")
+
+
+@app.post("/api/work/lease", dependencies=[Depends(require_worker_token)])
+async def lease_work(worker: str):
+    """
+    Attribue un lot de domaines à un worker (bail de WORK_LEASE_SECONDS secondes).
+    
+    Args:
+        worker: Nom du worker
+    
+    Returns:
+        Lot (batch_id, domains, lease_expires, states), ou 204 si la file est vide.
+        states contient les validateurs et l'empreinte des scans précédents.
+    """
+    batch = await db.lease_batch(worker, config.WORK_LEASE_SECONDS, config.WORK_MAX_ATTEMPTS)
+    if batch is None:
+        return Response(status_code=204)
+    batch["states"] = await db.domain_states(batch["domains"])
+    return batch
+
+
+@app.post("/api/work/{batch_id}/renew", dependencies=[Depends(require_worker_token)])
+async def renew_work(batch_id: int, worker: str):
+    """Prolonge le bail d'un lot en cours de scan (409 si le lot a été réattribué)"""
+    if not await db.renew_lease(batch_id, worker, config.WORK_LEASE_SECONDS):
+        raise HTTPException(status_code=409, detail="Lot non attribué à ce worker")
+    return {"status": "renewed"}
+
+
+@app.post("/api/work/{batch_id}/complete", dependencies=[Depends(require_worker_token)])
+async def complete_work(batch_id: int, payload: BatchResults):
+    """
+    Enregistre les résultats d'un lot et le marque comme terminé.
+    
+    Returns:
+        Nombre de scans enregistrés (409 si le bail a expiré et le lot a été réattribué)
+    """
+    results = [result.model_dump(exclude_unset=True) for result in payload.results]
+    stored = await coordinator.complete(batch_id, payload.worker, results)
+    if stored is None:
+        raise HTTPException(status_code=409, detail="Lot non attribué à ce worker")
+    return {"status": "done", "stored": stored}
+
+
+@app.get("/api/work/status")
+async def work_status():
+    """Nombre de lots et de domaines par état (pending, leased, expired, done, failed)"""
+    return await db.work_status(config.WORK_MAX_ATTEMPTS)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Métriques des process de scan au format texte Prometheus
+    (publiées dans METRICS_DIR, voir backend/metrics.py)
+    """
+    return Response(content=metrics.collect(), media_type=metrics.CONTENT_TYPE)
+
+
 def _start_subprocess(cmd: str):
     """Lance un subprocess et retourne le process"""
     proc = subprocess.Popen(
@@ -160,7 +294,7 @@ async def start_fetch():
 @app.post("/api/scan/start")
 async def start_scan():
     """
-    Lance le scan des domaines depuis domains_final.txt
+    Lance un scan planifié du catalogue (table domains: crt.sh, AXFR et imports)
     
     Returns:
         Status du job lancé
@@ -172,14 +306,14 @@ async def start_scan():
             "message": f"Un job est déjà en cours: {JOB_STATE['state']}"
         }
     
-    # Vérifier que le fichier de domaines existe
-    if not os.path.exists(DOMAINS_FILE):
+    # Vérifier que le catalogue contient des domaines
+    if await db.catalog_empty():
         return {
             "status": "error",
-            "message": f"Le fichier {DOMAINS_FILE} n'existe pas. Lancez d'abord la récupération des domaines."
+            "message": "Le catalogue de domaines est vide. Lancez d'abord la récupération des domaines."
         }
     
-    cmd = f"{PYTHON_BIN} -m backend.scan_ch_sites --domains-file {DOMAINS_FILE} --limit 800"
+    cmd = f"{PYTHON_BIN} -m backend.scan_ch_sites --schedule --limit 800"
     proc = _start_subprocess(cmd)
     
     JOB_STATE.update({
@@ -263,18 +397,16 @@ async def job_status():
     # Ajouter des infos supplémentaires
     response = dict(JOB_STATE)
     
-    # Vérifier si le fichier de domaines existe
-    response["domains_file_exists"] = os.path.exists(DOMAINS_FILE)
-    if os.path.exists(DOMAINS_FILE):
+    # Domaines disponibles pour le scan: catalogue (compté avec les statistiques, en cache),
+    # à défaut fichier crt.sh pas encore importé
+    response["domains_count"] = (await db.get_stats())["catalog_count"]
+    if not response["domains_count"] and os.path.exists(DOMAINS_FILE):
         try:
-            with open(DOMAINS_FILE, 'r') as f:
-                lines = f.readlines()
-                domains_count = len([l for l in lines if l.strip() and not l.startswith('#')])
-                response["domains_count"] = domains_count
-        except:
-            response["domains_count"] = 0
-    else:
-        response["domains_count"] = 0
+            # Lu dans l'en-tête du .dset: pas de relecture de la liste à chaque poll
+            response["domains_count"] = domainset.count_domains(DOMAINS_FILE)
+        except Exception:
+            pass
+    response["domains_file_exists"] = response["domains_count"] > 0 or os.path.exists(DOMAINS_FILE)
     
     # Vérifier si un fichier de progression existe (pendant la récupération)
     progress_file = DOMAINS_FILE + ".progress"
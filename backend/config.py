@@ -1,10 +1,104 @@
 """Configuration du scanner de vieux sites .ch"""
 
+import os
+
 DB_FILE = "oldsites.db"
-CONCURRENCY = 30
-HEAD_TIMEOUT = 3
+CONCURRENCY = 30             # scans simultanés (valeur de départ si ADAPTIVE_CONCURRENCY)
+SCAN_WORKERS = 1              # process de scan (--workers), chacun avec CONCURRENCY requêtes
+QUEUE_SIZE = 1000             # domaines lus d'avance (file bornée entre lecture et workers)
+STATE_LOOKUP_CHUNK = 500      # domaines par lecture de l'état précédent (re-scan conditionnel)
+
+# Débit par IP (hébergements mutualisés): token bucket par IP résolue ou par réseau
+IP_PREFIX = 24                # 32: par IP; 24: par réseau /24 (IPv6: /48 au plus, /64 pour 32)
+IP_RATE = 10.0                # domaines par seconde et par clé
+IP_BURST = 20                 # domaines d'affilée avant limitation
+IP_KEY_PENDING = 50           # places de la file au plus par clé (au-delà: domaines mis de côté)
+IP_SPILL_SIZE = 100000        # domaines mis de côté au plus (toutes clés), puis la lecture attend
+IP_REPORT_INTERVAL = 30       # secondes entre deux affichages des IP les plus chargées
+HEAD_TIMEOUT = 3              # mode "get": timeout de connexion; mode "head": timeout du HEAD
 PARTIAL_GET_TIMEOUT = 5
+
+# Concurrence adaptative (AIMD) et timeouts suivant les latences observées (backend/adaptive.py)
+ADAPTIVE_CONCURRENCY = True   # False: CONCURRENCY et timeouts fixes
+CONCURRENCY_MIN = 5
+CONCURRENCY_MAX = 300
+ADAPTIVE_WINDOW = 200         # scans par décision
+ADAPTIVE_STEP = 5             # augmentation additive quand tout va bien
+ADAPTIVE_BACKOFF = 0.7        # réduction multiplicative en cas de dégradation
+ADAPTIVE_LATENCY_FACTOR = 2.0 # dégradé si p95 > 2× la meilleure p95 observée
+ADAPTIVE_ERROR_MARGIN = 0.05  # dégradé si taux d'erreurs > meilleur taux + 5 points
+ADAPTIVE_TIMEOUT_FACTOR = 3.0 # timeout total = 3× p95 des réponses (connexion au prorata)
+TIMEOUT_MIN = 5               # bornes du timeout total adaptatif (pas moins que PARTIAL_GET_TIMEOUT: vieux serveurs lents)
+TIMEOUT_MAX = 15
+FETCH_MODE = "get"            # "get": un seul GET en streaming; "head": HEAD puis GET partiel
+HTTP_FALLBACK_DELAY = 1.0     # secondes avant de lancer HTTP en parallèle si HTTPS n'a pas répondu
 USER_AGENT = "ChAuditBot/1.0 (+mailto:you@yourdomain.ch)"
 SAMPLE_BYTES = 2048
 SCORE_THRESHOLD = 40
-DOMAINS_FILE = "domains_ch.txt"
+STORE_ALL_SCANS = False       # True: stocker aussi les scans sous le seuil (re-scoring hors ligne)
+DOMAINS_FILE = "domains_ch.dset"     # liste .dset (backend/domainset.py) ou texte, un domaine par ligne
+LEGACY_DOMAINS_FILE = "domains_ch.txt"  # ancienne liste texte, utilisée par défaut tant que DOMAINS_FILE n'existe pas
+
+# Résolution DNS asynchrone avant le scan (backend/resolver.py)
+DNS_RESOLVE = True            # False: laisser aiohttp résoudre (getaddrinfo) sans pré-résolution
+DNS_SERVERS = []              # ex: ["9.9.9.9", "127.0.0.1:5353"]; vide: serveurs de /etc/resolv.conf
+DNS_CONCURRENCY = 200         # requêtes DNS simultanées
+DNS_TIMEOUT = 2.0             # secondes par essai
+DNS_RETRIES = 2               # nouveaux essais (serveur suivant) après un timeout
+DNS_CACHE_SIZE = 100000       # noms gardés en mémoire
+DNS_SOCKETS = 16              # sockets UDP par famille (ports source aléatoires, un tiré au hasard par requête)
+DNS_SOCKET_QUERIES = 1000     # requêtes par socket avant de le remplacer (nouveau port)
+DNS_MIN_TTL = 60              # bornes du TTL des réponses positives en cache
+DNS_MAX_TTL = 3600
+DNS_NEGATIVE_TTL = 86400      # NXDOMAIN / pas d'adresse: domaine écarté des scans pendant ce délai
+
+# Écriture groupée des résultats (une transaction toutes les N lignes ou T ms)
+WRITER_BATCH_SIZE = 500
+WRITER_FLUSH_MS = 1000
+
+# SQLite: pool de lecture pour l'API et pragmas de performance
+DB_READ_POOL_SIZE = 4
+DB_BUSY_TIMEOUT = 30          # secondes d'attente si la base est verrouillée
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE_KB = 64 * 1024
+
+# Statistiques du dashboard (/api/stats)
+STATS_MIN_REFRESH = 10        # secondes minimum entre deux recalculs pendant un scan
+STATS_BUCKET_SIZE = 10        # largeur des tranches de l'histogramme des scores
+STATS_DAYS = 30               # nombre de jours pour les scans par jour
+STATS_TOP_REASONS = 20        # nombre de raisons retournées
+
+# Règles de scoring (fichier JSON versionné, rechargeable à chaud)
+SCORING_RULES_FILE = os.path.join(os.path.dirname(__file__), "scoring_rules.json")
+SCORING_RELOAD_CHECK = 5      # secondes entre deux vérifications du fichier par le scanner
+
+# Re-scoring hors ligne (python -m backend.rescore)
+RESCORE_CHUNK_SIZE = 2000
+
+# Scan planifié (--schedule): budget par run et intervalles de re-scan
+SCHEDULE_BUDGET = 1000
+SCHEDULE_INTERVAL = 30 * 86400       # re-scan d'un domaine sous le seuil
+SCHEDULE_HOT_INTERVAL = 7 * 86400    # re-scan d'un domaine au-dessus du seuil (plus fréquent)
+SCHEDULE_CHANGE_WEIGHT = 0.5         # réduction max de l'intervalle pour les domaines qui changent souvent
+SCHEDULE_FAIL_BACKOFF = 86400        # attente après un échec, doublée à chaque échec suivant
+SCHEDULE_MAX_BACKOFF = 90 * 86400
+SCHEDULE_RESCAN_SHARE = 0.5          # part du budget réservée aux re-scans dus
+
+# Catalogue des domaines (table domains, toutes sources: python -m backend.ingest)
+INGEST_CHUNK = 50000          # domaines par transaction lors de l'ingestion d'une source
+CATALOG_PAGE = 2000           # domaines lus par requête lors d'un scan du catalogue (--catalog)
+
+# Métriques (backend/metrics.py): publiées par les process de scan, servies par l'API sur /metrics
+METRICS_DIR = ".metrics"      # un fichier par process de scan, agrégés par l'API
+METRICS_INTERVAL = 5          # secondes entre deux publications
+
+# Scan distribué (python -m backend.coordinator)
+COORDINATOR_URL = "http://127.0.0.1:8000"
+WORK_BATCH_SIZE = 500         # domaines par lot loué à un worker
+WORK_LEASE_SECONDS = 900      # durée d'un bail (prolongé pendant le scan, expiré si le worker meurt)
+WORK_MAX_ATTEMPTS = 3         # tentatives avant d'abandonner un lot
+WORK_POLL_INTERVAL = 30       # secondes entre deux demandes quand la file est vide
+WORK_REQUEST_TIMEOUT = 120    # timeout des requêtes vers le coordinateur
+WORK_SUBMIT_RETRIES = 5       # essais d'envoi des résultats d'un lot
+# Jeton partagé entre l'API et les workers (header X-Worker-Token); vide: /api/work/* refusé
+WORK_TOKEN = os.environ.get("OLDSITES_WORK_TOKEN", "")
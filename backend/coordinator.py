@@ -0,0 +1,215 @@
+"""
+Scan distribué: un coordinateur central et des workers sur plusieurs machines.
+
+La file de travail est la table SQLite work_batches de la base de l'API: la
+liste de domaines y est découpée en lots. Les workers louent un lot via l'API
+(POST /api/work/lease), le scannent avec le pipeline habituel, prolongent leur
+bail pendant le scan et renvoient tous les résultats du lot en une requête
+(POST /api/work/{id}/complete). Un bail expiré (worker arrêté ou mort) remet
+le lot à disposition des autres workers.
+
+Usage:
+    python -m backend.coordinator enqueue [--domains-file F] [--batch-size N] [--limit N]
+    python -m backend.coordinator status
+    python -m backend.coordinator worker [--url URL] [--name NOM] [--wait]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import aiohttp
+from backend import config, db, domainset, metrics
+from backend.resolver import open_resolver
+from backend.scan_ch_sites import iter_domains, print_result, result_row, scan_pipeline, scanner_session
+
+
+async def enqueue(domains_file, batch_size=None, limit=None):
+    """
+    Découpe un fichier de domaines (.dset ou texte) en lots et les ajoute à la file de travail.
+
+    Returns:
+        Nombre de lots ajoutés (None si le fichier est introuvable)
+    """
+    await db.init_db()
+    batch_size = batch_size or config.WORK_BATCH_SIZE
+    if not os.path.exists(domains_file):
+        print(f"❌ Fichier {domains_file} introuvable")
+        return None
+
+    added = 0
+    domains = 0
+    batches = []
+    batch = []
+    with domainset.open_domains(domains_file) as lines:
+        for domain in iter_domains(lines, limit):
+            batch.append(domain)
+            if len(batch) >= batch_size:
+                batches.append(batch)
+                batch = []
+            # Une transaction toutes les 100 lots
+            if len(batches) >= 100:
+                added += await db.enqueue_batches(batches)
+                domains += sum(len(b) for b in batches)
+                batches = []
+    batches.append(batch)
+    added += await db.enqueue_batches(batches)
+    domains += sum(len(b) for b in batches)
+
+    print(f"📥 {domains} domaines ajoutés à la file en {added} lots de {batch_size} max")
+    return added
+
+
+async def complete(batch_id, worker, results):
+    """
+    Enregistre les résultats d'un lot renvoyés par un worker.
+
+    Les résultats sont écrits comme ceux d'un scan local (voir result_row),
+    dans la même transaction que la clôture du lot.
+
+    Returns:
+        Nombre de scans écrits (complets ou inchangés), ou None si le lot
+        n'est plus attribué à ce worker
+    """
+    rows = [result_row(result) for result in results]
+    if not await db.complete_batch(batch_id, worker, rows):
+        return None
+    return sum(1 for row in rows if "headers" in row or row.get("same_as") is not None)
+
+
+async def status():
+    """État de la file de travail"""
+    await db.init_db()
+    for state, counts in (await db.work_status(config.WORK_MAX_ATTEMPTS)).items():
+        print(f"   {state:<8} {counts['batches']:>8} lots {counts['domains']:>10} domaines")
+
+
+async def _post(api, url, **params):
+    """POST vers le coordinateur; retourne (status, json)"""
+    async with api.post(url, **params) as resp:
+        if resp.status == 204:
+            return resp.status, None
+        return resp.status, await resp.json()
+
+
+async def _keep_lease(api, base_url, batch_id, worker):
+    """Prolonge le bail régulièrement pendant le scan du lot"""
+    while True:
+        await asyncio.sleep(config.WORK_LEASE_SECONDS / 3)
+        try:
+            code, _ = await _post(api, f"{base_url}/api/work/{batch_id}/renew", params={"worker": worker})
+            if code == 409:
+                print(f"⚠️  Bail du lot {batch_id} perdu (réattribué à un autre worker)")
+                return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"⚠️  Renouvellement du bail du lot {batch_id} impossible: {type(e).__name__}")
+
+
+async def run_worker(base_url=None, worker=None, wait=False):
+    """
+    Boucle d'un worker: louer un lot, le scanner, renvoyer les résultats.
+
+    S'arrête quand la file est vide, sauf avec wait=True (attend de nouveaux
+    lots toutes les WORK_POLL_INTERVAL secondes).
+
+    Returns:
+        Nombre de domaines scannés
+    """
+    base_url = (base_url or config.COORDINATOR_URL).rstrip("/")
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    scanned = 0
+    print(f"👷 Worker {worker} connecté à {base_url}")
+
+    timeout = aiohttp.ClientTimeout(total=config.WORK_REQUEST_TIMEOUT)
+    headers = {"X-Worker-Token": config.WORK_TOKEN}
+    async with metrics.publishing(), aiohttp.ClientSession(timeout=timeout, headers=headers) as api, \
+            open_resolver() as resolver, scanner_session(resolver) as session:
+        while True:
+            try:
+                code, batch = await _post(api, f"{base_url}/api/work/lease", params={"worker": worker})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"⚠️  Coordinateur injoignable: {type(e).__name__}")
+                code = None
+            if code in (401, 403):
+                print(f"❌ Coordinateur: accès refusé ({batch['detail']}); vérifier OLDSITES_WORK_TOKEN")
+                break
+            if code != 200:
+                if code == 204 and not wait:
+                    break
+                await asyncio.sleep(config.WORK_POLL_INTERVAL)
+                continue
+
+            batch_id = batch["batch_id"]
+            print(f"📦 Lot {batch_id}: {len(batch['domains'])} domaines")
+            results = []
+
+            async def sink(result):
+                print_result(result)
+                results.append(result)
+
+            # État des scans précédents fourni par le coordinateur (re-scan conditionnel)
+            states = batch.get("states") or {}
+
+            async def lookup(domains):
+                return states
+
+            keeper = asyncio.create_task(_keep_lease(api, base_url, batch_id, worker))
+            try:
+                await scan_pipeline(session, enumerate(batch["domains"]), sink, lookup=lookup, resolver=resolver)
+            finally:
+                keeper.cancel()
+                await asyncio.gather(keeper, return_exceptions=True)
+
+            # Envoi groupé des résultats (quelques essais si le coordinateur est indisponible)
+            for attempt in range(config.WORK_SUBMIT_RETRIES):
+                try:
+                    code, body = await _post(api, f"{base_url}/api/work/{batch_id}/complete",
+                                             json={"worker": worker, "results": results})
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"⚠️  Envoi du lot {batch_id} impossible ({type(e).__name__}), nouvel essai")
+                    code = None
+                    await asyncio.sleep(2 ** attempt)
+            if code == 200:
+                scanned += len(results)
+                print(f"✅ Lot {batch_id} terminé: {body['stored']} scans enregistrés")
+            elif code == 409:
+                print(f"⚠️  Lot {batch_id} refusé: bail expiré et lot réattribué")
+            else:
+                print(f"❌ Lot {batch_id} non enregistré (il sera réattribué après expiration du bail)")
+
+    print(f"👋 Worker {worker} terminé: {scanned} domaines scannés")
+    return scanned
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(description='Scan distribué: file de lots et workers')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_enqueue = sub.add_parser('enqueue', help='Ajoute les domaines d\'un fichier à la file de travail')
+    p_enqueue.add_argument('--domains-file',
+                           help=f'Fichier contenant la liste des domaines (défaut: {config.DOMAINS_FILE}, sinon {config.LEGACY_DOMAINS_FILE})')
+    p_enqueue.add_argument('--batch-size', type=int,
+                           help=f'Domaines par lot (défaut: {config.WORK_BATCH_SIZE})')
+    p_enqueue.add_argument('--limit', type=int, help='Nombre maximum de domaines')
+
+    sub.add_parser('status', help='Affiche l\'état de la file de travail')
+
+    p_worker = sub.add_parser('worker', help='Scanne des lots loués au coordinateur')
+    p_worker.add_argument('--url', default=config.COORDINATOR_URL, help='URL de l\'API du coordinateur')
+    p_worker.add_argument('--name', help='Nom du worker (défaut: hôte-pid)')
+    p_worker.add_argument('--wait', action='store_true',
+                          help='Attendre de nouveaux lots quand la file est vide')
+
+    args = parser.parse_args()
+    if args.command == 'enqueue':
+        asyncio.run(enqueue(args.domains_file or domainset.default_file(), args.batch_size, args.limit))
+    elif args.command == 'status':
+        asyncio.run(status())
+    else:
+        asyncio.run(run_worker(args.url, args.name, args.wait))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,323 @@
 """Module de gestion de la base de données SQLite"""
 
+import asyncio
 import aiosqlite
 import time
-from backend import config
+from contextlib import asynccontextmanager
+from backend import config, metrics
+
+
+# Sentinelle de fin pour la file du writer
+_STOP = object()
+
+# Writer actif (démarré par start_writer), None sinon
+_writer = None
+
+# Pools partagés (créés par init_pools au démarrage), None sinon
+_read_pool = None
+_write_pool = None
+
+
+async def _connect(readonly=False):
+    """
+    Ouvre une connexion configurée pour un usage concurrent.
+
+    WAL permet aux lecteurs de ne pas bloquer pendant les écritures du scanner;
+    synchronous=NORMAL suffit en WAL (pas de fsync à chaque commit).
+    """
+    db = await aiosqlite.connect(config.DB_FILE, timeout=config.DB_BUSY_TIMEOUT)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+    await db.execute(f"PRAGMA cache_size=-{int(config.DB_CACHE_SIZE_KB)}")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        await db.execute("PRAGMA query_only=ON")
+    return db
+
+
+class ConnectionPool:
+    """Pool de connexions aiosqlite réutilisées entre les requêtes"""
+
+    def __init__(self, size, readonly=False):
+        self.size = size
+        self.readonly = readonly
+        self._idle = asyncio.Queue()
+        self._all = []
+
+    async def open(self):
+        """Ouvre toutes les connexions du pool"""
+        for _ in range(self.size):
+            db = await _connect(self.readonly)
+            self._all.append(db)
+            self._idle.put_nowait(db)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Emprunte une connexion (attend si toutes sont utilisées)"""
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+            self._idle.put_nowait(db)
+
+    async def close(self):
+        """Ferme toutes les connexions du pool"""
+        for db in self._all:
+            await db.close()
+        self._all = []
+
+
+async def init_pools(read_size=None):
+    """Crée le pool de lecture (read-only) et la connexion d'écriture partagée"""
+    global _read_pool, _write_pool
+    _read_pool = ConnectionPool(read_size or config.DB_READ_POOL_SIZE, readonly=True)
+    await _read_pool.open()
+    # SQLite n'accepte qu'un écrivain à la fois: une seule connexion suffit
+    _write_pool = ConnectionPool(1)
+    await _write_pool.open()
+
+
+async def close_pools():
+    """Ferme les pools partagés"""
+    global _read_pool, _write_pool
+    for pool in (_read_pool, _write_pool):
+        if pool is not None:
+            await pool.close()
+    _read_pool = _write_pool = None
+
+
+@asynccontextmanager
+async def _reader():
+    """Connexion de lecture: empruntée au pool si disponible, sinon ouverte à la volée"""
+    if _read_pool is not None:
+        async with _read_pool.acquire() as db:
+            yield db
+        return
+    db = await _connect(readonly=True)
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+@asynccontextmanager
+async def _writer_connection():
+    """Connexion d'écriture: la connexion partagée si disponible, sinon ouverte à la volée"""
+    if _write_pool is not None:
+        async with _write_pool.acquire() as db:
+            yield db
+        return
+    db = await _connect()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# Migrations du schéma, appliquées dans l'ordre selon PRAGMA user_version.
+# Ne jamais modifier une migration publiée: en ajouter une nouvelle à la fin.
+MIGRATIONS = [
+    # 1: index pour le listing + table latest_scan (dernier scan par domaine)
+    """
+    CREATE INDEX IF NOT EXISTS idx_scans_domain_time ON scans(domain_id, scan_time);
+    CREATE INDEX IF NOT EXISTS idx_scans_score_time ON scans(score DESC, scan_time DESC);
+
+    CREATE TABLE IF NOT EXISTS latest_scan(
+        domain_id INTEGER PRIMARY KEY,
+        scan_id INTEGER NOT NULL,
+        scan_time INTEGER,
+        http_code INTEGER,
+        score INTEGER,
+        reasons TEXT,
+        latency_ms INTEGER,
+        FOREIGN KEY(domain_id) REFERENCES domains(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_latest_score_time ON latest_scan(score DESC, scan_time DESC);
+
+    INSERT OR REPLACE INTO latest_scan(domain_id, scan_id, scan_time, http_code, score, reasons, latency_ms)
+    SELECT s.domain_id, s.id, s.scan_time, s.http_code, s.score, s.reasons, s.latency_ms
+    FROM scans s
+    JOIN (SELECT domain_id, MAX(id) AS id FROM scans GROUP BY domain_id) m ON m.id = s.id;
+
+    -- latest_scan est maintenue par triggers: tout chemin d'écriture la garde à jour
+    CREATE TRIGGER IF NOT EXISTS trg_scans_latest_insert AFTER INSERT ON scans BEGIN
+        INSERT INTO latest_scan(domain_id, scan_id, scan_time, http_code, score, reasons, latency_ms)
+        VALUES (NEW.domain_id, NEW.id, NEW.scan_time, NEW.http_code, NEW.score, NEW.reasons, NEW.latency_ms)
+        ON CONFLICT(domain_id) DO UPDATE SET
+            scan_id=excluded.scan_id, scan_time=excluded.scan_time, http_code=excluded.http_code,
+            score=excluded.score, reasons=excluded.reasons, latency_ms=excluded.latency_ms
+        WHERE excluded.scan_id > latest_scan.scan_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_scans_latest_update AFTER UPDATE OF score, reasons ON scans BEGIN
+        UPDATE latest_scan SET score=NEW.score, reasons=NEW.reasons WHERE scan_id=NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_scans_latest_delete AFTER DELETE ON scans BEGIN
+        DELETE FROM latest_scan WHERE scan_id=OLD.id;
+    END;
+    """,
+    # 2: compteur de génération (invalidation du cache des stats) + index par date
+    """
+    CREATE TABLE IF NOT EXISTS meta(
+        key TEXT PRIMARY KEY,
+        value INTEGER
+    );
+    INSERT OR IGNORE INTO meta(key, value) VALUES ('scans_generation', 0);
+    CREATE INDEX IF NOT EXISTS idx_scans_time ON scans(scan_time);
+    """,
+    # 3: version des règles de scoring utilisée pour chaque scan
+    """
+    ALTER TABLE scans ADD COLUMN rules_version TEXT;
+    """,
+    # 4: schéma utilisé (https/http), nécessaire pour re-scorer hors ligne
+    """
+    ALTER TABLE scans ADD COLUMN scheme TEXT;
+    UPDATE scans SET scheme = CASE WHEN reasons LIKE 'Pas de HTTPS%' THEN 'http' ELSE 'https' END;
+    """,
+    # 5: file de lots de domaines distribués aux workers (backend/coordinator.py)
+    """
+    CREATE TABLE IF NOT EXISTS work_batches(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domains TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        lease_expires INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        done_at INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_work_batches_status ON work_batches(status, lease_expires);
+    """,
+    # 6: runs de scan et domaines terminés par run (reprise avec --resume)
+    """
+    CREATE TABLE IF NOT EXISTS scan_runs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domains_file TEXT NOT NULL,
+        file_size INTEGER,
+        file_mtime INTEGER,
+        status TEXT NOT NULL DEFAULT 'running',
+        started_at INTEGER NOT NULL,
+        finished_at INTEGER,
+        scanned INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_scan_runs_file ON scan_runs(domains_file, id);
+    -- seq: rang du domaine dans le fichier (lignes vides et commentaires exclus)
+    CREATE TABLE IF NOT EXISTS scan_run_domains(
+        run_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        done_at INTEGER NOT NULL,
+        PRIMARY KEY(run_id, seq)
+    ) WITHOUT ROWID;
+    """,
+    # 7: état de planification des re-scans par domaine (scan --schedule)
+    """
+    ALTER TABLE domains ADD COLUMN last_scan_at INTEGER;
+    ALTER TABLE domains ADD COLUMN last_score INTEGER;
+    ALTER TABLE domains ADD COLUMN scan_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE domains ADD COLUMN change_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE domains ADD COLUMN fail_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE domains ADD COLUMN next_scan_at INTEGER NOT NULL DEFAULT 0;
+    UPDATE domains SET
+        last_scan_at = (SELECT scan_time FROM latest_scan l WHERE l.domain_id = domains.id),
+        last_score = (SELECT score FROM latest_scan l WHERE l.domain_id = domains.id),
+        scan_count = (SELECT COUNT(*) FROM scans s WHERE s.domain_id = domains.id);
+    UPDATE domains SET next_scan_at = COALESCE(last_scan_at, 0);
+    CREATE INDEX IF NOT EXISTS idx_domains_due ON domains(next_scan_at) WHERE last_scan_at IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_domains_unscanned ON domains(id) WHERE last_scan_at IS NULL;
+    """,
+    # 8: validateurs HTTP et empreinte du contenu (re-scans conditionnels)
+    """
+    ALTER TABLE domains ADD COLUMN etag TEXT;
+    ALTER TABLE domains ADD COLUMN last_modified TEXT;
+    ALTER TABLE domains ADD COLUMN content_hash TEXT;
+    ALTER TABLE domains ADD COLUMN last_scheme TEXT;
+    ALTER TABLE domains ADD COLUMN rules_version TEXT;
+    ALTER TABLE scans ADD COLUMN content_hash TEXT;
+    -- unchanged=1: contenu identique au scan same_as (headers et échantillon non dupliqués)
+    ALTER TABLE scans ADD COLUMN unchanged INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE scans ADD COLUMN same_as INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_scans_same_as ON scans(same_as) WHERE same_as IS NOT NULL;
+    """,
+    # 9: cache DNS négatif (NXDOMAIN, pas d'adresse) jusqu'à dns_retry_at
+    """
+    ALTER TABLE domains ADD COLUMN dns_error TEXT;
+    ALTER TABLE domains ADD COLUMN dns_retry_at INTEGER;
+    """,
+    # 10: domaines retirés de la zone (diff AXFR), plus planifiés
+    """
+    ALTER TABLE domains ADD COLUMN removed_at INTEGER;
+    """,
+    # 11: catalogue multi-sources (première et dernière apparition par source, voir SOURCES)
+    """
+    ALTER TABLE domains ADD COLUMN axfr_first_seen INTEGER;
+    ALTER TABLE domains ADD COLUMN axfr_last_seen INTEGER;
+    ALTER TABLE domains ADD COLUMN crtsh_first_seen INTEGER;
+    ALTER TABLE domains ADD COLUMN crtsh_last_seen INTEGER;
+    ALTER TABLE domains ADD COLUMN import_first_seen INTEGER;
+    ALTER TABLE domains ADD COLUMN import_last_seen INTEGER;
+    """,
+    # 12: nombre de domaines par raison (top_reasons de /api/stats) tenu à jour au fil des écritures:
+    # les triggers notent chaque changement de latest_scan.reasons, appliqué par _apply_reason_changes
+    """
+    CREATE TABLE IF NOT EXISTS reason_counts(
+        reason TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS reason_changes(
+        old_reasons TEXT,
+        new_reasons TEXT
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_latest_reasons_insert AFTER INSERT ON latest_scan
+    WHEN NEW.reasons IS NOT NULL BEGIN
+        INSERT INTO reason_changes(old_reasons, new_reasons) VALUES (NULL, NEW.reasons);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_latest_reasons_update AFTER UPDATE OF reasons ON latest_scan
+    WHEN OLD.reasons IS NOT NEW.reasons BEGIN
+        INSERT INTO reason_changes(old_reasons, new_reasons) VALUES (OLD.reasons, NEW.reasons);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_latest_reasons_delete AFTER DELETE ON latest_scan
+    WHEN OLD.reasons IS NOT NULL BEGIN
+        INSERT INTO reason_changes(old_reasons, new_reasons) VALUES (OLD.reasons, NULL);
+    END;
+
+    INSERT INTO reason_changes(old_reasons, new_reasons)
+    SELECT NULL, reasons FROM latest_scan WHERE reasons IS NOT NULL;
+    """,
+]
+
+# Sources du catalogue: colonnes <source>_first_seen / <source>_last_seen de domains
+SOURCES = ("axfr", "crtsh", "import")
+
+# Cache des statistiques, invalidé quand la génération des scans change
+_stats_cache = {"generation": None, "computed_at": 0.0, "value": None}
+# Recalcul des stats en cours, partagé par les requêtes simultanées
+_stats_refresh = None
+
+
+async def _migrate(db):
+    """Applique les migrations manquantes (une transaction par migration)"""
+    cursor = await db.execute("PRAGMA user_version")
+    version = (await cursor.fetchone())[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        await db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version={number};\nCOMMIT;")
+        print(f"🗄️  Migration du schéma appliquée: v{number}")
+    if version < len(MIGRATIONS):
+        # Comptage initial des raisons (migration 12), hors de la transaction de migration
+        await _apply_reason_changes(db)
+        await db.commit()
 
 
 async def init_db():
     """Initialise la base de données avec les tables nécessaires"""
-    async with aiosqlite.connect(config.DB_FILE) as db:
+    async with _writer_connection() as db:
         await db.execute("""
         CREATE TABLE IF NOT EXISTS domains(
             id INTEGER PRIMARY KEY,
@@ -30,31 +340,349 @@ async def init_db():
         );
         """)
         await db.commit()
+        await _migrate(db)
 
 
-async def add_scan(domain, http_code, headers, sample_head, score, reasons, latency_ms):
-    """Ajoute un résultat de scan dans la base de données"""
-    now = int(time.time())
-    async with aiosqlite.connect(config.DB_FILE) as db:
-        await db.execute("INSERT OR IGNORE INTO domains(domain, created_at) VALUES (?, ?)", (domain, now))
-        cur = await db.execute("SELECT id FROM domains WHERE domain=?", (domain,))
-        domain_id = (await cur.fetchone())[0]
-        await db.execute("""
-            INSERT INTO scans(domain_id, scan_time, http_code, headers, sample_head, score, reasons, latency_ms)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (domain_id, now, http_code, headers, sample_head, score, reasons, latency_ms))
-        await db.commit()
+async def _write_batch(db, rows):
+    """
+    Écrit un lot de résultats dans une seule transaction.
 
+    Voir _apply_rows pour le format des lignes.
+    """
+    await _apply_rows(db, rows)
+    await db.commit()
 
-async def list_scans(limit=200, min_score=0):
-    """Liste les scans avec un score minimum"""
-    async with aiosqlite.connect(config.DB_FILE) as db:
-        q = """
-        SELECT s.id, d.domain, s.scan_time, s.http_code, s.score, s.reasons, s.latency_ms
-        FROM scans s JOIN domains d ON d.id=s.domain_id
-        WHERE s.score>=?
-        ORDER BY s.score DESC, s.scan_time DESC LIMIT ?
-        """
+
+async def _apply_rows(db, rows):
+    """
+    Applique des lignes de résultat dans la transaction en cours (sans commit).
+
+    Chaque ligne a au moins domain, scan_time et score (None si injoignable):
+    - avec headers: scan complet à conserver;
+    - avec same_as: scan inchangé, enregistré par référence au scan same_as;
+    - toutes mettent à jour la planification et les validateurs du domaine;
+    - avec run_id: le domaine est marqué comme terminé pour son run (même
+      transaction que le scan: un domaine marqué a bien été écrit).
+    """
+    scans = [row for row in rows if "headers" in row]
+    if scans:
+        await _insert_scans(db, scans)
+    unchanged = [row for row in rows if row.get("same_as") is not None]
+    if unchanged:
+        await _insert_unchanged(db, unchanged)
+    await _update_schedule(db, rows)
+    done = [row for row in rows if row.get("run_id") is not None]
+    if done:
+        await db.executemany(
+            "INSERT OR IGNORE INTO scan_run_domains(run_id, seq, done_at) VALUES (:run_id, :seq, :scan_time)",
+            done
+        )
+
+
+async def _insert_scans(db, rows):
+    """
+    Insère des résultats dans la transaction en cours (sans commit).
+
+    Le domaine est inséré s'il n'existe pas, puis son id est résolu
+    directement dans l'INSERT des scans (sous-requête), sans SELECT séparé.
+    """
+    await db.executemany(
+        "INSERT OR IGNORE INTO domains(domain, created_at) VALUES (:domain, :scan_time)",
+        rows
+    )
+    await db.executemany("""
+        INSERT INTO scans(domain_id, scan_time, http_code, headers, sample_head, score, reasons, latency_ms,
+                          rules_version, scheme, content_hash)
+        SELECT id, :scan_time, :http_code, :headers, :sample_head, :score, :reasons, :latency_ms,
+               :rules_version, :scheme, :content_hash
+        FROM domains WHERE domain=:domain
+    """, [dict(row, content_hash=row.get("content_hash")) for row in rows])
+    await _bump_generation(db)
+
+
+async def _insert_unchanged(db, rows):
+    """
+    Insère des scans inchangés: score, raisons et empreinte sont copiés du scan
+    de référence, sans headers ni échantillon (lus via same_as).
+    """
+    await db.executemany("""
+        INSERT INTO scans(domain_id, scan_time, http_code, score, reasons, latency_ms,
+                          rules_version, scheme, content_hash, unchanged, same_as)
+        SELECT r.domain_id, :scan_time, r.http_code, r.score, r.reasons, :latency_ms,
+               r.rules_version, r.scheme, r.content_hash, 1, r.id
+        FROM scans r WHERE r.id=:same_as
+    """, rows)
+    await _bump_generation(db)
+
+
+async def _update_schedule(db, rows):
+    """
+    Met à jour l'état de planification des domaines scannés (sans commit).
+
+    Chaque ligne a domain, scan_time et score (None si le domaine était
+    injoignable). Succès: prochain scan dans SCHEDULE_INTERVAL secondes
+    (SCHEDULE_HOT_INTERVAL si le score atteint SCORE_THRESHOLD), raccourci
+    jusqu'à SCHEDULE_CHANGE_WEIGHT selon la probabilité de changement estimée
+    ((changements + 1) / (scans + 2)). Échec: backoff exponentiel à partir de
+    SCHEDULE_FAIL_BACKOFF, plafonné à SCHEDULE_MAX_BACKOFF.
+    """
+    if not rows:
+        return
+    await db.executemany(
+        "INSERT OR IGNORE INTO domains(domain, created_at) VALUES (:domain, :scan_time)",
+        rows
+    )
+    params = {
+        "threshold": config.SCORE_THRESHOLD, "interval": config.SCHEDULE_INTERVAL,
+        "hot_interval": config.SCHEDULE_HOT_INTERVAL, "weight": config.SCHEDULE_CHANGE_WEIGHT,
+    }
+    ok = [dict(params, domain=r["domain"], scan_time=r["scan_time"], score=r["score"],
+               unchanged=r.get("unchanged", 0), content_hash=r.get("content_hash"), etag=r.get("etag"),
+               last_modified=r.get("last_modified"), scheme=r.get("scheme"),
+               rules_version=r.get("rules_version"))
+          for r in rows if r["score"] is not None]
+    # Dans un UPDATE, toutes les expressions lisent les anciennes valeurs de la ligne.
+    # Changement: empreinte différente (ou score différent si l'empreinte est inconnue)
+    changed = """(CASE WHEN :unchanged THEN 0
+                   WHEN content_hash IS NOT NULL AND :content_hash IS NOT NULL THEN content_hash != :content_hash
+                   ELSE last_score IS NOT NULL AND last_score != :score END)"""
+    await db.executemany(f"""
+        UPDATE domains SET
+            last_scan_at = :scan_time,
+            last_score = :score,
+            fail_count = 0,
+            scan_count = scan_count + 1,
+            change_count = change_count + {changed},
+            next_scan_at = :scan_time + CAST(
+                (CASE WHEN :score >= :threshold THEN :hot_interval ELSE :interval END)
+                * (1.0 - :weight * (change_count + {changed} + 1.0) / (scan_count + 3.0))
+                AS INTEGER),
+            etag = CASE WHEN :unchanged THEN COALESCE(:etag, etag) ELSE :etag END,
+            last_modified = CASE WHEN :unchanged THEN COALESCE(:last_modified, last_modified) ELSE :last_modified END,
+            content_hash = CASE WHEN :unchanged THEN content_hash ELSE :content_hash END,
+            rules_version = CASE WHEN :unchanged THEN rules_version ELSE :rules_version END,
+            last_scheme = COALESCE(:scheme, last_scheme),
+            dns_error = NULL,
+            dns_retry_at = NULL
+        WHERE domain = :domain
+    """, ok)
+    # dns_error / dns_retry_at: cache DNS négatif (absents si le domaine a résolu)
+    failed = [{"domain": r["domain"], "scan_time": r["scan_time"], "backoff": config.SCHEDULE_FAIL_BACKOFF,
+               "max_backoff": config.SCHEDULE_MAX_BACKOFF, "dns_error": r.get("dns_error"),
+               "dns_retry_at": r.get("dns_retry_at")}
+              for r in rows if r["score"] is None]
+    await db.executemany("""
+        UPDATE domains SET
+            last_scan_at = :scan_time,
+            fail_count = fail_count + 1,
+            next_scan_at = :scan_time + MIN(:max_backoff, :backoff * (1 << MIN(fail_count, 16))),
+            dns_error = :dns_error,
+            dns_retry_at = :dns_retry_at
+        WHERE domain = :domain
+    """, failed)
+
+
+async def _bump_generation(db):
+    """
+    Signale aux lecteurs (même dans un autre process) que les scans ont
+    changé, et reporte les changements de raisons dans reason_counts (même
+    transaction).
+    """
+    await _apply_reason_changes(db)
+    await db.execute("UPDATE meta SET value=value+1 WHERE key='scans_generation'")
+
+
+async def _apply_reason_changes(db):
+    """
+    Applique à reason_counts les changements de latest_scan.reasons notés par
+    les triggers: les raisons de l'ancienne valeur sont décomptées, celles de
+    la nouvelle comptées. Le coût suit le nombre de domaines modifiés, pas la
+    taille de la table.
+
+    Raisons découpées sur "; ", le détail entre parenthèses est ignoré
+    ("Apache ancien (apache/2.2.3)" -> "Apache ancien").
+    """
+    await db.execute("""
+        WITH RECURSIVE split(rest, label, delta) AS (
+            SELECT reasons || '; ', NULL, delta FROM (
+                SELECT old_reasons AS reasons, -1 AS delta FROM reason_changes
+                UNION ALL
+                SELECT new_reasons, 1 FROM reason_changes
+            ) WHERE reasons IS NOT NULL
+            UNION ALL
+            SELECT substr(rest, instr(rest, '; ') + 2), substr(rest, 1, instr(rest, '; ') - 1), delta
+            FROM split WHERE rest <> ''
+        )
+        INSERT INTO reason_counts(reason, count)
+        SELECT CASE WHEN instr(label, ' (') > 0 THEN substr(label, 1, instr(label, ' (') - 1)
+                    ELSE label END AS reason,
+               SUM(delta)
+        FROM split WHERE label IS NOT NULL AND label <> ''
+        GROUP BY reason
+        ON CONFLICT(reason) DO UPDATE SET count = count + excluded.count
+    """)
+    await db.execute("DELETE FROM reason_changes")
+    await db.execute("DELETE FROM reason_counts WHERE count <= 0")
+
+
+class ScanWriter:
+    """
+    Writer unique et persistant pour les résultats de scan.
+
+    Les résultats sont déposés dans une file asyncio et écrits par lots
+    (toutes les `batch_size` lignes ou toutes les `flush_ms` millisecondes)
+    sur une seule connexion, avec un seul commit par lot.
+    """
+
+    def __init__(self, batch_size=None, flush_ms=None):
+        self.batch_size = batch_size or config.WRITER_BATCH_SIZE
+        self.flush_interval = (flush_ms or config.WRITER_FLUSH_MS) / 1000
+        self.queue = asyncio.Queue(maxsize=self.batch_size * 4)
+        self.written = 0
+        self._db = None
+        self._task = None
+
+    async def start(self):
+        """Ouvre la connexion et lance la tâche d'écriture"""
+        self._db = await _connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, row):
+        """Ajoute un résultat à la file (bloque si la file est pleine)"""
+        if self._task.done():
+            # La tâche d'écriture est morte: remonter son erreur au producteur
+            self._task.result()
+        await self.queue.put(row)
+
+    async def close(self):
+        """Vide la file, écrit le dernier lot et ferme la connexion"""
+        if not self._task.done():
+            await self.queue.put(_STOP)
+        try:
+            await self._task
+        finally:
+            await self._db.close()
+
+    async def _next_batch(self):
+        """Attend le premier élément puis accumule jusqu'à batch_size ou flush_interval"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        item = await self.queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        """Boucle principale du writer"""
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                started = time.monotonic()
+                await _write_batch(self._db, batch)
+                metrics.DB_WRITE_BATCH.observe(time.monotonic() - started)
+                metrics.DB_ROWS.inc(amount=len(batch))
+                self.written += len(batch)
+            except Exception as e:
+                await self._db.rollback()
+                print(f"❌ Erreur d'écriture DB ({len(batch)} résultats perdus): {e}")
+
+
+async def start_writer(batch_size=None, flush_ms=None):
+    """Démarre le writer global utilisé par add_scan"""
+    global _writer
+    _writer = ScanWriter(batch_size, flush_ms)
+    await _writer.start()
+    return _writer
+
+
+async def stop_writer():
+    """Arrête le writer global après avoir écrit les résultats en attente"""
+    global _writer
+    if _writer is None:
+        return
+    writer, _writer = _writer, None
+    await writer.close()
+
+
+def scan_row(domain, http_code, headers, sample_head, score, reasons, latency_ms,
+             rules_version=None, scheme=None):
+    """Ligne de scan au format attendu par _insert_scans"""
+    return {
+        "scan_time": int(time.time()), "domain": domain, "http_code": http_code,
+        "headers": headers, "sample_head": sample_head, "score": score, "reasons": reasons,
+        "latency_ms": latency_ms, "rules_version": rules_version, "scheme": scheme,
+    }
+
+
+async def add_scan(domain, http_code, headers, sample_head, score, reasons, latency_ms,
+                   rules_version=None, scheme=None, run_id=None, seq=None):
+    """
+    Ajoute un résultat de scan dans la base de données.
+
+    Si le writer global est démarré, le résultat est mis en file et écrit
+    dans le prochain lot; sinon il est écrit immédiatement. Avec run_id, le
+    domaine (rang seq dans le fichier) est aussi marqué comme terminé.
+    """
+    row = scan_row(domain, http_code, headers, sample_head, score, reasons, latency_ms,
+                   rules_version, scheme)
+    row["run_id"] = run_id
+    row["seq"] = seq
+    await put_row(row)
+
+
+async def put_row(row):
+    """
+    Envoie une ligne de résultat (format: voir _apply_rows) au writer global,
+    ou l'écrit immédiatement s'il n'est pas démarré.
+    """
+    if _writer is not None:
+        await _writer.put(row)
+        return
+    async with _writer_connection() as db:
+        await _write_batch(db, [row])
+
+
+async def list_scans(limit=200, min_score=0, history=False):
+    """
+    Liste les scans avec un score minimum.
+
+    Par défaut seul le dernier scan de chaque domaine est retourné (table
+    latest_scan); history=True parcourt tout l'historique des scans.
+    """
+    async with _reader() as db:
+        if history:
+            q = """
+            SELECT s.id, d.domain, s.scan_time, s.http_code, s.score, s.reasons, s.latency_ms
+            FROM scans s JOIN domains d ON d.id=s.domain_id
+            WHERE s.score>=?
+            ORDER BY s.score DESC, s.scan_time DESC LIMIT ?
+            """
+        else:
+            q = """
+            SELECT l.scan_id, d.domain, l.scan_time, l.http_code, l.score, l.reasons, l.latency_ms
+            FROM latest_scan l JOIN domains d ON d.id=l.domain_id
+            WHERE l.score>=?
+            ORDER BY l.score DESC, l.scan_time DESC LIMIT ?
+            """
         cursor = await db.execute(q, (min_score, limit))
         rows = await cursor.fetchall()
         return [
@@ -66,10 +694,15 @@ async def list_scans(limit=200, min_score=0):
 
 async def get_scan(scan_id: int):
     """Récupère les détails d'un scan spécifique"""
-    async with aiosqlite.connect(config.DB_FILE) as db:
+    async with _reader() as db:
+        # Un scan inchangé affiche les headers et l'échantillon de son scan de référence
         q = """
-        SELECT s.id, d.domain, s.scan_time, s.http_code, s.score, s.reasons, s.headers, s.sample_head, s.latency_ms
-        FROM scans s JOIN domains d ON d.id=s.domain_id WHERE s.id=?
+        SELECT s.id, d.domain, s.scan_time, s.http_code, s.score, s.reasons,
+               COALESCE(s.headers, r.headers), COALESCE(s.sample_head, r.sample_head), s.latency_ms,
+               s.rules_version, s.unchanged, s.same_as
+        FROM scans s JOIN domains d ON d.id=s.domain_id
+        LEFT JOIN scans r ON r.id=s.same_as
+        WHERE s.id=?
         """
         cursor = await db.execute(q, (scan_id,))
         r = await cursor.fetchone()
@@ -78,5 +711,575 @@ async def get_scan(scan_id: int):
         return {
             "id": r[0], "domain": r[1], "scan_time": r[2], "http_code": r[3], 
             "score": r[4], "reasons": r[5], "headers": r[6], "sample_head": r[7], 
-            "latency_ms": r[8]
+            "latency_ms": r[8], "rules_version": r[9], "unchanged": bool(r[10]), "same_as": r[11]
         }
+
+
+async def _compute_stats(db):
+    """Calcule les statistiques globales directement en SQL"""
+    cursor = await db.execute("SELECT COUNT(*), COALESCE(AVG(score), 0), COALESCE(MAX(score), 0) FROM scans")
+    total_scans, avg_score, max_score = await cursor.fetchone()
+    cursor = await db.execute("SELECT COUNT(*) FROM latest_scan")
+    domains_count = (await cursor.fetchone())[0]
+    # Domaines actifs du catalogue (crt.sh, AXFR, imports): ceux que --schedule peut scanner
+    cursor = await db.execute("SELECT COUNT(*) FROM domains WHERE removed_at IS NULL")
+    catalog_count = (await cursor.fetchone())[0]
+
+    # Histogramme du dernier score de chaque domaine (tranches de STATS_BUCKET_SIZE, arrondi vers le bas)
+    size = config.STATS_BUCKET_SIZE
+    cursor = await db.execute("""
+        SELECT score - (((score % ?) + ?) % ?) AS bucket, COUNT(*)
+        FROM latest_scan GROUP BY bucket ORDER BY bucket
+    """, (size, size, size))
+    histogram = [{"min_score": r[0], "max_score": r[0] + size - 1, "count": r[1]}
+                 for r in await cursor.fetchall()]
+
+    since = int(time.time()) - config.STATS_DAYS * 86400
+    cursor = await db.execute("""
+        SELECT date(scan_time, 'unixepoch') AS day, COUNT(*)
+        FROM scans WHERE scan_time >= ? GROUP BY day ORDER BY day
+    """, (since,))
+    per_day = [{"day": r[0], "count": r[1]} for r in await cursor.fetchall()]
+
+    # Compteurs tenus à jour à chaque écriture (voir _apply_reason_changes)
+    cursor = await db.execute("""
+        SELECT reason, count FROM reason_counts ORDER BY count DESC, reason LIMIT ?
+    """, (config.STATS_TOP_REASONS,))
+    reasons = [{"reason": r[0], "count": r[1]} for r in await cursor.fetchall()]
+
+    return {
+        "total_scans": total_scans,
+        "avg_score": avg_score,
+        "max_score": max_score,
+        "domains_count": domains_count,
+        "catalog_count": catalog_count,
+        "score_histogram": histogram,
+        "scans_per_day": per_day,
+        "top_reasons": reasons,
+    }
+
+
+async def get_stats():
+    """
+    Retourne les statistiques globales des scans.
+
+    Le résultat est mis en cache et recalculé seulement quand le writer a
+    commité de nouveaux scans (compteur scans_generation), et au plus une fois
+    toutes les STATS_MIN_REFRESH secondes pendant un scan en cours. Les
+    requêtes qui arrivent pendant un recalcul attendent celui-ci au lieu d'en
+    lancer un autre.
+    """
+    global _stats_refresh
+    async with _reader() as db:
+        cursor = await db.execute("SELECT value FROM meta WHERE key='scans_generation'")
+        generation = (await cursor.fetchone())[0]
+    cached = _stats_cache["value"]
+    if cached is not None:
+        if generation == _stats_cache["generation"]:
+            return cached
+        if time.monotonic() - _stats_cache["computed_at"] < config.STATS_MIN_REFRESH:
+            return cached
+    if _stats_refresh is None:
+        _stats_refresh = asyncio.ensure_future(_refresh_stats(generation))
+    # shield: une requête annulée (client parti) n'interrompt pas le recalcul partagé
+    return await asyncio.shield(_stats_refresh)
+
+
+async def _refresh_stats(generation):
+    global _stats_refresh
+    try:
+        async with _reader() as db:
+            value = await _compute_stats(db)
+        _stats_cache.update(generation=generation, computed_at=time.monotonic(), value=value)
+        return value
+    finally:
+        _stats_refresh = None
+
+
+def _parse_headers(headers_str):
+    """Reconstruit le dict de headers stocké sous la forme "Nom: valeur" par ligne"""
+    headers = {}
+    for line in (headers_str or "").split("\n"):
+        name, sep, value = line.partition(": ")
+        if sep:
+            headers[name] = value
+    return headers
+
+
+async def iter_stored_scans(chunk_size, outdated_version=None):
+    """
+    Parcourt par lots les scans qui ont un échantillon HTML stocké.
+
+    Pagination par id (keyset): chaque lot est une lecture d'index, quel que
+    soit le nombre de scans. Si outdated_version est donné, seuls les scans
+    scorés avec une autre version des règles sont retournés.
+
+    Yields:
+        Listes de tuples (id, http_code, headers, sample_head, scheme)
+    """
+    last_id = 0
+    version_filter = "AND (rules_version IS NULL OR rules_version <> ?)" if outdated_version else ""
+    async with _reader() as db:
+        while True:
+            params = (last_id, outdated_version, chunk_size) if outdated_version else (last_id, chunk_size)
+            cursor = await db.execute(f"""
+                SELECT id, http_code, headers, sample_head, scheme FROM scans
+                WHERE id > ? AND sample_head IS NOT NULL {version_filter}
+                ORDER BY id LIMIT ?
+            """, params)
+            rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [(r[0], r[1], _parse_headers(r[2]), r[3], r[4]) for r in rows]
+
+
+async def update_scores(rows):
+    """
+    Met à jour score, raisons et version des règles en une seule transaction.
+
+    Args:
+        rows: Liste de tuples (score, reasons, rules_version, scan_id)
+
+    Returns:
+        Nombre de scans dont le score ou les raisons ont changé
+    """
+    async with _writer_connection() as db:
+        cursor = await db.executemany("""
+            UPDATE scans SET score=?1, reasons=?2, rules_version=?3
+            WHERE id=?4 AND (score IS NOT ?1 OR reasons IS NOT ?2 OR rules_version IS NOT ?3)
+        """, rows)
+        changed = cursor.rowcount
+        # Les scans inchangés qui référencent ce scan suivent son score
+        cursor = await db.executemany("""
+            UPDATE scans SET score=?1, reasons=?2, rules_version=?3
+            WHERE same_as=?4 AND (score IS NOT ?1 OR reasons IS NOT ?2 OR rules_version IS NOT ?3)
+        """, rows)
+        changed += cursor.rowcount
+        if changed:
+            await _bump_generation(db)
+        await db.commit()
+    return changed
+
+
+async def enqueue_batches(batches):
+    """
+    Ajoute des lots de domaines à la file de travail distribuée.
+
+    Args:
+        batches: Itérable de listes de domaines (un lot par liste)
+
+    Returns:
+        Nombre de lots ajoutés
+    """
+    now = int(time.time())
+    rows = [("\n".join(domains), len(domains), now) for domains in batches if domains]
+    async with _writer_connection() as db:
+        await db.executemany(
+            "INSERT INTO work_batches(domains, size, created_at) VALUES (?, ?, ?)", rows
+        )
+        await db.commit()
+    return len(rows)
+
+
+async def lease_batch(worker, lease_seconds, max_attempts):
+    """
+    Attribue au worker le plus ancien lot disponible.
+
+    Un lot est disponible s'il est en attente ou si le bail d'un autre worker
+    a expiré (worker mort), tant qu'il n'a pas dépassé max_attempts tentatives.
+    La sélection et la prise du bail se font en une seule requête (atomique).
+
+    Returns:
+        dict (batch_id, domains, lease_expires) ou None si la file est vide
+    """
+    now = int(time.time())
+    async with _writer_connection() as db:
+        cursor = await db.execute("""
+            UPDATE work_batches
+            SET status='leased', worker=?, lease_expires=?, attempts=attempts+1
+            WHERE id = (
+                SELECT id FROM work_batches
+                WHERE (status='pending' OR (status='leased' AND lease_expires < ?)) AND attempts < ?
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, domains, lease_expires
+        """, (worker, now + lease_seconds, now, max_attempts))
+        row = await cursor.fetchone()
+        await cursor.close()
+        await db.commit()
+    if row is None:
+        return None
+    return {"batch_id": row[0], "domains": row[1].split("\n"), "lease_expires": row[2]}
+
+
+async def renew_lease(batch_id, worker, lease_seconds):
+    """Prolonge le bail d'un lot; False si le lot n'est plus attribué à ce worker"""
+    async with _writer_connection() as db:
+        cursor = await db.execute("""
+            UPDATE work_batches SET lease_expires=?
+            WHERE id=? AND worker=? AND status='leased'
+        """, (int(time.time()) + lease_seconds, batch_id, worker))
+        renewed = cursor.rowcount
+        await db.commit()
+    return renewed > 0
+
+
+async def complete_batch(batch_id, worker, rows):
+    """
+    Marque un lot comme terminé et écrit ses résultats dans la même transaction.
+
+    `rows` sont les lignes de résultat de tous les domaines du lot (format:
+    voir _apply_rows).
+
+    Les résultats sont refusés si le lot a été réattribué à un autre worker
+    (bail expiré) ou déjà terminé: il sera scanné une seule fois.
+
+    Returns:
+        True si le lot a été accepté
+    """
+    async with _writer_connection() as db:
+        cursor = await db.execute("""
+            UPDATE work_batches SET status='done', done_at=?
+            WHERE id=? AND worker=? AND status='leased'
+        """, (int(time.time()), batch_id, worker))
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return False
+        await _apply_rows(db, rows)
+        await db.commit()
+    return True
+
+
+async def work_status(max_attempts):
+    """Nombre de lots et de domaines par état de la file de travail"""
+    now = int(time.time())
+    async with _reader() as db:
+        cursor = await db.execute("""
+            SELECT CASE
+                       WHEN status='leased' AND lease_expires < ?1 AND attempts >= ?2 THEN 'failed'
+                       WHEN status='leased' AND lease_expires < ?1 THEN 'expired'
+                       ELSE status
+                   END AS state,
+                   COUNT(*), COALESCE(SUM(size), 0)
+            FROM work_batches GROUP BY state
+        """, (now, max_attempts))
+        rows = await cursor.fetchall()
+    status = {state: {"batches": 0, "domains": 0} for state in ("pending", "leased", "expired", "done", "failed")}
+    for state, batches, domains in rows:
+        status[state] = {"batches": batches, "domains": domains}
+    return status
+
+
+async def start_run(domains_file, file_size, file_mtime):
+    """Enregistre un nouveau run de scan et retourne son id"""
+    async with _writer_connection() as db:
+        cursor = await db.execute("""
+            INSERT INTO scan_runs(domains_file, file_size, file_mtime, started_at)
+            VALUES (?, ?, ?, ?)
+        """, (domains_file, file_size, file_mtime, int(time.time())))
+        run_id = cursor.lastrowid
+        await db.commit()
+    return run_id
+
+
+async def last_unfinished_run(domains_file):
+    """Dernier run non terminé (interrompu ou tué) pour ce fichier, None sinon"""
+    async with _reader() as db:
+        cursor = await db.execute("""
+            SELECT id, file_size, file_mtime, status, started_at
+            FROM scan_runs WHERE domains_file=? ORDER BY id DESC LIMIT 1
+        """, (domains_file,))
+        r = await cursor.fetchone()
+    if r is None or r[3] == "completed":
+        return None
+    return {"id": r[0], "file_size": r[1], "file_mtime": r[2], "status": r[3], "started_at": r[4]}
+
+
+async def resume_run(run_id):
+    """Repasse un run interrompu à l'état running"""
+    async with _writer_connection() as db:
+        await db.execute("UPDATE scan_runs SET status='running', finished_at=NULL WHERE id=?", (run_id,))
+        await db.commit()
+
+
+async def finish_run(run_id, status):
+    """Clôt un run (completed ou interrupted) et compte ses domaines terminés"""
+    async with _writer_connection() as db:
+        await db.execute("""
+            UPDATE scan_runs
+            SET status=?, finished_at=?, scanned=(SELECT COUNT(*) FROM scan_run_domains WHERE run_id=?)
+            WHERE id=?
+        """, (status, int(time.time()), run_id, run_id))
+        await db.commit()
+
+
+async def load_done(run_id):
+    """
+    Domaines déjà terminés d'un run, sous forme de bitmap indexé par seq.
+
+    Un bit par domaine (≈ 300 Ko pour 2,5 millions de domaines) au lieu d'un
+    ensemble de noms.
+
+    Returns:
+        tuple: (bytearray, nombre de domaines terminés)
+    """
+    async with _reader() as db:
+        cursor = await db.execute("SELECT MAX(seq), COUNT(*) FROM scan_run_domains WHERE run_id=?", (run_id,))
+        max_seq, count = await cursor.fetchone()
+        done = bytearray(((max_seq or 0) >> 3) + 1)
+        cursor = await db.execute("SELECT seq FROM scan_run_domains WHERE run_id=?", (run_id,))
+        while True:
+            rows = await cursor.fetchmany(10000)
+            if not rows:
+                break
+            for (seq,) in rows:
+                done[seq >> 3] |= 1 << (seq & 7)
+    return done, count
+
+
+async def apply_zone_diff(changes, chunk_size=10000):
+    """
+    Applique à la table domains le diff entre deux versions d'une zone.
+
+    `changes` produit des (type, domaine), type parmi:
+    - "added": domaine inséré (jamais scanné, donc choisi par next_domains)
+      ou rattaché à la source axfr; un domaine retiré puis revenu est
+      réactivé et dû immédiatement;
+    - "changed": délégation modifiée (serveurs NS), re-scan dû immédiatement
+      et cache DNS négatif oublié;
+    - "removed": marqué retiré (removed_at), plus planifié.
+    Une transaction par paquet de chunk_size changements. Seuls les domaines
+    du diff sont touchés: axfr_last_seen date le dernier changement constaté,
+    et un domaine non retiré est présent dans la zone à la date du dernier
+    diff (meta axfr_synced_at).
+
+    Returns:
+        dict type -> nombre de domaines modifiés
+    """
+    now = int(time.time())
+    counts = {"added": 0, "changed": 0, "removed": 0}
+    async with _writer_connection() as db:
+        chunk = []
+        for kind, domain in changes:
+            chunk.append((kind, domain))
+            if len(chunk) >= chunk_size:
+                await _apply_zone_chunk(db, chunk, now, counts)
+                chunk = []
+        if chunk:
+            await _apply_zone_chunk(db, chunk, now, counts)
+        await db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('axfr_synced_at', ?)", (now,))
+        # Statistiques à recalculer (taille du catalogue)
+        await _bump_generation(db)
+        await db.commit()
+    return counts
+
+
+async def _apply_zone_chunk(db, chunk, now, counts):
+    statements = {
+        "added": """
+            INSERT INTO domains(domain, created_at, axfr_first_seen, axfr_last_seen) VALUES (:domain, :now, :now, :now)
+            ON CONFLICT(domain) DO UPDATE SET
+                axfr_first_seen = COALESCE(axfr_first_seen, :now),
+                axfr_last_seen = :now,
+                next_scan_at = CASE WHEN removed_at IS NOT NULL THEN 0 ELSE next_scan_at END,
+                removed_at = NULL
+        """,
+        "changed": """
+            UPDATE domains SET next_scan_at = 0, dns_error = NULL, dns_retry_at = NULL, axfr_last_seen = :now
+            WHERE domain = :domain AND removed_at IS NULL
+        """,
+        "removed": """
+            UPDATE domains SET removed_at = :now WHERE domain = :domain AND removed_at IS NULL
+        """,
+    }
+    for kind, sql in statements.items():
+        rows = [{"domain": domain, "now": now} for k, domain in chunk if k == kind]
+        if rows:
+            before = db.total_changes
+            await db.executemany(sql, rows)
+            counts[kind] += db.total_changes - before
+    await db.commit()
+
+
+def _source_column(source, suffix):
+    if source not in SOURCES:
+        raise ValueError(f"Source inconnue: {source} (sources: {', '.join(SOURCES)})")
+    return f"{source}_{suffix}"
+
+
+async def ingest_domains(domains, source, chunk_size=None):
+    """
+    Ajoute les domaines d'une source au catalogue (table domains).
+
+    Upsert par paquets de INGEST_CHUNK domaines, un paquet par transaction:
+    les nouveaux domaines sont insérés, les domaines connus sont seulement
+    rattachés à la source (<source>_first_seen conservé, <source>_last_seen
+    mis à jour). Une liste triée (fichiers .dset) donne des écritures
+    localisées dans l'index.
+
+    Returns:
+        dict: {"seen": domaines lus, "added": nouveaux domaines}
+    """
+    first = _source_column(source, "first_seen")
+    last = _source_column(source, "last_seen")
+    chunk_size = chunk_size or config.INGEST_CHUNK
+    sql = f"""
+        INSERT INTO domains(domain, created_at, {first}, {last}) VALUES (?1, ?2, ?2, ?2)
+        ON CONFLICT(domain) DO UPDATE SET {first} = COALESCE({first}, ?2), {last} = ?2
+    """
+    now = int(time.time())
+    stats = {"seen": 0, "added": 0}
+    async with _writer_connection() as db:
+        chunk = []
+        for domain in domains:
+            chunk.append((domain, now))
+            if len(chunk) >= chunk_size:
+                await _ingest_chunk(db, sql, chunk, stats)
+                chunk = []
+        if chunk:
+            await _ingest_chunk(db, sql, chunk, stats)
+        # Statistiques à recalculer (taille du catalogue)
+        await _bump_generation(db)
+        await db.commit()
+    return stats
+
+
+async def _ingest_chunk(db, sql, chunk, stats):
+    # Les nouvelles lignes reçoivent des id au-delà du maximum actuel
+    cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM domains")
+    top = (await cursor.fetchone())[0]
+    await db.executemany(sql, chunk)
+    cursor = await db.execute("SELECT COUNT(*) FROM domains WHERE id > ?", (top,))
+    stats["added"] += (await cursor.fetchone())[0]
+    stats["seen"] += len(chunk)
+    await db.commit()
+
+
+async def iter_catalog(source=None, page_size=None):
+    """
+    Parcourt le catalogue: domaines non retirés, dans l'ordre des id.
+
+    SQLite n'a pas de curseur côté serveur, et une requête gardée ouverte
+    figerait un instantané WAL pendant tout le scan (checkpoints bloqués):
+    la lecture se fait donc par pages de CATALOG_PAGE domaines sur la clé
+    primaire (id > dernier id lu), chaque page dans sa propre lecture.
+
+    Yields:
+        tuple: (id, domaine), filtrés sur une source si `source` est donnée
+    """
+    page_size = page_size or config.CATALOG_PAGE
+    where = f"AND {_source_column(source, 'first_seen')} IS NOT NULL" if source else ""
+    last_id = 0
+    while True:
+        async with _reader() as db:
+            cursor = await db.execute(f"""
+                SELECT id, domain FROM domains
+                WHERE id > ? AND removed_at IS NULL {where}
+                ORDER BY id LIMIT ?
+            """, (last_id, page_size))
+            rows = await cursor.fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+async def catalog_empty():
+    """Vrai si le catalogue n'a aucun domaine actif (requête bornée, pas de comptage)"""
+    async with _reader() as db:
+        cursor = await db.execute("SELECT NOT EXISTS(SELECT 1 FROM domains WHERE removed_at IS NULL)")
+        return bool((await cursor.fetchone())[0])
+
+
+async def catalog_status():
+    """
+    Composition du catalogue.
+
+    Returns:
+        dict: total, actifs, retirés, sans source connue, et par source
+        {"domains": n, "last_seen": date max}; "axfr_synced_at" (dernier
+        diff de zone appliqué) si disponible
+    """
+    columns = ", ".join(
+        f"COUNT({s}_first_seen), MAX({s}_last_seen)" for s in SOURCES
+    )
+    unknown = " AND ".join(f"{s}_first_seen IS NULL" for s in SOURCES)
+    async with _reader() as db:
+        cursor = await db.execute(f"""
+            SELECT COUNT(*), COUNT(removed_at), SUM({unknown}), {columns} FROM domains
+        """)
+        row = await cursor.fetchone()
+        cursor = await db.execute("SELECT value FROM meta WHERE key = 'axfr_synced_at'")
+        synced = await cursor.fetchone()
+    status = {"total": row[0], "active": row[0] - row[1], "removed": row[1], "unknown_source": row[2] or 0,
+              "sources": {}, "axfr_synced_at": synced[0] if synced else None}
+    for i, source in enumerate(SOURCES):
+        status["sources"][source] = {"domains": row[3 + 2 * i], "last_seen": row[4 + 2 * i]}
+    return status
+
+
+async def next_domains(budget, now=None):
+    """
+    Choisit les prochains domaines à scanner pour un budget donné.
+
+    Une part SCHEDULE_RESCAN_SHARE du budget est réservée aux re-scans dus
+    (les plus en retard d'abord: domaines anciens, intéressants ou changeants,
+    échecs après leur backoff); le reste va aux domaines jamais scannés (dans
+    l'ordre d'import), puis de nouveau aux re-scans s'il en reste. Les
+    domaines retirés de la zone (removed_at) ne sont plus choisis.
+
+    Returns:
+        Liste de domaines
+    """
+    now = now or int(time.time())
+    async with _reader() as db:
+        cursor = await db.execute("""
+            SELECT domain FROM domains
+            WHERE last_scan_at IS NOT NULL AND next_scan_at <= ? AND removed_at IS NULL
+            ORDER BY next_scan_at LIMIT ?
+        """, (now, budget))
+        due = [r[0] for r in await cursor.fetchall()]
+        reserved = min(len(due), int(budget * config.SCHEDULE_RESCAN_SHARE))
+        cursor = await db.execute("""
+            SELECT domain FROM domains WHERE last_scan_at IS NULL AND removed_at IS NULL ORDER BY id LIMIT ?
+        """, (budget - reserved,))
+        fresh = [r[0] for r in await cursor.fetchall()]
+    picked = due[:reserved] + fresh
+    picked += due[reserved:reserved + budget - len(picked)]
+    return picked
+
+
+async def domain_states(domains):
+    """
+    État connu des domaines pour un re-scan conditionnel.
+
+    Returns:
+        dict domaine -> {etag, last_modified, content_hash, scheme, score,
+        rules_version, scan_id, dns_error, dns_retry_at}; scan_id est le scan
+        stocké dont le contenu correspond à content_hash (None si le contenu
+        n'a pas été conservé). dns_error est renseigné tant que le domaine est
+        dans le cache DNS négatif (jusqu'à dns_retry_at). Les domaines jamais
+        scannés avec succès et sans erreur DNS en cours sont absents.
+    """
+    if not domains:
+        return {}
+    now = int(time.time())
+    placeholders = ",".join("?" * len(domains))
+    async with _reader() as db:
+        cursor = await db.execute(f"""
+            SELECT d.domain, d.etag, d.last_modified, d.content_hash, d.last_scheme, d.last_score,
+                   d.rules_version, CASE WHEN s.content_hash = d.content_hash THEN COALESCE(s.same_as, s.id) END,
+                   CASE WHEN d.dns_retry_at > ? THEN d.dns_error END, d.dns_retry_at
+            FROM domains d
+            LEFT JOIN latest_scan l ON l.domain_id = d.id
+            LEFT JOIN scans s ON s.id = l.scan_id
+            WHERE d.domain IN ({placeholders}) AND (d.content_hash IS NOT NULL OR d.dns_retry_at > ?)
+        """, [now, *domains, now])
+        rows = await cursor.fetchall()
+    return {
+        r[0]: {"etag": r[1], "last_modified": r[2], "content_hash": r[3], "scheme": r[4], "score": r[5],
+               "rules_version": r[6], "scan_id": r[7], "dns_error": r[8], "dns_retry_at": r[9]}
+        for r in rows
+    }
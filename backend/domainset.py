@@ -0,0 +1,393 @@
+"""
+Format binaire compact des listes de domaines (fichiers .dset).
+
+Les domaines sont triés et codés par préfixe commun (front coding) dans des
+blocs de BLOCK_SIZE entrées: la première entrée d'un bloc est complète, les
+suivantes ne stockent que la longueur du préfixe partagé avec la précédente
+et leur suffixe. Le fichier est lu via mmap:
+
+    en-tête   MAGIC, nombre de domaines, taille des blocs, nombre de blocs,
+              position de l'index (HEADER, little-endian)
+    blocs     entrées en varint (longueur) + octets UTF-8
+    index     position de chaque bloc (uint64 little-endian)
+
+Le nombre de domaines se lit dans l'en-tête (O(1)), l'appartenance est une
+recherche dichotomique sur la première entrée des blocs puis un parcours
+d'au plus BLOCK_SIZE entrées (O(log n)), et l'itération décode les blocs
+au fil de l'eau.
+
+Les fichiers texte (un domaine par ligne, # pour les commentaires) restent
+acceptés partout où une liste de domaines est lue (open_domains,
+count_domains), et convertibles dans les deux sens:
+
+Usage:
+    python -m backend.domainset import domains.txt domains.dset
+    python -m backend.domainset export domains.dset [domains.txt]
+    python -m backend.domainset info domains.dset
+    python -m backend.domainset contains domains.dset exemple.ch [...]
+"""
+
+import argparse
+import contextlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from datetime import datetime
+from backend import config
+
+
+MAGIC = b"DOMSET\x00\x01"
+# magic, nombre de domaines, taille des blocs, nombre de blocs, position de l'index
+HEADER = struct.Struct("<8sQIIQ")
+BLOCK_SIZE = 64
+# Taille du tampon d'écriture
+WRITE_BUFFER = 1 << 20
+
+
+def _varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def _read_varint(data, pos):
+    """(valeur, position suivante) du varint à pos"""
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _shared_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class Writer:
+    """
+    Écriture en flux d'un fichier .dset à partir de domaines triés.
+
+    add() ignore un domaine identique au précédent et lève ValueError si
+    l'ordre n'est pas respecté. Le fichier est écrit sous un nom temporaire
+    et ne remplace la cible qu'à close(); en cas d'exception dans le bloc
+    `with`, la cible n'est pas modifiée.
+    """
+
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.count = 0
+        fd, self._tmp = tempfile.mkstemp(prefix=".dset-", dir=os.path.dirname(os.path.abspath(path)))
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(bytes(HEADER.size))
+        self._position = HEADER.size
+        self._buffer = bytearray()
+        self._offsets = array("Q")
+        self._previous = None
+
+    def add(self, domain):
+        key = domain.encode()
+        previous = self._previous
+        if previous is not None:
+            if key == previous:
+                return
+            if key < previous:
+                raise ValueError(f"Domaines non triés: {domain!r} après {previous.decode()!r}")
+        buffer = self._buffer
+        if self.count % self.block_size == 0:
+            self._offsets.append(self._position + len(buffer))
+            buffer += _varint(len(key))
+            buffer += key
+        else:
+            shared = _shared_prefix(previous, key)
+            buffer += _varint(shared)
+            buffer += _varint(len(key) - shared)
+            buffer += key[shared:]
+        self._previous = key
+        self.count += 1
+        if len(buffer) >= WRITE_BUFFER:
+            self._flush()
+
+    def _flush(self):
+        self._file.write(self._buffer)
+        self._position += len(self._buffer)
+        self._buffer = bytearray()
+
+    def close(self):
+        """Écrit l'index et l'en-tête puis remplace le fichier cible; retourne le nombre de domaines"""
+        self._flush()
+        index_offset = self._position
+        if sys.byteorder != "little":
+            self._offsets.byteswap()
+        self._file.write(self._offsets.tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, self.count, self.block_size, len(self._offsets), index_offset))
+        self._file.close()
+        os.chmod(self._tmp, 0o644)
+        os.replace(self._tmp, self.path)
+        return self.count
+
+    def abort(self):
+        self._file.close()
+        with contextlib.suppress(OSError):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write(path, domains, block_size=BLOCK_SIZE):
+    """
+    Écrit des domaines triés dans un fichier .dset (remplacé atomiquement).
+
+    Returns:
+        int: Nombre de domaines écrits
+    """
+    with Writer(path, block_size) as writer:
+        for domain in domains:
+            writer.add(domain)
+    return writer.count
+
+
+class DomainSet:
+    """
+    Fichier .dset ouvert en lecture via mmap.
+
+    len() lit l'en-tête, `domaine in s` fait une recherche dichotomique,
+    l'itération produit les domaines dans l'ordre sans tout charger.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self._count, self.block_size, self._blocks, self._index = HEADER.unpack_from(self._map)
+        except (ValueError, struct.error):
+            self._file.close()
+            raise ValueError(f"{path}: fichier .dset invalide")
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: fichier .dset invalide")
+
+    def close(self):
+        if not self._file.closed:
+            self._map.close()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _block_offset(self, block):
+        return struct.unpack_from("<Q", self._map, self._index + 8 * block)[0]
+
+    def _first_key(self, block):
+        length, pos = _read_varint(self._map, self._block_offset(block))
+        return self._map[pos:pos + length]
+
+    def _iter_block(self, block):
+        """Clés (bytes) d'un bloc"""
+        data = self._map
+        remaining = min(self.block_size, self._count - block * self.block_size)
+        length, pos = _read_varint(data, self._block_offset(block))
+        key = data[pos:pos + length]
+        pos += length
+        yield key
+        for _ in range(remaining - 1):
+            shared, pos = _read_varint(data, pos)
+            length, pos = _read_varint(data, pos)
+            key = key[:shared] + data[pos:pos + length]
+            pos += length
+            yield key
+
+    def __contains__(self, domain):
+        if not self._blocks:
+            return False
+        key = domain.encode()
+        # Dernier bloc dont la première clé est <= key
+        low, high = 0, self._blocks - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._first_key(middle) <= key:
+                low = middle
+            else:
+                high = middle - 1
+        for candidate in self._iter_block(low):
+            if candidate >= key:
+                return candidate == key
+        return False
+
+    def __iter__(self):
+        for block in range(self._blocks):
+            for key in self._iter_block(block):
+                yield key.decode()
+
+
+def is_domainset(path):
+    """Vrai si le fichier est au format .dset (d'après son en-tête)"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _iter_text(lines):
+    for line in lines:
+        domain = line.strip()
+        if domain and not domain.startswith("#"):
+            yield domain
+
+
+def count_domains(path):
+    """
+    Nombre de domaines d'une liste: lu dans l'en-tête pour un .dset,
+    compté ligne par ligne pour un fichier texte.
+
+    Lève OSError si le fichier est illisible.
+    """
+    if is_domainset(path):
+        with open(path, "rb") as f:
+            return HEADER.unpack(f.read(HEADER.size))[1]
+    with open(path, "r") as f:
+        return sum(1 for _ in _iter_text(f))
+
+
+def default_file():
+    """
+    Liste de domaines par défaut (--domains-file): DOMAINS_FILE, ou
+    l'ancienne liste texte LEGACY_DOMAINS_FILE tant qu'elle n'a pas été
+    convertie (installations antérieures au format .dset).
+    """
+    if not os.path.exists(config.DOMAINS_FILE) and os.path.exists(config.LEGACY_DOMAINS_FILE):
+        print(f"ℹ️  {config.DOMAINS_FILE} absent: lecture de {config.LEGACY_DOMAINS_FILE} "
+              f"(conversion: python -m backend.domainset import {config.LEGACY_DOMAINS_FILE} {config.DOMAINS_FILE})")
+        return config.LEGACY_DOMAINS_FILE
+    return config.DOMAINS_FILE
+
+
+@contextlib.contextmanager
+def open_domains(path):
+    """
+    Ouvre une liste de domaines (.dset ou texte).
+
+    Yields:
+        itérable de lignes: domaines du .dset, ou lignes brutes du fichier
+        texte (commentaires compris, voir scan_ch_sites.iter_domains)
+    """
+    if is_domainset(path):
+        with DomainSet(path) as domains:
+            yield domains
+    else:
+        with open(path, "r") as f:
+            yield f
+
+
+def import_text(source, target, block_size=BLOCK_SIZE):
+    """
+    Convertit une liste texte (dans n'importe quel ordre) en .dset.
+
+    Returns:
+        int: Nombre de domaines distincts écrits
+    """
+    with open(source, "r") as f:
+        domains = sorted(set(_iter_text(f)))
+    return write(target, domains, block_size)
+
+
+def export_text(source, target=None):
+    """
+    Écrit un .dset au format texte (un domaine par ligne, avec en-tête);
+    sur la sortie standard si target est None.
+
+    Returns:
+        int: Nombre de domaines écrits
+    """
+    with DomainSet(source) as domains:
+        out = open(target, "w") if target else contextlib.nullcontext(sys.stdout)
+        with out as f:
+            f.write(f"# Liste de domaines exportée de {os.path.basename(source)}\n")
+            f.write(f"# Généré le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"# Total: {len(domains)} domaines\n")
+            f.write(f"#\n")
+            f.write(f"# Un domaine par ligne\n")
+            f.write(f"\n")
+            for domain in domains:
+                f.write(f"{domain}\n")
+        return len(domains)
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(description='Listes de domaines au format .dset')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_import = sub.add_parser('import', help='Convertit une liste texte en .dset')
+    p_import.add_argument('source', help='Fichier texte (un domaine par ligne)')
+    p_import.add_argument('target', help='Fichier .dset à créer')
+
+    p_export = sub.add_parser('export', help='Convertit un .dset en liste texte')
+    p_export.add_argument('source', help='Fichier .dset')
+    p_export.add_argument('target', nargs='?', help='Fichier texte à créer (défaut: sortie standard)')
+
+    p_info = sub.add_parser('info', help='Affiche le nombre de domaines d\'une liste')
+    p_info.add_argument('path', help='Fichier .dset ou texte')
+
+    p_contains = sub.add_parser('contains', help='Vérifie la présence de domaines dans un .dset')
+    p_contains.add_argument('path', help='Fichier .dset')
+    p_contains.add_argument('domains', nargs='+', help='Domaines à chercher')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'import':
+            count = import_text(args.source, args.target)
+            print(f"✅ {count} domaines écrits dans {args.target}")
+        elif args.command == 'export':
+            count = export_text(args.source, args.target)
+            if args.target:
+                print(f"✅ {count} domaines écrits dans {args.target}")
+        elif args.command == 'info':
+            kind = ".dset" if is_domainset(args.path) else "texte"
+            print(f"📄 {args.path} ({kind}): {count_domains(args.path)} domaines")
+        else:
+            with DomainSet(args.path) as domains:
+                missing = [d for d in args.domains if d not in domains]
+                for domain in args.domains:
+                    print(f"{'✓' if domain not in missing else '✗'} {domain}")
+            sys.exit(1 if missing else 0)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,166 @@
 """
 Script pour récupérer automatiquement tous les domaines .ch via AXFR
-et créer le fichier domains_ch.txt
+et créer le fichier domains_ch.dset
+
+La table domains de la base ne reçoit que le diff avec le transfert
+précédent (ajouts, retraits, délégations modifiées), calculé par fusion avec
+l'instantané trié SNAPSHOT_FILE.
 """
 
+import asyncio
+import heapq
+import sqlite3
 import subprocess
 import sys
 import os
-from datetime import datetime
+import tempfile
+import threading
+from backend import db, domainset
+
+
+# Durée maximale d'un transfert AXFR (la zone .ch complète prend plusieurs minutes)
+AXFR_TIMEOUT = 1800
+# Domaines distincts gardés en mémoire avant d'écrire une portion triée sur disque
+SORT_CHUNK = 500_000
+# Affichage de la progression tous les N domaines
+PROGRESS_EVERY = 250_000
+# Instantané trié de la dernière zone transférée (domaine et serveurs NS), base du diff
+SNAPSHOT_FILE = "zone_ch.snapshot"
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
+
+
+def iter_axfr_zone(zone="ch", nameserver="zonedata.switch.ch"):
+    """
+    Lit la sortie de dig au fil du transfert AXFR et produit les délégations.
+
+    Aucune copie de la zone n'est gardée: les enregistrements d'un même nom
+    étant consécutifs dans un transfert, chaque nom n'est produit qu'une fois
+    par série ayant des enregistrements NS, avec ses serveurs (un nom peut
+    réapparaître plus loin, voir save_zone).
+
+    Lève RuntimeError si le transfert échoue, même après des domaines produits.
+
+    Yields:
+        tuple: (domaine de second niveau, serveurs NS triés séparés par des espaces)
+    """
+    cmd = ["dig", f"@{nameserver}", zone, "AXFR", "+noall", "+answer"]
+    print(f"   Commande: {' '.join(cmd)}")
 
+    suffix = f".{zone}."
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, bufsize=1 << 20)
+    timed_out = threading.Event()
 
-def try_axfr_transfer(zone="ch", nameserver="zonedata.switch.ch"):
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    def delegation(owner, servers):
+        # Ne garder que les domaines .ch délégués (pas les sous-domaines ni les
+        # noms techniques sans NS, comme les empreintes NSEC3 d'une zone signée)
+        if servers and owner.endswith(suffix) and owner.count('.') == 2:
+            name = owner[:-len(suffix)]
+            if name and not name.startswith('_'):
+                return f"{name}.{zone}", " ".join(sorted(servers))
+        return None
+
+    timer = threading.Timer(AXFR_TIMEOUT, kill)
+    timer.start()
+    try:
+        owner = None
+        servers = set()
+        failure = None
+        for line in process.stdout:
+            if line.startswith(';'):
+                # dig signale l'échec dans la sortie ("; Transfer failed.")
+                if 'failed' in line.lower():
+                    failure = line.strip('; \n')
+                continue
+            parts = line.split()
+            if not parts:
+                continue
+            name = parts[0].lower()
+            if name != owner:
+                record = delegation(owner, servers)
+                if record:
+                    yield record
+                owner = name
+                servers = set()
+            # owner TTL classe type données
+            if len(parts) >= 5 and parts[3].upper() == 'NS':
+                servers.add(parts[4].lower().rstrip('.'))
+        record = delegation(owner, servers)
+
+        returncode = process.wait()
+        if timed_out.is_set():
+            raise RuntimeError("timeout")
+        if returncode != 0:
+            raise RuntimeError(f"code {returncode}: {process.stderr.read()[:200].strip()}")
+        if failure:
+            raise RuntimeError(failure)
+        if record:
+            yield record
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def try_axfr_transfer(zone="ch", nameserver="zonedata.switch.ch", filename="domains_ch.dset"):
     """
     Tente un transfert de zone AXFR pour récupérer tous les domaines .ch
-    
+
+    Les domaines sont écrits au fil du transfert (voir save_zone): la mémoire
+    utilisée ne dépend pas de la taille de la zone. Le fichier existant n'est
+    remplacé que si le transfert aboutit; la table domains reçoit alors le
+    diff avec le transfert précédent.
+
     Args:
         zone: Zone DNS à transférer (défaut: "ch")
         nameserver: Serveur DNS à interroger (défaut: "zonedata.switch.ch")
-    
+        filename: Fichier de sortie
+
     Returns:
-        list: Liste des domaines trouvés, ou None si échec
+        int: Nombre de domaines sauvegardés, ou None si échec
     """
     print(f"🔍 Tentative de transfert AXFR depuis {nameserver} pour la zone .{zone}")
-    
+
     try:
-        # Commande dig pour AXFR
-        cmd = ["dig", f"@{nameserver}", zone, "AXFR", "+noall", "+answer"]
-        
-        print(f"   Commande: {' '.join(cmd)}")
-        
-        # Exécuter la commande
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minutes max
-        )
-        
-        if result.returncode != 0:
-            print(f"❌ Échec AXFR (code {result.returncode})")
-            if result.stderr:
-                print(f"   Erreur: {result.stderr[:200]}")
-            return None
-        
-        # Parser la sortie pour extraire les domaines
-        domains = set()
-        lines = result.stdout.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith(';'):
-                continue
-            
-            parts = line.split()
-            if len(parts) >= 1:
-                domain = parts[0].rstrip('.')
-                # Ne garder que les domaines .ch (pas les sous-domaines)
-                if domain.endswith(f'.{zone}') and domain.count('.') == 1:
-                    # Extraire juste le nom de domaine
-                    domain_name = domain.replace(f'.{zone}', '')
-                    if domain_name and not domain_name.startswith('_'):
-                        domains.add(f"{domain_name}.{zone}")
-        
-        if domains:
-            print(f"✅ AXFR réussi: {len(domains)} domaines .{zone} trouvés")
-            return sorted(list(domains))
+        count = save_zone(iter_axfr_zone(zone, nameserver), filename)
+    except RuntimeError as e:
+        if str(e) == "timeout":
+            print(f"⏱️  Timeout: Le transfert AXFR a pris trop de temps")
         else:
-            print(f"⚠️  AXFR retourné mais aucun domaine trouvé")
-            return None
-            
-    except subprocess.TimeoutExpired:
-        print(f"⏱️  Timeout: Le transfert AXFR a pris trop de temps")
+            print(f"❌ Échec AXFR ({e})")
         return None
     except FileNotFoundError:
         print(f"❌ Erreur: La commande 'dig' n'est pas installée")
         print(f"   Installez-la avec: sudo apt install dnsutils")
         return None
+    except sqlite3.Error:
+        # Un autre serveur AXFR n'y changerait rien
+        raise
     except Exception as e:
         print(f"❌ Erreur inattendue: {e}")
         return None
 
+    if count:
+        print(f"✅ AXFR réussi: {count} domaines .{zone} trouvés")
+        return count
+    print(f"⚠️  AXFR retourné mais aucun domaine trouvé")
+    return None
+
 
-def try_alternative_sources():
+def try_alternative_sources(filename="domains_ch.dset"):
     """
     Tente des sources alternatives pour récupérer des domaines .ch
     
     Returns:
-        list: Liste des domaines trouvés, ou None si échec
+        int: Nombre de domaines sauvegardés, ou None si échec
     """
     print("🔄 Tentative de sources alternatives...")
     
@@ -103,65 +178,186 @@ def try_alternative_sources():
     
     for server in alternative_servers:
         print(f"   Essai avec {server}...")
-        domains = try_axfr_transfer(zone="ch", nameserver=server)
-        if domains:
-            return domains
+        count = try_axfr_transfer(zone="ch", nameserver=server, filename=filename)
+        if count:
+            return count
     
     print("❌ Toutes les sources alternatives ont échoué")
     return None
 
 
-def save_domains_to_file(domains, filename="domains_ch.txt"):
+def _merge_servers(a, b):
+    """Union de deux listes de serveurs NS (chaînes triées séparées par des espaces)"""
+    if not a or a == b:
+        return b or a
+    if not b:
+        return a
+    return " ".join(sorted(set(a.split()) | set(b.split())))
+
+
+def _write_run(chunk, directory):
+    """Écrit une portion triée de délégations dans un fichier temporaire; retourne son chemin"""
+    fd, path = tempfile.mkstemp(prefix=".run-", dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        for domain in sorted(chunk):
+            f.write(f"{domain}\t{chunk[domain]}\n")
+    return path
+
+
+def read_zone(path):
     """
-    Sauvegarde la liste de domaines dans un fichier
-    
+    Délégations d'un fichier trié (portion de tri ou instantané de zone).
+
+    Yields:
+        tuple: (domaine, serveurs NS); rien si le fichier n'existe pas
+    """
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            domain, _, servers = line.rstrip('\n').partition('\t')
+            yield domain, servers
+
+
+def _merge_runs(paths):
+    """Fusionne des portions triées: une délégation par domaine (serveurs NS réunis)"""
+    current = None
+    for domain, servers in heapq.merge(*(read_zone(p) for p in paths)):
+        if current is not None and current[0] == domain:
+            current = (domain, _merge_servers(current[1], servers))
+            continue
+        if current is not None:
+            yield current
+        current = (domain, servers)
+    if current is not None:
+        yield current
+
+
+def iter_zone_diff(old, new):
+    """
+    Diff par fusion de deux zones triées par domaine.
+
     Args:
-        domains: Liste des domaines
-        filename: Nom du fichier de sortie
+        old, new: itérables de (domaine, serveurs NS), triés par domaine
+
+    Yields:
+        tuple: ("added" | "removed" | "changed", domaine); "changed" quand
+        les serveurs NS de la délégation ont changé
     """
-    filepath = os.path.join(os.path.dirname(os.path.dirname(__file__)), filename)
-    
+    old = iter(old)
+    new = iter(new)
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield "removed", a[0]
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield "added", b[0]
+            b = next(new, None)
+        else:
+            if a[1] != b[1]:
+                yield "changed", b[0]
+            a = next(old, None)
+            b = next(new, None)
+
+
+async def _apply_diff(changes):
+    await db.init_db()
+    return await db.apply_zone_diff(changes)
+
+
+def save_zone(records, filename="domains_ch.dset", snapshot=SNAPSHOT_FILE):
+    """
+    Sauvegarde une zone: liste de domaines, instantané et diff en base.
+
+    `records` peut être un générateur: les délégations sont dédoublonnées par
+    portions de SORT_CHUNK écrites triées sur disque, puis fusionnées (tri
+    externe). Pendant la fusion, la zone est comparée à l'instantané du
+    transfert précédent (iter_zone_diff) et seuls les changements sont
+    appliqués à la table domains (db.apply_zone_diff). Le fichier de domaines
+    (.dset, voir backend/domainset.py) et le nouvel instantané sont écrits sous
+    un nom temporaire et ne remplacent les anciens qu'à la fin: si `records`
+    lève une exception, rien n'est modifié et l'exception est propagée.
+
+    Args:
+        records: (domaine, serveurs NS) (itérable)
+        filename: Nom du fichier de domaines
+        snapshot: Nom du fichier d'instantané
+
+    Returns:
+        int: Nombre de domaines sauvegardés (0 si aucun: fichiers inchangés)
+    """
+    filepath = os.path.join(PROJECT_ROOT, filename)
+    snapshot_path = os.path.join(PROJECT_ROOT, snapshot)
+    directory = os.path.dirname(os.path.abspath(filepath))
+    runs = []
+    temporary = []
     try:
-        with open(filepath, 'w') as f:
-            # Header avec info
-            f.write(f"# Liste de domaines .ch\n")
-            f.write(f"# Généré automatiquement le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"# Total: {len(domains)} domaines\n")
-            f.write(f"#\n")
-            f.write(f"# Un domaine par ligne\n")
-            f.write(f"# Les lignes commençant par # sont ignorées\n")
-            f.write(f"\n")
-            
-            # Domaines
-            for domain in domains:
-                f.write(f"{domain}\n")
-        
+        chunk = {}
+        seen = 0
+        for domain, servers in records:
+            chunk[domain] = _merge_servers(chunk.get(domain), servers)
+            seen += 1
+            if seen % PROGRESS_EVERY == 0:
+                print(f"   … {seen} domaines reçus")
+            if len(chunk) >= SORT_CHUNK:
+                runs.append(_write_run(chunk, directory))
+                chunk = {}
+        if chunk:
+            runs.append(_write_run(chunk, directory))
+            chunk = None
+        if not runs:
+            return 0
+
+        snapshot_fd, tmp_snapshot = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+        temporary.append(tmp_snapshot)
+        if not os.path.exists(snapshot_path):
+            print(f"📸 Pas d'instantané précédent ({snapshot}): toute la zone est ajoutée à la base")
+        with domainset.Writer(filepath) as writer, os.fdopen(snapshot_fd, 'w') as s:
+
+            def zone():
+                # Domaines écrits au fil de la fusion, pendant le diff
+                for domain, servers in _merge_runs(runs):
+                    writer.add(domain)
+                    s.write(f"{domain}\t{servers}\n")
+                    yield domain, servers
+
+            changes = asyncio.run(_apply_diff(iter_zone_diff(read_zone(snapshot_path), zone())))
+        count = writer.count
+        os.chmod(tmp_snapshot, 0o644)
+        os.replace(tmp_snapshot, snapshot_path)
+        temporary = []
+
         print(f"✅ Fichier créé: {filepath}")
-        print(f"   {len(domains)} domaines sauvegardés")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Erreur lors de la sauvegarde: {e}")
-        return False
+        print(f"   {count} domaines sauvegardés")
+        print(f"🔀 Diff avec le transfert précédent: {changes['added']} ajoutés, "
+              f"{changes['removed']} retirés, {changes['changed']} délégations modifiées")
+        return count
+    finally:
+        for path in runs + temporary:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
-def check_existing_file(filename="domains_ch.txt"):
+def check_existing_file(filename="domains_ch.dset"):
     """
     Vérifie si un fichier de domaines existe déjà
     
     Returns:
         tuple: (existe, nombre_de_domaines)
     """
-    filepath = os.path.join(os.path.dirname(os.path.dirname(__file__)), filename)
+    filepath = os.path.join(PROJECT_ROOT, filename)
     
     if not os.path.exists(filepath):
         return False, 0
     
     try:
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            domains = [l.strip() for l in lines if l.strip() and not l.startswith('#')]
-            return True, len(domains)
+        return True, domainset.count_domains(filepath)
     except:
         return True, 0
 
@@ -176,20 +372,20 @@ def main():
     # Vérifier si un fichier existe déjà
     exists, count = check_existing_file()
     if exists:
-        print(f"ℹ️  Un fichier domains_ch.txt existe déjà ({count} domaines)")
+        print(f"ℹ️  Un fichier domains_ch.dset existe déjà ({count} domaines)")
         print(f"   Il sera remplacé si la récupération réussit")
         print()
     
-    # Tentative 1: AXFR sur zonedata.switch.ch
-    domains = try_axfr_transfer(zone="ch", nameserver="zonedata.switch.ch")
+    # Tentative 1: AXFR sur zonedata.switch.ch (écrit domains_ch.dset au fil du transfert)
+    total = try_axfr_transfer(zone="ch", nameserver="zonedata.switch.ch")
     
     # Tentative 2: Sources alternatives
-    if not domains:
+    if not total:
         print()
-        domains = try_alternative_sources()
+        total = try_alternative_sources()
     
     # Si échec complet
-    if not domains:
+    if not total:
         print()
         print("=" * 80)
         print("❌ ÉCHEC: Impossible de récupérer les domaines .ch")
@@ -201,35 +397,28 @@ def main():
             print(f"   Le scanner pourra utiliser cette liste")
             sys.exit(0)  # Exit 0 pour ne pas bloquer le pipeline
         else:
-            print("⚠️  Aucun fichier domains_ch.txt disponible")
+            print("⚠️  Aucun fichier domains_ch.dset disponible")
             print()
             print("Solutions:")
             print("  1. Installer dig: sudo apt install dnsutils")
             print("  2. Vérifier la connectivité réseau")
-            print("  3. Créer manuellement domains_ch.txt")
+            print("  3. Créer manuellement une liste (texte, puis python -m backend.domainset import)")
             print("  4. Utiliser une liste de domaines d'une autre source")
             sys.exit(1)
     
-    # Sauvegarder les domaines
     print()
-    if save_domains_to_file(domains):
-        print()
-        print("=" * 80)
-        print("✅ SUCCÈS: Domaines .ch récupérés et sauvegardés")
-        print("=" * 80)
-        print()
-        print(f"📊 Statistiques:")
-        print(f"   - Domaines trouvés: {len(domains)}")
-        print(f"   - Fichier: domains_ch.txt")
-        print()
-        print("🚀 Prochaine étape:")
-        print("   python -m backend.scan_ch_sites --limit 100")
-        print()
-        sys.exit(0)
-    else:
-        print()
-        print("❌ Échec de la sauvegarde")
-        sys.exit(1)
+    print("=" * 80)
+    print("✅ SUCCÈS: Domaines .ch récupérés et sauvegardés")
+    print("=" * 80)
+    print()
+    print(f"📊 Statistiques:")
+    print(f"   - Domaines trouvés: {total}")
+    print(f"   - Fichier: domains_ch.dset")
+    print()
+    print("🚀 Prochaine étape:")
+    print("   python -m backend.scan_ch_sites --limit 100")
+    print()
+    sys.exit(0)
 
 
 if __name__ == "__main__":
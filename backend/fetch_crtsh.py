@@ -5,20 +5,32 @@ Module pour récupérer automatiquement les domaines .ch depuis crt.sh (Certific
 import asyncio
 import aiohttp
 import aiofiles
+import codecs
 import re
 import json
 import os
-from datetime import datetime
-from typing import Set, List
-import socket
+import random
+from datetime import date, datetime, timedelta
+from typing import Set, List, Tuple
+from backend import db, domainset
+from backend.resolver import NEGATIVE_ERRORS, DNSResolver
 
 
 # Configuration
 YEARS = list(range(2020, 2026))  # 2020 à 2025
-OUTFILE = "domains_final.txt"
+OUTFILE = "domains_final.dset"
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 OUTPUT_PATH = os.path.join(PROJECT_ROOT, OUTFILE)
 CRTSH_BASE_URL = "https://crt.sh/"
+CHUNK_SIZE = 64 * 1024  # Lecture de la réponse JSON par morceaux
+MAX_ELEMENT_BYTES = 1024 * 1024  # Taille maximale d'un élément du tableau JSON (au-delà: réponse rejetée)
+CRTSH_TIMEOUT = 120  # Secondes par requête (une fenêtre)
+CRTSH_CONCURRENCY = 3  # Requêtes simultanées vers crt.sh
+CRTSH_RETRIES = 4  # Nouveaux essais d'une fenêtre (erreurs qui ne justifient pas un découpage)
+CRTSH_BACKOFF = 5.0  # Attente avant le premier nouvel essai, doublée ensuite (avec jitter)
+CRTSH_MAX_BACKOFF = 120.0
+CACHE_DIR = os.path.join(PROJECT_ROOT, ".crtsh_cache")  # Fenêtres terminées (une liste de domaines par fichier)
+CACHE_SETTLE_DAYS = 7  # Fenêtres plus récentes non mises en cache (certificats encore en cours d'ajout aux logs)
 
 
 def clean_domain(raw_domain: str) -> str:
@@ -70,51 +82,161 @@ def clean_domain(raw_domain: str) -> str:
     return domain
 
 
-async def fetch_crtsh_year(session: aiohttp.ClientSession, year: int) -> Set[str]:
+def _truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+    """Vrai si l'erreur de décodage vient de la fin des données reçues (élément incomplet)"""
+    if error.msg.startswith("Unterminated string"):
+        # Signalée au début de la chaîne
+        return True
+    # Littéral (nu, fals...) ou échappement (\u00) coupé: signalé à son début, à quelques caractères de la fin
+    return len(buffer) - error.pos <= 10
+
+
+async def iter_json_array(stream: aiohttp.StreamReader, chunk_size: int = CHUNK_SIZE,
+                          max_element: int = MAX_ELEMENT_BYTES):
     """
-    Récupère les domaines .ch pour une année donnée depuis crt.sh
+    Parcourt les éléments d'un tableau JSON au fil de la réception
+    
+    Le flux est décodé par morceaux de chunk_size octets et chaque élément est
+    décodé dès qu'il est complet (json.JSONDecoder.raw_decode): la mémoire
+    utilisée ne dépend que de la taille d'un élément, pas de la réponse. Un
+    élément de plus de max_element caractères, ou une erreur de syntaxe avant
+    la fin des données reçues, rejette la réponse sans lire la suite.
+    
+    Args:
+        stream: Body de la réponse (response.content)
+        chunk_size: Taille des lectures
+        max_element: Taille maximale d'un élément
+    
+    Yields:
+        Éléments du tableau
+    
+    Raises:
+        ValueError: si le flux n'est pas un tableau JSON valide
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n":
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != "[":
+                    raise ValueError("Le flux JSON n'est pas un tableau")
+                started = True
+                pos += 1
+                continue
+            if char == "]":
+                return
+            if char == ",":
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Élément incomplet: lire la suite (erreur si le flux est terminé)
+                if eof or not _truncated(e, buffer):
+                    raise ValueError(f"JSON invalide: {buffer[pos:pos + 80]!r}")
+            else:
+                # Complet seulement s'il est suivi d'un séparateur (un nombre peut être tronqué)
+                if eof or (end < len(buffer) and buffer[end] in ",] \t\r\n"):
+                    pos = end
+                    yield item
+                    continue
+        elif eof:
+            raise ValueError("Tableau JSON non terminé")
+        if len(buffer) - pos > max_element:
+            raise ValueError(f"Élément JSON de plus de {max_element} caractères")
+        
+        chunk = await stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+
+class CrtshError(Exception):
+    """Réponse inexploitable de crt.sh (split=True: une fenêtre plus petite a des chances de passer)"""
+    
+    def __init__(self, message: str, split: bool):
+        super().__init__(message)
+        self.split = split
+
+
+def month_windows(year: int) -> List[Tuple[date, date]]:
+    """Fenêtres mensuelles (bornes incluses) d'une année"""
+    windows = []
+    for month in range(1, 13):
+        start = date(year, month, 1)
+        end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        windows.append((start, end))
+    return windows
+
+
+def _cache_path(start: date, end: date) -> str:
+    return os.path.join(CACHE_DIR, f"{start}_{end}.txt")
+
+
+async def _read_cache(path: str) -> Set[str]:
+    async with aiofiles.open(path, 'r') as f:
+        return {line.strip() for line in (await f.read()).splitlines() if line.strip()}
+
+
+async def _write_cache(path: str, domains: Set[str]):
+    """Écrit une fenêtre terminée dans le cache (fichier temporaire puis renommage atomique)"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    async with aiofiles.open(tmp_path, 'w') as f:
+        await f.write("".join(f"{domain}\n" for domain in sorted(domains)))
+    os.replace(tmp_path, path)
+
+
+def _backoff(attempt: int) -> float:
+    """Attente avant le nouvel essai n°attempt: exponentielle avec jitter (±50%)"""
+    return min(CRTSH_MAX_BACKOFF, CRTSH_BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+async def fetch_crtsh_window(session: aiohttp.ClientSession, start: date, end: date) -> Set[str]:
+    """
+    Récupère les domaines .ch des certificats émis entre start et end (inclus)
+    
+    La réponse est lue en streaming: chaque name_value est nettoyé et
+    dédoublonné dès sa réception.
     
     Args:
         session: Session aiohttp
-        year: Année à interroger
+        start: Premier jour de la fenêtre
+        end: Dernier jour de la fenêtre
     
     Returns:
         Set de domaines trouvés
-    """
-    domains = set()
     
-    # Requête pour l'année
-    # Format: https://crt.sh/?q=%.ch&output=json&minNotBefore=2024-01-01&maxNotBefore=2024-12-31
+    Raises:
+        CrtshError: code HTTP différent de 200 ou JSON tronqué / invalide
+        asyncio.TimeoutError, aiohttp.ClientError: erreurs réseau
+    """
+    # Format: https://crt.sh/?q=%.ch&output=json&minNotBefore=2024-01-01&maxNotBefore=2024-01-31
     params = {
         'q': '%.ch',
         'output': 'json',
-        'minNotBefore': f'{year}-01-01',
-        'maxNotBefore': f'{year}-12-31'
+        'minNotBefore': start.isoformat(),
+        'maxNotBefore': end.isoformat()
     }
+    found = set()
     
-    print(f"🔍 Interrogation crt.sh pour l'année {year}...")
-    
-    try:
-        async with session.get(CRTSH_BASE_URL, params=params, timeout=aiohttp.ClientTimeout(total=120)) as response:
-            if response.status != 200:
-                print(f"   ⚠️  Erreur HTTP {response.status} pour {year}")
-                return domains
-            
-            text = await response.text()
-            
-            # Parser le JSON
-            try:
-                data = json.loads(text)
-            except json.JSONDecodeError:
-                print(f"   ⚠️  Erreur de parsing JSON pour {year}")
-                return domains
-            
-            if not isinstance(data, list):
-                print(f"   ⚠️  Format inattendu pour {year}")
-                return domains
-            
-            # Extraire les domaines
-            for entry in data:
+    async with session.get(CRTSH_BASE_URL, params=params, timeout=aiohttp.ClientTimeout(total=CRTSH_TIMEOUT)) as response:
+        if response.status != 200:
+            # 502/503/504: requête trop lourde pour crt.sh (timeout de sa base)
+            raise CrtshError(f"HTTP {response.status}", split=response.status in (502, 503, 504))
+        
+        # Extraire les domaines au fil du flux JSON
+        try:
+            async for entry in iter_json_array(response.content):
                 if not isinstance(entry, dict):
                     continue
                 
@@ -125,34 +247,129 @@ async def fetch_crtsh_year(session: aiohttp.ClientSession, year: int) -> Set[str
                 for raw_domain in raw_domains.split('\n'):
                     cleaned = clean_domain(raw_domain)
                     if cleaned:
-                        domains.add(cleaned)
-            
-            print(f"   ✅ {year}: {len(domains)} domaines trouvés")
-            
-    except asyncio.TimeoutError:
-        print(f"   ⏱️  Timeout pour {year}")
-    except Exception as e:
-        print(f"   ❌ Erreur pour {year}: {e}")
+                        found.add(cleaned)
+        except ValueError as e:
+            # Réponse coupée en cours de route (fréquent sur les grosses fenêtres)
+            raise CrtshError(f"JSON invalide: {e}", split=True)
+    
+    return found
+
+
+async def fetch_window(session: aiohttp.ClientSession, start: date, end: date,
+                       domains: Set[str], semaphore: asyncio.Semaphore) -> int:
+    """
+    Récupère une fenêtre avec cache disque, nouveaux essais et découpage
+    
+    Une fenêtre déjà en cache n'est pas redemandée. Sur un timeout, un 502/503/504
+    ou une réponse tronquée, la fenêtre est coupée en deux (jusqu'à un jour); les
+    autres erreurs sont réessayées CRTSH_RETRIES fois avec un backoff exponentiel.
+    Au plus CRTSH_CONCURRENCY requêtes sont en cours (semaphore).
+    
+    Args:
+        session: Session aiohttp
+        start: Premier jour de la fenêtre
+        end: Dernier jour de la fenêtre
+        domains: Set à compléter
+        semaphore: Limite de requêtes simultanées vers crt.sh
+    
+    Returns:
+        Nombre de fenêtres qui n'ont pas pu être récupérées
+    """
+    label = f"{start} → {end}"
+    cache_path = _cache_path(start, end)
+    if os.path.exists(cache_path):
+        found = await _read_cache(cache_path)
+        domains |= found
+        print(f"   💾 {label}: {len(found)} domaines (cache)")
+        return 0
+    
+    for attempt in range(CRTSH_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(_backoff(attempt))
+        try:
+            async with semaphore:
+                found = await fetch_crtsh_window(session, start, end)
+        except (asyncio.TimeoutError, CrtshError, aiohttp.ClientError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                reason, split = "Timeout", True
+            elif isinstance(e, CrtshError):
+                reason, split = str(e), e.split
+            else:
+                reason, split = f"Erreur {type(e).__name__}", isinstance(e, aiohttp.ClientPayloadError)
+            if split and end > start:
+                middle = start + timedelta(days=(end - start).days // 2)
+                print(f"   ✂️  {label}: {reason}, découpage en deux")
+                halves = [(start, middle), (middle + timedelta(days=1), end)]
+                failed = await asyncio.gather(*(fetch_window(session, a, b, domains, semaphore) for a, b in halves))
+                # Regrouper le cache des deux moitiés: un nouveau run ne retentera pas la fenêtre entière
+                paths = [_cache_path(a, b) for a, b in halves]
+                if all(os.path.exists(path) for path in paths):
+                    merged = set()
+                    for path in paths:
+                        merged |= await _read_cache(path)
+                    await _write_cache(cache_path, merged)
+                    for path in paths:
+                        os.remove(path)
+                return sum(failed)
+            print(f"   ⚠️  {label}: {reason} (essai {attempt + 1}/{CRTSH_RETRIES + 1})")
+            continue
+        
+        new = sum(1 for domain in found if domain not in domains)
+        domains |= found
+        # Les certificats récents peuvent encore arriver dans les logs: pas de cache
+        if end < date.today() - timedelta(days=CACHE_SETTLE_DAYS):
+            await _write_cache(cache_path, found)
+        print(f"   ✅ {label}: {len(found)} domaines, {new} nouveaux")
+        return 0
+    
+    print(f"   ❌ {label}: abandon après {CRTSH_RETRIES + 1} essais")
+    return 1
+
+
+async def fetch_crtsh_year(session: aiohttp.ClientSession, year: int, domains: Set[str] = None,
+                           semaphore: asyncio.Semaphore = None) -> Set[str]:
+    """
+    Récupère les domaines .ch pour une année donnée depuis crt.sh
+    
+    L'année est interrogée par fenêtres mensuelles (voir fetch_window): une
+    requête par année dépasse régulièrement les timeouts de crt.sh.
+    
+    Args:
+        session: Session aiohttp
+        year: Année à interroger
+        domains: Set à compléter (partagé entre les années pour ne garder chaque domaine qu'une fois)
+        semaphore: Limite de requêtes simultanées (partagée entre les années)
+    
+    Returns:
+        Set de domaines trouvés (domains s'il est fourni)
+    """
+    if domains is None:
+        domains = set()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(CRTSH_CONCURRENCY)
+    
+    print(f"🔍 Interrogation crt.sh pour l'année {year}...")
+    failed = await asyncio.gather(*(fetch_window(session, start, end, domains, semaphore)
+                                    for start, end in month_windows(year)))
+    if sum(failed):
+        print(f"   ⚠️  {year}: {sum(failed)} fenêtre(s) non récupérée(s), relancer pour les compléter")
     
     return domains
 
 
-async def verify_domain_dns(domain: str) -> bool:
+async def verify_domains_dns(domains: List[str], resolver: DNSResolver) -> Set[str]:
     """
-    Vérifie qu'un domaine résout en DNS (optionnel, peut être lent)
+    Garde les domaines qui résolvent en DNS (résolveur asynchrone, DNS_CONCURRENCY requêtes en vol)
     
     Args:
-        domain: Domaine à vérifier
+        domains: Domaines à vérifier
+        resolver: Résolveur DNS partagé
     
     Returns:
-        True si le domaine résout
+        Set des domaines qui résolvent (les erreurs temporaires sont gardées)
     """
-    try:
-        loop = asyncio.get_event_loop()
-        await loop.getaddrinfo(domain, None)
-        return True
-    except:
-        return False
+    answers = await resolver.resolve_many(domains)
+    return {domain for domain, (_, error) in answers.items() if error not in NEGATIVE_ERRORS}
 
 
 async def fetch_all_domains(verify_dns: bool = False, progress_callback=None) -> Set[str]:
@@ -160,7 +377,7 @@ async def fetch_all_domains(verify_dns: bool = False, progress_callback=None) ->
     Récupère tous les domaines .ch depuis crt.sh
     
     Args:
-        verify_dns: Si True, vérifie que les domaines résolvent (lent!)
+        verify_dns: Si True, écarte les domaines qui ne résolvent pas en DNS
         progress_callback: Fonction appelée avec le nombre de domaines trouvés
     
     Returns:
@@ -168,46 +385,41 @@ async def fetch_all_domains(verify_dns: bool = False, progress_callback=None) ->
     """
     all_domains = set()
     
-    # Créer une session HTTP
-    timeout = aiohttp.ClientTimeout(total=120)
+    # Créer une session HTTP (timeout par fenêtre: CRTSH_TIMEOUT)
+    timeout = aiohttp.ClientTimeout(total=None)
     connector = aiohttp.TCPConnector(limit=10)  # Max 10 connexions simultanées
     
     async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-        # Lancer les requêtes pour toutes les années en parallèle
-        tasks = [fetch_crtsh_year(session, year) for year in YEARS]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Combiner les résultats
-        for i, result in enumerate(results):
-            if isinstance(result, set):
-                all_domains.update(result)
-                # Appeler le callback de progression
-                if progress_callback:
-                    await progress_callback(len(all_domains))
-            elif isinstance(result, Exception):
-                print(f"   ⚠️  Une requête a échoué: {result}")
+        # Lancer les requêtes pour toutes les années en parallèle, dans un seul set
+        semaphore = asyncio.Semaphore(CRTSH_CONCURRENCY)
+        tasks = [fetch_crtsh_year(session, year, all_domains, semaphore) for year in YEARS]
+        for task in asyncio.as_completed(tasks):
+            try:
+                await task
+            except Exception as e:
+                print(f"   ⚠️  Une requête a échoué: {e}")
+                continue
+            # Appeler le callback de progression
+            if progress_callback:
+                await progress_callback(len(all_domains))
     
     print(f"\n📊 Total brut: {len(all_domains)} domaines uniques")
     
     # Vérification DNS optionnelle
     if verify_dns and all_domains:
-        print(f"\n🔍 Vérification DNS de {len(all_domains)} domaines (peut prendre du temps)...")
+        print(f"\n🔍 Vérification DNS de {len(all_domains)} domaines...")
         verified = set()
         
-        # Vérifier par lots de 100
+        # Par lots de 10000 pour afficher la progression
         domains_list = list(all_domains)
-        batch_size = 100
-        
-        for i in range(0, len(domains_list), batch_size):
-            batch = domains_list[i:i+batch_size]
-            tasks = [verify_domain_dns(d) for d in batch]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for domain, result in zip(batch, results):
-                if result is True:
-                    verified.add(domain)
-            
-            print(f"   Vérifié {min(i+batch_size, len(domains_list))}/{len(domains_list)} domaines...")
+        batch_size = 10000
+        resolver = DNSResolver()
+        try:
+            for i in range(0, len(domains_list), batch_size):
+                verified |= await verify_domains_dns(domains_list[i:i+batch_size], resolver)
+                print(f"   Vérifié {min(i+batch_size, len(domains_list))}/{len(domains_list)} domaines...")
+        finally:
+            await resolver.close()
         
         print(f"   ✅ {len(verified)} domaines résolvent en DNS")
         all_domains = verified
@@ -217,30 +429,19 @@ async def fetch_all_domains(verify_dns: bool = False, progress_callback=None) ->
 
 async def save_domains(domains: Set[str], filepath: str):
     """
-    Sauvegarde les domaines dans un fichier
+    Sauvegarde les domaines dans un fichier .dset (voir backend/domainset.py)
+    
+    Le tri et l'écriture se font hors de la boucle asyncio; le fichier est
+    remplacé atomiquement.
     
     Args:
         domains: Set de domaines
         filepath: Chemin du fichier de sortie
     """
-    # Trier les domaines
-    sorted_domains = sorted(list(domains))
-    
-    print(f"\n💾 Sauvegarde de {len(sorted_domains)} domaines dans {filepath}...")
-    
-    async with aiofiles.open(filepath, 'w') as f:
-        # Header
-        await f.write(f"# Liste de domaines .ch récupérés depuis crt.sh\n")
-        await f.write(f"# Généré le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        await f.write(f"# Total: {len(sorted_domains)} domaines\n")
-        await f.write(f"# Années: {min(YEARS)}-{max(YEARS)}\n")
-        await f.write(f"#\n")
-        await f.write(f"# Un domaine par ligne\n")
-        await f.write(f"\n")
-        
-        # Domaines
-        for domain in sorted_domains:
-            await f.write(f"{domain}\n")
+    print(f"\n💾 Sauvegarde de {len(domains)} domaines dans {filepath}...")
+    
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: domainset.write(filepath, sorted(domains)))
     
     print(f"   ✅ Fichier créé: {filepath}")
 
@@ -276,7 +477,7 @@ async def main():
         print(f"   📊 Progression: {count} domaines trouvés jusqu'à présent...")
     
     # Récupérer les domaines
-    domains = await fetch_all_domains(verify_dns=False, progress_callback=progress_callback)  # DNS verification désactivée (trop lent)
+    domains = await fetch_all_domains(verify_dns=True, progress_callback=progress_callback)
     
     if not domains:
         print("\n❌ Aucun domaine trouvé!")
@@ -285,15 +486,20 @@ async def main():
     # Sauvegarder
     await save_domains(domains, OUTPUT_PATH)
     
+    # Ajouter au catalogue (source crtsh): une seule ingestion, le scan lit ensuite la base
+    await db.init_db()
+    stats = await db.ingest_domains(sorted(domains), "crtsh")
+    
     print("\n" + "=" * 80)
     print("✅ SUCCÈS")
     print("=" * 80)
     print(f"\n📊 Statistiques:")
     print(f"   - Domaines trouvés: {len(domains)}")
     print(f"   - Fichier: {OUTPUT_PATH}")
+    print(f"   - Nouveaux dans le catalogue: {stats['added']}")
     print()
     print("🚀 Prochaine étape:")
-    print(f"   python -m backend.scan_ch_sites --domains-file {OUTFILE} --limit 500")
+    print(f"   python -m backend.scan_ch_sites --schedule --limit 500")
     print()
     
     return 0
@@ -0,0 +1,66 @@
+"""
+Ingestion des sources de domaines dans le catalogue (table domains).
+
+Chaque source est ingérée une seule fois, par upserts groupés
+(db.ingest_domains): le catalogue garde l'union des sources, avec pour
+chacune la première et la dernière apparition d'un domaine
+(<source>_first_seen / <source>_last_seen). Le scanner lit ensuite le
+catalogue (--schedule, --catalog) au lieu de relire les listes.
+
+Les récupérations alimentent le catalogue d'elles-mêmes: fetch_crtsh ingère
+ses domaines (source crtsh) et fetch_ch_domains applique le diff de zone
+(source axfr). Cette commande sert aux listes existantes ou manuelles.
+
+Usage:
+    python -m backend.ingest FICHIER [--source crtsh|axfr|import]
+    python -m backend.ingest --status
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from backend import db
+from backend.scan_ch_sites import import_domains_file
+
+
+def _date(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M') if timestamp else "-"
+
+
+async def status():
+    """Affiche la composition du catalogue par source"""
+    await db.init_db()
+    info = await db.catalog_status()
+    print(f"📚 Catalogue: {info['active']} domaines actifs ({info['removed']} retirés de la zone, "
+          f"{info['total']} au total)")
+    for source, counts in info["sources"].items():
+        print(f"   {source:<8} {counts['domains']:>10} domaines   dernière ingestion {_date(counts['last_seen'])}")
+    if info["unknown_source"]:
+        print(f"   {'?':<8} {info['unknown_source']:>10} domaines sans source (importés avant le catalogue)")
+    if info["axfr_synced_at"]:
+        print(f"   Dernier diff de zone AXFR: {_date(info['axfr_synced_at'])}")
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(description='Ingestion des listes de domaines dans le catalogue')
+    parser.add_argument('files', nargs='*', help='Listes de domaines (.dset ou texte)')
+    parser.add_argument('--source', default='import', choices=db.SOURCES,
+                        help='Source des domaines (défaut: import)')
+    parser.add_argument('--status', action='store_true', help='Affiche la composition du catalogue')
+    args = parser.parse_args()
+
+    if not args.files and not args.status:
+        parser.error('indiquer au moins un fichier, ou --status')
+
+    async def run():
+        for path in args.files:
+            await import_domains_file(path, args.source)
+        if args.status:
+            await status()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
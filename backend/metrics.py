@@ -0,0 +1,303 @@
+"""
+Métriques du scanner au format texte Prometheus.
+
+Chaque process de scan (process unique, shards de --workers, worker du
+coordinateur) tient ses compteurs en mémoire et les publie toutes les
+METRICS_INTERVAL secondes dans METRICS_DIR/<pid>.json (écriture atomique),
+puis une dernière fois en s'arrêtant. L'API agrège ces fichiers et les sert
+sur GET /metrics (collect()).
+
+Les fichiers des process terminés (pid disparu, ou fichier qui n'est plus mis
+à jour) sont repris dans METRICS_DIR/archive.json: leurs compteurs et
+histogrammes y sont cumulés pour que les totaux restent croissants d'un scan
+à l'autre, leurs jauges (file, requêtes en cours, débit) sont abandonnées.
+
+    oldsites_domains_total{outcome}            domaines traités (scanned, unchanged, error, dns_error)
+    oldsites_domains_per_second                débit sur le dernier intervalle de publication
+    oldsites_http_latency_seconds{scheme}      latence des réponses HTTP (histogramme)
+    oldsites_scan_errors_total{type}           échecs par type d'exception (ou code DNS)
+    oldsites_queue_depth                       domaines en attente dans la file du pipeline
+    oldsites_in_flight                         scans en cours
+    oldsites_concurrency_limit                 limite de concurrence (AIMD)
+    oldsites_db_write_batch_seconds            durée d'écriture d'un lot de résultats (histogramme)
+    oldsites_db_rows_written_total             résultats écrits en base
+    oldsites_score                             distribution des scores (histogramme)
+"""
+
+import asyncio
+import bisect
+import contextlib
+import json
+import math
+import os
+import tempfile
+import time
+from backend import config
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+ARCHIVE = "archive.json"
+
+# Nom -> métrique, dans l'ordre de déclaration (ordre de l'exposition)
+_registry = {}
+
+
+class Counter:
+    """Compteur, éventuellement ventilé par valeurs de labels (dans l'ordre de `labels`)"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        _registry[name] = self
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def _merge(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def _samples(self, key, value):
+        yield self.name, self._label_pairs(key), value
+
+    def _label_pairs(self, key, extra=()):
+        return list(zip(self.labels, key)) + list(extra)
+
+
+class Gauge(Counter):
+    """Jauge: valeur instantanée (additionnée entre process à l'agrégation)"""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Counter):
+    """
+    Histogramme à seuils fixes: par valeurs de labels, le nombre
+    d'observations de chaque intervalle (le dernier au-delà du plus grand
+    seuil) suivi de leur somme.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, target, key, value):
+        current = target.get(key)
+        target[key] = value if current is None else [a + b for a, b in zip(current, value)]
+
+    def _samples(self, key, counts):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else _number(bound)
+            yield f"{self.name}_bucket", self._label_pairs(key, [("le", le)]), cumulative
+        yield f"{self.name}_sum", self._label_pairs(key), counts[-1]
+        yield f"{self.name}_count", self._label_pairs(key), cumulative
+
+
+DOMAINS = Counter("oldsites_domains_total", "Domaines traités par le scanner", ("outcome",))
+DOMAINS_PER_SECOND = Gauge("oldsites_domains_per_second", "Domaines traités par seconde (dernier intervalle)")
+HTTP_LATENCY = Histogram("oldsites_http_latency_seconds", "Latence des réponses HTTP par schéma",
+                         (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30), ("scheme",))
+ERRORS = Counter("oldsites_scan_errors_total", "Scans en échec par type d'exception (dns:CODE pour le DNS)",
+                 ("type",))
+QUEUE_DEPTH = Gauge("oldsites_queue_depth", "Domaines en attente dans la file du pipeline")
+IN_FLIGHT = Gauge("oldsites_in_flight", "Scans en cours")
+CONCURRENCY_LIMIT = Gauge("oldsites_concurrency_limit", "Limite de scans simultanés (concurrence adaptative)")
+DB_WRITE_BATCH = Histogram("oldsites_db_write_batch_seconds", "Durée d'écriture d'un lot de résultats",
+                           (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+DB_ROWS = Counter("oldsites_db_rows_written_total", "Résultats de scan écrits en base")
+SCORE = Histogram("oldsites_score", "Distribution des scores d'ancienneté", range(0, 101, 10))
+
+
+def record_result(result):
+    """Comptabilise un résultat du pipeline (issue, erreur, score)"""
+    error = result.get("error")
+    if error is not None:
+        if error.startswith("DNS:"):
+            DOMAINS.inc("dns_error")
+            ERRORS.inc(f"dns:{error[4:].strip()}")
+        else:
+            # Le type d'exception est compté par scan_domain
+            DOMAINS.inc("error")
+        return
+    DOMAINS.inc("unchanged" if result.get("unchanged") else "scanned")
+    SCORE.observe(result["score"])
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def snapshot():
+    """État des métriques du process: {nom: [[labels, valeur], ...]}"""
+    return {name: [[list(key), value] for key, value in metric.values.items()]
+            for name, metric in _registry.items() if metric.values}
+
+
+def render(values):
+    """Exposition texte Prometheus de valeurs agrégées ({nom: {labels: valeur}})"""
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(values.get(name, {}).items()):
+            for sample, pairs, number in metric._samples(key, value):
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+                lines.append(f"{sample}{{{labels}}} {_number(number)}" if labels else f"{sample} {_number(number)}")
+    return "\n".join(lines) + "\n"
+
+
+def _merge_into(values, state, counters_only=False):
+    for name, entries in state.items():
+        metric = _registry.get(name)
+        if metric is None or (counters_only and metric.kind == "gauge"):
+            continue
+        target = values.setdefault(name, {})
+        for labels, value in entries:
+            metric._merge(target, tuple(labels), value)
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish(directory=None):
+    """Écrit l'état des métriques du process dans METRICS_DIR/<pid>.json"""
+    directory = directory or config.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, f"{os.getpid()}.json"),
+                {"pid": os.getpid(), "updated": time.time(), "metrics": snapshot()})
+
+
+@contextlib.asynccontextmanager
+async def publishing(interval=None, directory=None):
+    """
+    Publie les métriques du process toutes les `interval` secondes pendant
+    le bloc, une dernière fois à la sortie (même en cas d'erreur).
+    """
+    interval = interval or config.METRICS_INTERVAL
+
+    async def loop():
+        previous, since = DOMAINS.total(), time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            total, now = DOMAINS.total(), time.monotonic()
+            DOMAINS_PER_SECOND.set(round((total - previous) / (now - since), 2))
+            previous, since = total, now
+            try:
+                publish(directory)
+            except OSError as e:
+                print(f"⚠️  Publication des métriques impossible: {e}")
+
+    task = asyncio.create_task(loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        DOMAINS_PER_SECOND.set(0)
+        with contextlib.suppress(OSError):
+            publish(directory)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(directory=None):
+    """
+    Agrège les métriques publiées par les process de scan (texte Prometheus).
+
+    Les fichiers des process terminés sont cumulés dans l'archive puis
+    supprimés; un fichier non mis à jour depuis 10 intervalles est considéré
+    comme celui d'un process terminé (pid réutilisé).
+    """
+    directory = directory or config.METRICS_DIR
+    values = {}
+    if not os.path.isdir(directory):
+        return render(values)
+
+    archive_path = os.path.join(directory, ARCHIVE)
+    archive = _read_json(archive_path) or {}
+    finished = []
+    live = []
+    stale_before = time.time() - 10 * config.METRICS_INTERVAL
+    for entry in os.listdir(directory):
+        if not entry.endswith(".json") or entry == ARCHIVE:
+            continue
+        path = os.path.join(directory, entry)
+        data = _read_json(path)
+        if data is None:
+            continue
+        if _alive(data["pid"]) and data["updated"] >= stale_before:
+            live.append(data["metrics"])
+        else:
+            finished.append((path, data["metrics"]))
+
+    if finished:
+        folded = {}
+        _merge_into(folded, archive)
+        for _, state in finished:
+            _merge_into(folded, state, counters_only=True)
+        archive = {name: [[list(key), value] for key, value in entries.items()]
+                   for name, entries in folded.items()}
+        _write_json(archive_path, archive)
+        for path, _ in finished:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    _merge_into(values, archive)
+    for state in live:
+        _merge_into(values, state)
+    return render(values)
@@ -0,0 +1,99 @@
+"""
+Re-scoring hors ligne des scans stockés, sans aucune requête réseau.
+
+Relit headers et échantillons HTML déjà en base, les re-score avec les règles
+actuelles sur plusieurs process et réécrit score, raisons et version des
+règles par transactions groupées.
+
+Usage:
+    python -m backend.rescore [--outdated] [--workers N] [--chunk-size N]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from backend import config, db, scoring
+
+
+def _init_worker(rules_path):
+    """Charge les règles une fois par process worker"""
+    scoring.reload(rules_path)
+
+
+def _score_rows(rows):
+    """
+    Re-score un lot de scans (exécuté dans un process worker).
+
+    Returns:
+        Liste de tuples (score, reasons, rules_version, scan_id) pour db.update_scores
+    """
+    ruleset = scoring.current()
+    results = []
+    for scan_id, http_code, headers, sample_head, scheme in rows:
+        score, reasons = ruleset.score(headers, sample_head, http_code, scheme or "https")
+        results.append((score, reasons, ruleset.version, scan_id))
+    return results
+
+
+async def rescore(workers=None, chunk_size=None, outdated_only=False):
+    """
+    Re-score tous les scans stockés (ou seulement ceux d'une autre version des règles).
+
+    Les lots sont lus par pagination sur l'id, scorés en parallèle et écrits
+    dans l'ordre; au plus 2 lots par worker sont en vol pour borner la mémoire.
+    """
+    await db.init_db()
+    ruleset = scoring.current()
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or config.RESCORE_CHUNK_SIZE
+    loop = asyncio.get_running_loop()
+
+    print(f"🔁 Re-scoring avec les règles version {ruleset.version} ({workers} process)")
+    if outdated_only:
+        print("   Seulement les scans scorés avec une autre version")
+    print("-" * 80)
+
+    start = time.time()
+    scanned = 0
+    changed = 0
+    pending = deque()
+
+    async def write_oldest():
+        nonlocal scanned, changed
+        results = await pending.popleft()
+        changed += await db.update_scores(results)
+        scanned += len(results)
+        print(f"   {scanned} scans re-scorés ({changed} modifiés)")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(ruleset.path,)) as pool:
+        async for rows in db.iter_stored_scans(chunk_size, ruleset.version if outdated_only else None):
+            pending.append(loop.run_in_executor(pool, _score_rows, rows))
+            if len(pending) >= workers * 2:
+                await write_oldest()
+        while pending:
+            await write_oldest()
+
+    elapsed = time.time() - start
+    print("-" * 80)
+    print(f"✅ Re-scoring terminé: {scanned} scans, {changed} modifiés en {elapsed:.1f}s")
+    return scanned, changed
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(description='Re-scoring hors ligne des scans stockés')
+    parser.add_argument('--workers', type=int, help='Nombre de process (défaut: nombre de CPU)')
+    parser.add_argument('--chunk-size', type=int, help=f'Scans par lot (défaut: {config.RESCORE_CHUNK_SIZE})')
+    parser.add_argument('--outdated', action='store_true',
+                       help='Ne re-scorer que les scans faits avec une autre version des règles')
+
+    args = parser.parse_args()
+    asyncio.run(rescore(args.workers, args.chunk_size, args.outdated))
+
+
+if __name__ == "__main__":
+    main()
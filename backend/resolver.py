@@ -0,0 +1,376 @@
+"""
+Résolution DNS asynchrone du scanner.
+
+Client DNS UDP minimal sur la boucle asyncio (pas de threadpool comme
+getaddrinfo): les requêtes A (puis AAAA si le nom n'a pas d'IPv4) sont envoyées
+directement aux serveurs de DNS_SERVERS (par défaut ceux de /etc/resolv.conf),
+avec au plus DNS_CONCURRENCY requêtes en vol. Les réponses sont gardées dans un
+cache mémoire selon leur TTL (borné par DNS_MIN_TTL / DNS_MAX_TTL); les noms
+inexistants (NXDOMAIN, pas d'adresse) aussi, pendant DNS_NEGATIVE_TTL.
+
+Le cache négatif écarte des domaines des scans suivants: contre l'usurpation
+de réponses, chaque requête part d'un socket tiré au hasard parmi DNS_SOCKETS
+(ports source aléatoires, renouvelés toutes les DNS_SOCKET_QUERIES requêtes),
+et une réponse n'est acceptée que si elle arrive sur ce socket, depuis le
+serveur interrogé, avec le même identifiant et la même question.
+
+Le pipeline de scan résout chaque paquet de domaines avant de les confier aux
+workers: les noms morts (NEGATIVE_ERRORS) sont écartés sans occuper de place
+de scan, et aiohttp réutilise les adresses déjà résolues via
+`aiohttp_resolver()`. Après une erreur temporaire (Timeout, SERVFAIL...), la
+connexion se rabat sur getaddrinfo au lieu de conclure que le site est mort.
+"""
+
+import asyncio
+import contextlib
+import ipaddress
+import random
+import socket
+import struct
+import time
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import ThreadedResolver
+from backend import config
+
+
+QTYPE_A = 1
+QTYPE_AAAA = 28
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+RCODE_NAMES = {1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+# Erreurs définitives (mises en cache négatif); les autres sont réessayées au prochain scan
+NEGATIVE_ERRORS = ("NXDOMAIN", "NODATA", "INVALID")
+
+
+def build_query(qid, name, qtype):
+    """Requête DNS (récursion demandée) pour un nom et un type d'enregistrement"""
+    header = struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0)
+    labels = name.rstrip(".").encode("idna").split(b".")
+    qname = b"".join(bytes([len(label)]) + label for label in labels) + b"\0"
+    return header + qname + struct.pack("!HH", qtype, 1)
+
+
+def _read_name(data, offset):
+    """Nom (en minuscules, sans point final) et position après le nom à partir de offset"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length == 0:
+            return b".".join(labels).lower(), offset + 1 if end is None else end
+        labels.append(bytes(data[offset + 1:offset + 1 + length]))
+        offset += 1 + length
+    raise ValueError("nom compressé en boucle")
+
+
+def _skip_name(data, offset):
+    """Position après un nom (éventuellement compressé) à partir de offset"""
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def parse_response(data, qtype):
+    """
+    Décode une réponse DNS.
+
+    Lève ValueError si le paquet est tronqué ou malformé.
+
+    Returns:
+        tuple: (qid, rcode, adresses du type qtype, TTL minimal ou None,
+        question (nom, type) ou None)
+    """
+    try:
+        qid, flags, qdcount, ancount, _, _ = struct.unpack_from("!HHHHHH", data)
+        offset = 12
+        question = None
+        for index in range(qdcount):
+            if index == 0:
+                qname, offset = _read_name(data, offset)
+                question = (qname, struct.unpack_from("!H", data, offset)[0])
+            else:
+                offset = _skip_name(data, offset)
+            offset += 4
+        addresses = []
+        ttl = None
+        family = socket.AF_INET if qtype == QTYPE_A else socket.AF_INET6
+        # Les CNAME précèdent les adresses de la cible dans la section réponse
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rtype, _, rttl, rdlength = struct.unpack_from("!HHIH", data, offset)
+            offset += 10
+            if rtype == qtype:
+                addresses.append(socket.inet_ntop(family, data[offset:offset + rdlength]))
+                ttl = rttl if ttl is None else min(ttl, rttl)
+            offset += rdlength
+    except (struct.error, IndexError, ValueError) as e:
+        raise ValueError(f"Réponse DNS invalide: {e}")
+    if flags & 0x0200 and not addresses:
+        raise ValueError("Réponse DNS tronquée")
+    return qid, flags & 0x000F, addresses, ttl, question
+
+
+def _question(name, qtype):
+    """Question attendue dans la réponse à build_query(name, qtype)"""
+    return name.rstrip(".").encode("idna").lower(), qtype
+
+
+def system_nameservers(path="/etc/resolv.conf"):
+    """Serveurs DNS configurés sur la machine (127.0.0.1 à défaut)"""
+    servers = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers or ["127.0.0.1"]
+
+
+def _server_address(server):
+    """(famille, (hôte, port)) d'un serveur "ip", "ip:port" ou "[ipv6]:port" """
+    host, port = server, 53
+    if server.startswith("["):
+        host, _, rest = server[1:].partition("]")
+        if rest.startswith(":"):
+            port = int(rest[1:])
+    elif server.count(":") == 1:
+        host, port = server.split(":")
+        port = int(port)
+    family = socket.AF_INET6 if ipaddress.ip_address(host).version == 6 else socket.AF_INET
+    return family, (host, port)
+
+
+def host_of(domain):
+    """Nom d'hôte d'un domaine de la liste (sans port éventuel)"""
+    return domain.split(":")[0]
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    """Socket UDP du résolveur: réveille la requête correspondant à une réponse (par identifiant)"""
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.transport = None
+        self.in_flight = 0
+        self.remaining = config.DNS_SOCKET_QUERIES
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 2:
+            return
+        entry = self.pending.get(struct.unpack_from("!H", data)[0])
+        if entry is None:
+            return
+        future, server, question, protocol = entry
+        # Ignorer les réponses reçues sur un autre socket ou d'un autre serveur que celui interrogé
+        if protocol is not self or addr[0] != server[0] or addr[1] != server[1] or future.done():
+            return
+        try:
+            response = parse_response(data, question[1])
+        except ValueError as e:
+            future.set_exception(e)
+            return
+        if response[4] != question:
+            # Question différente: réponse usurpée ou égarée, la vraie peut encore arriver
+            return
+        future.set_result(response)
+
+    def error_received(self, exc):
+        # Ex: port ICMP injoignable; la requête concernée expirera et sera réessayée
+        pass
+
+
+class DNSResolver:
+    """
+    Résolveur DNS UDP asynchrone avec cache positif et négatif.
+
+    resolve(host) -> (adresses, erreur): erreur vaut None, un code définitif de
+    NEGATIVE_ERRORS, ou un code temporaire ("Timeout", "SERVFAIL"...).
+    """
+
+    def __init__(self, servers=None, concurrency=None, timeout=None, retries=None):
+        self.servers = [_server_address(s) for s in (servers or config.DNS_SERVERS or system_nameservers())]
+        self.timeout = timeout or config.DNS_TIMEOUT
+        self.retries = config.DNS_RETRIES if retries is None else retries
+        self._semaphore = asyncio.Semaphore(concurrency or config.DNS_CONCURRENCY)
+        self._pending = {}
+        self._sockets = {}      # famille -> sockets (_Protocol) en service
+        self._open = set()      # tous les sockets ouverts, y compris ceux en fin de service
+        self._opening = asyncio.Lock()
+        self._cache = {}
+
+    async def close(self):
+        for protocol in self._open:
+            protocol.transport.close()
+        self._open.clear()
+        self._sockets.clear()
+
+    async def _socket(self, family):
+        """Socket d'une requête, tiré au hasard parmi les DNS_SOCKETS du pool (complété au besoin)"""
+        pool = self._sockets.setdefault(family, [])
+        if len(pool) < config.DNS_SOCKETS:
+            async with self._opening:
+                loop = asyncio.get_running_loop()
+                while len(pool) < config.DNS_SOCKETS:
+                    # Port source choisi par le système (aléatoire)
+                    _, protocol = await loop.create_datagram_endpoint(lambda: _Protocol(self._pending), family=family)
+                    pool.append(protocol)
+                    self._open.add(protocol)
+        protocol = random.choice(pool)
+        protocol.in_flight += 1
+        protocol.remaining -= 1
+        if protocol.remaining <= 0:
+            # Retiré du pool (remplacé par un nouveau port), fermé après ses requêtes en cours
+            pool.remove(protocol)
+        return protocol
+
+    def _release(self, protocol):
+        protocol.in_flight -= 1
+        if protocol.remaining <= 0 and protocol.in_flight == 0 and protocol in self._open:
+            protocol.transport.close()
+            self._open.discard(protocol)
+
+    def _new_id(self):
+        while True:
+            qid = random.getrandbits(16)
+            if qid not in self._pending:
+                return qid
+
+    async def query(self, name, qtype):
+        """
+        Interroge les serveurs à tour de rôle (DNS_RETRIES nouveaux essais).
+
+        Returns:
+            tuple: (rcode, adresses, ttl)
+        """
+        loop = asyncio.get_running_loop()
+        query = bytearray(build_query(0, name, qtype))
+        question = _question(name, qtype)
+        for attempt in range(self.retries + 1):
+            family, server = self.servers[attempt % len(self.servers)]
+            protocol = await self._socket(family)
+            qid = self._new_id()
+            struct.pack_into("!H", query, 0, qid)
+            future = loop.create_future()
+            self._pending[qid] = (future, server, question, protocol)
+            try:
+                protocol.transport.sendto(bytes(query), server)
+                _, rcode, addresses, ttl, _ = await asyncio.wait_for(future, self.timeout)
+                return rcode, addresses, ttl
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                self._pending.pop(qid, None)
+                self._release(protocol)
+        raise asyncio.TimeoutError()
+
+    def _remember(self, host, addresses, error, ttl):
+        if len(self._cache) >= config.DNS_CACHE_SIZE:
+            # Éviction de l'entrée la plus ancienne (ordre d'insertion)
+            del self._cache[next(iter(self._cache))]
+        self._cache[host] = (time.monotonic() + ttl, addresses, error)
+
+    async def resolve(self, host):
+        """Adresses d'un nom d'hôte: (liste d'IP, erreur ou None)"""
+        try:
+            ipaddress.ip_address(host)
+            return [host], None
+        except ValueError:
+            pass
+        cached = self._cache.get(host)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1], cached[2]
+
+        async with self._semaphore:
+            try:
+                rcode, addresses, ttl = await self.query(host, QTYPE_A)
+                if rcode == RCODE_NOERROR and not addresses:
+                    rcode, addresses, ttl = await self.query(host, QTYPE_AAAA)
+            except UnicodeError:
+                rcode, addresses, ttl = None, [], None
+            except asyncio.TimeoutError:
+                return [], "Timeout"
+            except (OSError, ValueError):
+                return [], "Erreur"
+
+        if rcode is None:
+            error = "INVALID"
+        elif rcode == RCODE_NOERROR:
+            error = None if addresses else "NODATA"
+        else:
+            error = RCODE_NAMES.get(rcode, f"RCODE{rcode}")
+        if error is None:
+            ttl = min(max(ttl or 0, config.DNS_MIN_TTL), config.DNS_MAX_TTL)
+            self._remember(host, addresses, None, ttl)
+        elif error in NEGATIVE_ERRORS:
+            self._remember(host, [], error, config.DNS_NEGATIVE_TTL)
+        return addresses, error
+
+    async def resolve_many(self, domains):
+        """Résout des domaines en parallèle: dict domaine -> (adresses, erreur)"""
+        answers = await asyncio.gather(*(self.resolve(host_of(d)) for d in domains))
+        return dict(zip(domains, answers))
+
+    def aiohttp_resolver(self):
+        """Résolveur à passer à aiohttp.TCPConnector (partage le cache)"""
+        return _AiohttpResolver(self)
+
+
+class _AiohttpResolver(AbstractResolver):
+    """Adaptateur aiohttp: les connexions utilisent les adresses du DNSResolver"""
+
+    def __init__(self, dns):
+        self._dns = dns
+        self._fallback = None
+
+    async def resolve(self, host, port=0, family=socket.AF_UNSPEC):
+        addresses, error = await self._dns.resolve(host)
+        if error is not None and error not in NEGATIVE_ERRORS:
+            # Résolveur saturé ou indisponible: résolution système (getaddrinfo)
+            if self._fallback is None:
+                self._fallback = ThreadedResolver()
+            return await self._fallback.resolve(host, port, family)
+        hosts = []
+        for address in addresses:
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            if family not in (socket.AF_UNSPEC, address_family):
+                continue
+            hosts.append({"hostname": host, "host": address, "port": port, "family": address_family,
+                          "proto": 0, "flags": socket.AI_NUMERICHOST})
+        if not hosts:
+            # aiohttp convertit OSError en erreur de connexion DNS
+            raise OSError(f"DNS {error or 'NODATA'}: {host}")
+        return hosts
+
+    async def close(self):
+        pass
+
+
+@contextlib.asynccontextmanager
+async def open_resolver():
+    """DNSResolver pour la durée d'un scan, ou None si DNS_RESOLVE est désactivé"""
+    if not config.DNS_RESOLVE:
+        yield None
+        return
+    resolver = DNSResolver()
+    try:
+        yield resolver
+    finally:
+        await resolver.close()
@@ -2,10 +2,19 @@
 
 import asyncio
 import aiohttp
+import hashlib
 import time
-import re
 import argparse
-from backend import config, db
+import contextlib
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+from backend import adaptive, config, db, domainset, metrics, scoring
+from backend.adaptive import ConcurrencyController
+from backend.resolver import NEGATIVE_ERRORS, host_of, open_resolver
+from backend.throttle import IPQueue, ip_key
 
 
 def score_site(headers, body_sample, http_code):
@@ -14,293 +23,842 @@ def score_site(headers, body_sample, http_code):
     Plus le score est élevé, plus le site est probablement ancien.
     
     NOUVEAU: Pénalise les sites morts et favorise les sites actifs mais obsolètes.
+    Les critères sont définis dans config.SCORING_RULES_FILE (voir backend/scoring.py).
     """
-    score = 0
-    reasons = []
-    
-    # FILTRAGE: Pénaliser fortement les sites non-fonctionnels
-    if http_code >= 400:
-        score -= 100  # Pénalité massive pour sites morts
-        reasons.append(f"Site non accessible (HTTP {http_code})")
-        return score, "; ".join(reasons)
-    
-    # BONUS: Site actif et accessible
-    if http_code == 200:
-        score += 5
-        reasons.append("Site actif (HTTP 200)")
+    return scoring.current().score(headers, body_sample, http_code)
 
-    # Conversion des headers en dict case-insensitive
-    headers_lower = {k.lower(): v for k, v in headers.items()}
-    
-    # 1. Pas de HTTPS (si on a dû fallback sur HTTP)
-    # Cette info sera passée par le caller
+
+async def _read_sample(resp):
+    """Lit au plus SAMPLE_BYTES octets du body (sans télécharger le reste)"""
+    chunks = []
+    size = 0
+    while size < config.SAMPLE_BYTES:
+        chunk = await resp.content.read(config.SAMPLE_BYTES - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks)
+
+
+async def fetch_site(session, url, request_headers=None):
+    """
+    Récupère code HTTP, headers et début du body d'une URL.
+
+    `request_headers` (If-None-Match / If-Modified-Since) rend le GET
+    conditionnel: un 304 est retourné tel quel, avec un body vide.
+
+    Mode "get" (défaut): un seul GET en streaming; headers et code viennent de
+    cette réponse et seuls SAMPLE_BYTES octets sont lus avant de fermer la
+    connexion (aiohttp ne la réutilise pas si le body n'a pas été lu en entier).
+    Mode "head": HEAD puis GET partiel, avec repli sur le GET si le serveur
+    refuse HEAD (405/501).
+
+    Returns:
+        tuple: (http_code, headers, body_bytes)
+    """
+    # HEAD_TIMEOUT / PARTIAL_GET_TIMEOUT, ou ajustés aux latences observées (adaptive)
+    connect_timeout, total_timeout = adaptive.timeouts()
+    if config.FETCH_MODE == "head":
+        started = time.monotonic()
+        async with session.head(url, timeout=aiohttp.ClientTimeout(total=connect_timeout),
+                                allow_redirects=True) as resp:
+            headers = dict(resp.headers)
+            http_code = resp.status
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=total_timeout),
+                               allow_redirects=True) as resp2:
+            body_bytes = await _read_sample(resp2)
+            if http_code in (405, 501):
+                headers = dict(resp2.headers)
+                http_code = resp2.status
+        metrics.HTTP_LATENCY.observe(time.monotonic() - started, url.split("://", 1)[0])
+        return http_code, headers, body_bytes
+
+    timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=connect_timeout)
+    started = time.monotonic()
+    async with session.get(url, timeout=timeout, allow_redirects=True, headers=request_headers) as resp:
+        response = resp.status, dict(resp.headers), await _read_sample(resp)
+    metrics.HTTP_LATENCY.observe(time.monotonic() - started, url.split("://", 1)[0])
+    return response
+
+
+async def _cancel(*tasks):
+    """Annule les tâches encore en cours et récupère leurs erreurs"""
+    pending = [t for t in tasks if t is not None]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def probe_site(session, domain):
+    """
+    Interroge HTTPS et HTTP en parallèle (façon happy eyeballs).
+
+    HTTPS part en premier; HTTP est lancé après HTTP_FALLBACK_DELAY secondes,
+    ou tout de suite si HTTPS échoue avant (connexion refusée, erreur TLS).
+    HTTPS est prioritaire: la réponse HTTP n'est retenue que si HTTPS a échoué,
+    pour que le bonus « Pas de HTTPS » reste exact. La tentative perdante est
+    annulée.
+
+    Returns:
+        tuple: (scheme, http_code, headers, body_bytes)
+
+    Raises:
+        L'erreur de la tentative HTTP si aucun schéma n'a répondu.
+    """
+    https = asyncio.create_task(fetch_site(session, f"https://{domain}"))
+    http = None
+    try:
+        done, _ = await asyncio.wait({https}, timeout=config.HTTP_FALLBACK_DELAY)
+        if not done or https.exception() is not None:
+            http = asyncio.create_task(fetch_site(session, f"http://{domain}"))
+        try:
+            return ("https",) + await https
+        except Exception:
+            pass
+        if http is None:
+            http = asyncio.create_task(fetch_site(session, f"http://{domain}"))
+        return ("http",) + await http
+    finally:
+        await _cancel(https, http)
+
+
+def fingerprint(ruleset, scheme, http_code, headers, body_bytes):
+    """
+    Empreinte de tout ce qui détermine le score: version des règles, schéma,
+    code HTTP, headers lus par les règles et échantillon du body.
+
+    Deux réponses de même empreinte ont forcément le même score.
+    """
+    digest = hashlib.sha1(f"{ruleset.version}\n{scheme}\n{http_code}\n".encode())
+    lower = {k.lower(): v for k, v in headers.items()}
+    for name in ruleset.header_names:
+        digest.update(f"{name}:{lower.get(name)!r}\n".encode())
+    digest.update(body_bytes)
+    return digest.hexdigest()
+
+
+async def _conditional_fetch(session, domain, state, ruleset):
+    """
+    Re-fetch conditionnel avec les validateurs du scan précédent.
+
+    Retourne None (scan complet nécessaire) si le domaine n'a pas de
+    validateurs, si les règles ont changé depuis, si la requête échoue, ou si
+    le contenu a changé alors que le domaine n'était joignable qu'en HTTP (il
+    faut alors revérifier HTTPS).
+
+    Returns:
+        tuple: (scheme, http_code, headers, body_bytes) ou None
+    """
+    if not state or not state["scheme"] or state["rules_version"] != ruleset.version:
+        return None
+    request_headers = {}
+    if state["etag"]:
+        request_headers["If-None-Match"] = state["etag"]
+    if state["last_modified"]:
+        request_headers["If-Modified-Since"] = state["last_modified"]
+    if not request_headers:
+        return None
+    scheme = state["scheme"]
+    try:
+        http_code, headers, body_bytes = await fetch_site(session, f"{scheme}://{domain}", request_headers)
+    except Exception:
+        return None
+    if http_code != 304 and scheme == "http":
+        return None
+    return scheme, http_code, headers, body_bytes
+
+
+def _validators(headers):
+    """(ETag, Last-Modified) d'une réponse (noms de headers insensibles à la casse)"""
+    lower = {k.lower(): v for k, v in headers.items()}
+    return lower.get("etag"), lower.get("last-modified")
+
+
+def _unchanged(domain, state, scheme, http_code, headers, latency_ms):
+    """Résultat d'un domaine dont le contenu n'a pas changé (score repris tel quel)"""
+    etag, last_modified = _validators(headers)
+    return {
+        "domain": domain,
+        "unchanged": True,
+        "scheme": scheme,
+        "http_code": http_code,
+        "score": state["score"],
+        "same_as": state["scan_id"],
+        "latency_ms": latency_ms,
+        "etag": etag,
+        "last_modified": last_modified,
+        "rules_version": state["rules_version"],
+    }
+
+
+async def scan_domain(session, domain, state=None):
+    """
+    Scanne un domaine et retourne les résultats.
+
+    Avec l'état du scan précédent (db.domain_states), la requête est
+    conditionnelle (If-None-Match / If-Modified-Since): un 304, ou une réponse
+    de même empreinte, réutilise le score précédent sans re-scorer.
+
+    Returns:
+        dict: domain, scheme, http_code, headers, sample_head, score, reasons,
+        latency_ms, rules_version, content_hash, etag, last_modified;
+        unchanged=True (score et same_as repris du scan précédent) si le
+        contenu n'a pas changé; ou domain et error si le site est injoignable.
+    """
+    start_time = time.time()
+    ruleset = scoring.reload_if_changed()
     
-    # 2. Server header révélateur
-    server = headers_lower.get('server', '').lower()
-    if 'apache/1.' in server or 'apache/2.0' in server or 'apache/2.2' in server:
-        score += 15
-        reasons.append(f"Apache ancien ({server})")
-    if 'iis/5' in server or 'iis/6' in server or 'iis/7' in server:
-        score += 15
-        reasons.append(f"IIS ancien ({server})")
-    if 'php/4' in server or 'php/5.0' in server or 'php/5.1' in server or 'php/5.2' in server:
-        score += 20
-        reasons.append(f"PHP très ancien ({server})")
-    if 'php/5.3' in server or 'php/5.4' in server or 'php/5.5' in server:
-        score += 15
-        reasons.append(f"PHP 5.x ancien ({server})")
+    try:
+        response = await _conditional_fetch(session, domain, state, ruleset)
+        if response is None:
+            response = await probe_site(session, domain)
+    except asyncio.TimeoutError as e:
+        metrics.ERRORS.inc(type(e).__name__)
+        return {"domain": domain, "error": "Timeout"}
+    except aiohttp.ClientError as e:
+        metrics.ERRORS.inc(type(e).__name__)
+        return {"domain": domain, "error": f"Erreur: {type(e).__name__}"}
+    except Exception as e:
+        metrics.ERRORS.inc(type(e).__name__)
+        return {"domain": domain, "error": f"Erreur inattendue: {e}"}
     
-    # 3. X-Powered-By
-    powered = headers_lower.get('x-powered-by', '').lower()
-    if 'php/4' in powered or 'php/5.0' in powered or 'php/5.1' in powered or 'php/5.2' in powered:
-        score += 20
-        reasons.append(f"X-Powered-By PHP ancien ({powered})")
-    if 'php/5.3' in powered or 'php/5.4' in powered or 'php/5.5' in powered:
-        score += 15
-        reasons.append(f"X-Powered-By PHP 5.x ({powered})")
-    if 'asp.net' in powered:
-        score += 10
-        reasons.append("ASP.NET classique")
+    scheme, http_code, headers, body_bytes = response
+    latency_ms = int((time.time() - start_time) * 1000)
+    if http_code == 304:
+        return _unchanged(domain, state, scheme, 304, headers, latency_ms)
     
-    # 4. Content-Type avec charset ISO-8859
-    content_type = headers_lower.get('content-type', '').lower()
-    if 'iso-8859' in content_type or 'windows-1252' in content_type:
-        score += 15
-        reasons.append(f"Charset ancien ({content_type})")
+    # Contenu identique au scan précédent (même sans validateurs): pas de re-scoring
+    content_hash = fingerprint(ruleset, scheme, http_code, headers, body_bytes)
+    if state and state["content_hash"] == content_hash:
+        return _unchanged(domain, state, scheme, http_code, headers, latency_ms)
     
-    # 5. Vérifier que le site a du contenu réel
-    if not body_sample or len(body_sample) < 100:
-        score -= 50  # Pénalité pour sites vides ou parking
-        reasons.append("Contenu insuffisant (site parking ou vide)")
-        return score, "; ".join(reasons)
+    # Scoring (passer le code HTTP; bonus si pas HTTPS)
+    body_sample = body_bytes.decode('utf-8', errors='ignore')
+    score, reasons = ruleset.score(headers, body_sample, http_code, scheme)
+    etag, last_modified = _validators(headers)
     
-    # 5. Analyse du body_sample
-    if body_sample:
-        body_lower = body_sample.lower()
-        
-        # Détecter les pages parking / domaines à vendre
-        parking_keywords = ['domain for sale', 'domaine à vendre', 'buy this domain', 
-                           'acheter ce domaine', 'domain parking', 'sedo', 'godaddy parking']
-        if any(keyword in body_lower for keyword in parking_keywords):
-            score -= 80
-            reasons.append("Page parking / domaine à vendre")
-            return score, "; ".join(reasons)
-        
-        # Détecter les pages d'erreur
-        error_keywords = ['page not found', 'page introuvable', 'error 404', 'erreur 404',
-                         'site en construction', 'under construction', 'coming soon']
-        if any(keyword in body_lower for keyword in error_keywords):
-            score -= 60
-            reasons.append("Page d'erreur ou en construction")
-            return score, "; ".join(reasons)
-        
-        # HTML4 / XHTML 1.0
-        if '<!doctype html public "-//w3c//dtd html 4' in body_lower:
-            score += 20
-            reasons.append("DOCTYPE HTML 4")
-        if '<!doctype html public "-//w3c//dtd xhtml 1.0' in body_lower:
-            score += 15
-            reasons.append("DOCTYPE XHTML 1.0")
-        
-        # Meta charset ISO-8859
-        if re.search(r'charset\s*=\s*["\']?iso-8859', body_lower):
-            score += 15
-            reasons.append("Meta charset ISO-8859")
-        
-        # Balises obsolètes
-        obsolete_tags = ['<font', '<center', '<marquee', '<blink', '<frame']
-        for tag in obsolete_tags:
-            if tag in body_lower:
-                score += 10
-                reasons.append(f"Balise obsolète: {tag}")
+    return {
+        "domain": domain,
+        "scheme": scheme,
+        "http_code": http_code,
+        "headers": headers,
+        "sample_head": body_sample,
+        "score": score,
+        "reasons": reasons,
+        "latency_ms": latency_ms,
+        "rules_version": ruleset.version,
+        "content_hash": content_hash,
+        "etag": etag,
+        "last_modified": last_modified,
+    }
+
+
+def print_result(result):
+    """Affiche une ligne de progression pour un résultat"""
+    domain = result["domain"]
+    if "error" in result:
+        if result["error"] == "Timeout":
+            print(f"⏱ {domain} - Timeout")
+        else:
+            print(f"✗ {domain} - {result['error']}")
+        print(f"✗ {domain} - Inaccessible")
+    elif result.get("unchanged"):
+        print(f"= {domain} - Inchangé (HTTP {result['http_code']}) - Score: {result['score']}")
+    elif result["score"] >= config.SCORE_THRESHOLD:
+        print(f"✓ {domain} - Score: {result['score']} - {result['reasons'][:80]}")
+    else:
+        print(f"○ {domain} - Score: {result['score']} (trop faible)")
+
+
+def result_row(result, run_id=None):
+    """
+    Ligne DB d'un résultat (format: voir db._apply_rows).
+
+    Tous les domaines mettent à jour leur planification et leurs validateurs;
+    le scan complet n'est conservé que si le score atteint SCORE_THRESHOLD
+    (ou avec STORE_ALL_SCANS), un scan inchangé est enregistré par référence.
+    """
+    row = {"domain": result["domain"], "scan_time": int(time.time()), "score": result.get("score"),
+           "run_id": run_id, "seq": result.get("seq")}
+    if "error" in result:
+        # Cache DNS négatif (NXDOMAIN, pas d'adresse)
+        row.update(dns_error=result.get("dns_error"), dns_retry_at=result.get("dns_retry_at"))
+        return row
+    row.update(scheme=result["scheme"], etag=result["etag"], last_modified=result["last_modified"],
+               rules_version=result["rules_version"])
+    if result.get("unchanged"):
+        row.update(unchanged=1, same_as=result["same_as"], latency_ms=result["latency_ms"])
+        return row
+    row["content_hash"] = result["content_hash"]
+    # Sauvegarder si score suffisant (ou tout garder pour re-scorer plus tard)
+    if result["score"] >= config.SCORE_THRESHOLD or config.STORE_ALL_SCANS:
+        headers_str = "\n".join(f"{k}: {v}" for k, v in result["headers"].items())
+        row.update(db.scan_row(result["domain"], result["http_code"], headers_str, result["sample_head"],
+                               result["score"], result["reasons"], result["latency_ms"],
+                               result["rules_version"], result["scheme"]))
+    return row
+
+
+async def record_result(result, run_id=None):
+    """
+    Sink par défaut: affiche le résultat et l'envoie au writer DB.
+
+    Avec run_id, le domaine est aussi marqué comme terminé pour ce run (même
+    s'il n'est pas conservé), pour pouvoir reprendre avec --resume.
+    """
+    await db.put_row(result_row(result, run_id))
+    print_result(result)
+
+
+def iter_domains(lines, limit=None):
+    """Générateur de domaines: ignore lignes vides et commentaires, s'arrête après `limit`"""
+    count = 0
+    for line in lines:
+        domain = line.strip()
+        if not domain or domain.startswith('#'):
+            continue
+        if limit and count >= limit:
+            return
+        count += 1
+        yield domain
+
+
+async def _aiter(items):
+    """Itère de la même façon un itérable synchrone ou asynchrone"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+def is_done(done, seq):
+    """Vrai si le bit `seq` est positionné dans le bitmap de db.load_done"""
+    byte = seq >> 3
+    return byte < len(done) and (done[byte] >> (seq & 7)) & 1
+
+
+async def scan_pipeline(session, items, sink, workers=None, stop=None, lookup=db.domain_states, resolver=None):
+    """
+    Pipeline producteur/consommateur borné.
+
+    Un producteur alimente une file de QUEUE_SIZE domaines depuis l'itérable
+    `items` (synchrone ou asynchrone) de couples (seq, domaine) lu au fil de l'eau, `workers` tâches
+    scannent en parallèle et chaque résultat (avec son seq) est passé à
+    `sink`. La mémoire reste constante quelle que soit la taille de la liste.
+
+    La file est répartie par IP (throttle.IPQueue): les workers prennent le
+    prochain domaine dont l'IP (ou le réseau /IP_PREFIX) n'a pas dépassé son
+    débit, et les IP les plus chargées sont affichées toutes les
+    IP_REPORT_INTERVAL secondes.
+
+    L'état du scan précédent (re-scan conditionnel) est lu par `lookup` par
+    paquets de STATE_LOOKUP_CHUNK domaines (une requête par paquet).
+
+    Avec un `resolver` (resolver.DNSResolver), chaque paquet est résolu en DNS
+    pendant que le précédent est scanné: les domaines inexistants
+    (NEGATIVE_ERRORS, ou encore dans le cache DNS négatif) sont passés
+    directement à `sink` en erreur, sans occuper de worker. Une erreur DNS
+    temporaire ne suffit pas à conclure: ces domaines sont scannés normalement.
+
+    Avec ADAPTIVE_CONCURRENCY, CONCURRENCY_MAX workers sont lancés mais le
+    nombre de scans simultanés est piloté par adaptive.ConcurrencyController
+    selon les latences et le taux d'erreurs observés.
+
+    Si l'événement `stop` est positionné, la file est abandonnée
+    (IPQueue.abort, ce qui réveille les workers en attente d'un jeton): les
+    workers terminent le domaine en cours et s'arrêtent sans prendre les suivants.
+
+    Débit, latences, erreurs, file et scans en cours sont comptés dans
+    backend.metrics (publiés par metrics.publishing, voir _run_scan).
+
+    Returns:
+        int: nombre de domaines scannés
+    """
+    controller = ConcurrencyController() if config.ADAPTIVE_CONCURRENCY and not workers else None
+    workers = workers or (controller.maximum if controller else config.CONCURRENCY)
+    queue = IPQueue(config.QUEUE_SIZE)
+    scanned = 0
+    metrics.CONCURRENCY_LIMIT.set(controller.limit if controller else workers)
+
+    def stopping():
+        return stop is not None and stop.is_set()
+
+    async def chunks():
+        chunk = []
+        async for item in _aiter(items):
+            if stopping():
+                return
+            chunk.append(item)
+            if len(chunk) >= config.STATE_LOOKUP_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def prepare(chunk):
+        domains = [domain for _, domain in chunk]
+        states = await lookup(domains) if lookup else {}
+        answers = {}
+        if resolver is not None:
+            # Pas de requête DNS pour les domaines encore dans le cache négatif
+            cached = {d for d in domains if (states.get(d) or {}).get("dns_error")}
+            answers = await resolver.resolve_many([d for d in domains if d not in cached])
+        return chunk, states, answers
+
+    async def put_chunk(prepared):
+        nonlocal scanned
+        chunk, states, answers = prepared
+        now = int(time.time())
+        for seq, domain in chunk:
+            if stopping():
+                return
+            state = states.get(domain)
+            if state is not None and state.get("dns_error"):
+                error, retry_at = state["dns_error"], state["dns_retry_at"]
+            elif domain in answers and answers[domain][1] in NEGATIVE_ERRORS:
+                error, retry_at = answers[domain][1], now + config.DNS_NEGATIVE_TTL
+            else:
+                # Clé de limitation: première IP résolue (nom d'hôte sans pré-résolution, ou
+                # après une erreur DNS temporaire: la connexion passera par getaddrinfo)
+                addresses = answers[domain][0] if domain in answers else None
+                await queue.put((seq, domain, state), ip_key(addresses[0] if addresses else host_of(domain)))
+                continue
+            # Domaine mort: résultat immédiat (planification et --resume), sans scan
+            result = {"domain": domain, "error": f"DNS: {error}", "seq": seq,
+                      "dns_error": error, "dns_retry_at": retry_at}
+            metrics.record_result(result)
+            await sink(result)
+            scanned += 1
+        metrics.QUEUE_DEPTH.set(len(queue))
+
+    async def produce():
+        # Un paquet d'avance: lecture d'état et DNS du suivant pendant le scan du courant
+        ahead = None
+        try:
+            async for chunk in chunks():
+                current, ahead = ahead, asyncio.ensure_future(prepare(chunk))
+                if current is not None:
+                    await put_chunk(await current)
+            if ahead is not None:
+                await put_chunk(await ahead)
+        finally:
+            if ahead is not None and not ahead.done():
+                await _cancel(ahead)
+            # Aussi en cas d'erreur de lecture de la source: les workers ne doivent pas attendre indéfiniment
+            queue.close()
+
+    async def report():
+        while True:
+            await asyncio.sleep(config.IP_REPORT_INTERVAL)
+            depths = [(key, count) for key, count in queue.depths() if count > 1]
+            if depths:
+                busiest = ", ".join(f"{key} ({count})" for key, count in depths)
+                print(f"📶 File: {len(queue)} domaines en attente; IP les plus chargées: {busiest}")
+
+    async def scan(item):
+        nonlocal scanned
+        seq, domain, state = item
+        metrics.QUEUE_DEPTH.set(len(queue))
+        metrics.IN_FLIGHT.inc()
+        try:
+            result = await scan_domain(session, domain, state)
+        finally:
+            metrics.IN_FLIGHT.dec()
+        result["seq"] = seq
+        if controller is not None:
+            # Timeouts et erreurs de connexion font baisser la concurrence
+            controller.record(None if "error" in result else result["latency_ms"])
+            metrics.CONCURRENCY_LIMIT.set(controller.limit)
+        metrics.record_result(result)
+        await sink(result)
+        scanned += 1
+
+    async def watch():
+        # Les workers bloqués dans get() (attente d'un jeton) ou acquire() ne verraient pas l'arrêt
+        await stop.wait()
+        queue.abort()
+        if controller is not None:
+            controller.close()
+
+    async def work():
+        while not stopping():
+            if controller is None:
+                item = await queue.get()
+                if item is None or stopping():
+                    return
+                await scan(item)
+                continue
+            # Créneau pris avant get(): seuls `limit` workers dépensent les jetons des IP,
+            # les autres n'immobilisent pas de domaines dont le jeton est déjà consommé
+            if not await controller.acquire():
+                return
+            try:
+                item = await queue.get()
+                if item is None or stopping():
+                    return
+                await scan(item)
+            finally:
+                controller.release()
+
+    producer = asyncio.create_task(produce())
+    reporter = asyncio.create_task(report())
+    watcher = asyncio.create_task(watch()) if stop is not None else None
+    tasks = [asyncio.create_task(work()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+        if producer.done() and not producer.cancelled() and producer.exception() is not None:
+            # Source illisible: remonter l'erreur au lieu d'annoncer un scan terminé
+            raise producer.exception()
+    finally:
+        await _cancel(producer, reporter, watcher, *tasks)
+    return scanned
+
+
+def scanner_session(resolver=None):
+    """
+    Session HTTP du scanner (connexions limitées à CONCURRENCY, ou
+    CONCURRENCY_MAX quand la concurrence est adaptative).
+
+    Avec un resolver.DNSResolver, les connexions utilisent ses adresses en
+    cache au lieu de getaddrinfo.
+    """
+    dns = resolver.aiohttp_resolver() if resolver is not None else None
+    limit = config.CONCURRENCY_MAX if config.ADAPTIVE_CONCURRENCY else config.CONCURRENCY
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=2, resolver=dns)
+    return aiohttp.ClientSession(connector=connector, headers={'User-Agent': config.USER_AGENT})
+
+
+def shard_of(domain, shards):
+    """Numéro de shard d'un domaine (hash stable entre process et entre runs)"""
+    return zlib.crc32(domain.encode()) % shards
+
+
+class CatalogSource:
+    """Source de domaines: le catalogue (table domains), limité à une source d'ingestion si `source` est donnée"""
+
+    def __init__(self, source=None):
+        self.source = source
+
+    @property
+    def name(self):
+        """Nom du run dans scan_runs"""
+        return f"catalog:{self.source or 'all'}"
+
+
+def _open_source(source):
+    """Lignes d'une source de domaines: chemin de fichier (.dset ou texte) ou liste déjà en mémoire"""
+    if isinstance(source, str):
+        return domainset.open_domains(source)
+    return contextlib.nullcontext(source)
+
+
+async def _iter_source(source, limit=None, done=b"", shard=0, shards=1):
+    """
+    Couples (seq, domaine) à scanner d'une source, sans les domaines déjà
+    terminés (`done`) ni ceux des autres shards.
+
+    Pour le catalogue, seq est l'id du domaine (stable d'un run à l'autre,
+    pour --resume); pour un fichier, sa position dans la liste.
+    """
+    if isinstance(source, CatalogSource):
+        count = 0
+        async for seq, domain in db.iter_catalog(source.source):
+            if limit and count >= limit:
+                return
+            count += 1
+            if (shards == 1 or shard_of(domain, shards) == shard) and not is_done(done, seq):
+                yield seq, domain
+        return
+    with _open_source(source) as lines:
+        for seq, domain in enumerate(iter_domains(lines, limit)):
+            if (shards == 1 or shard_of(domain, shards) == shard) and not is_done(done, seq):
+                yield seq, domain
+
+
+def _scan_shard(source, limit, shard, shards, done, results):
+    """
+    Process worker: scanne les domaines de son shard dans sa propre boucle
+    asyncio et envoie chaque résultat au process parent via `results`.
+
+    SIGTERM (envoyé par le parent lors d'un arrêt) termine les scans en cours
+    avant de quitter.
+    """
+    async def sink(result):
+        results.put(result)
+
+    async def run():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        items = _iter_source(source, limit, done, shard, shards)
+        async with metrics.publishing(), open_resolver() as resolver, scanner_session(resolver) as session:
+            await scan_pipeline(session, items, sink, stop=stop, resolver=resolver)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    # Fin normale seulement: une exception termine le process sans ce message (code de sortie non nul)
+    results.put(None)
+
+
+def _drain(results, max_items=500):
+    """Attend un résultat (1 s max) puis récupère ceux déjà disponibles"""
+    try:
+        items = [results.get(timeout=1)]
+    except queue.Empty:
+        return []
+    try:
+        while len(items) < max_items:
+            items.append(results.get_nowait())
+    except queue.Empty:
+        pass
+    return items
+
+
+async def _scan_sharded(source, limit, workers, sink, done, stop):
+    """
+    Répartit les domaines sur `workers` process (shard = crc32(domaine) % workers).
+
+    Chaque process lit la source (fichier ou catalogue), garde son shard et le scanne avec son propre
+    pipeline; le parent fusionne les résultats et reste le seul écrivain DB.
+    Quand `stop` est positionné, les process reçoivent SIGTERM et le parent
+    continue de recevoir leurs derniers résultats.
+
+    Un process qui meurt (exception, tué) est signalé avec son code de sortie.
+
+    Returns:
+        tuple: (domaines scannés, True si tous les process ont terminé normalement)
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue(maxsize=config.QUEUE_SIZE * workers)
+    processes = [
+        ctx.Process(target=_scan_shard, args=(source, limit, shard, workers, done, results), daemon=True)
+        for shard in range(workers)
+    ]
+    for proc in processes:
+        proc.start()
+
+    loop = asyncio.get_running_loop()
+    scanned = 0
+    finished = 0
+    signalled = False
+    try:
+        while finished < workers:
+            if stop.is_set() and not signalled:
+                for proc in processes:
+                    proc.terminate()
+                signalled = True
+            items = await loop.run_in_executor(None, _drain, results)
+            if not items and not any(proc.is_alive() for proc in processes):
                 break
-        
-        # Styles inline excessifs (signe de vieux CMS)
-        if body_lower.count('style=') > 20:
-            score += 5
-            reasons.append("Nombreux styles inline")
-        
-        # Absence de meta viewport (mobile)
-        if 'viewport' not in body_lower:
-            score += 5
-            reasons.append("Pas de meta viewport")
-        
-        # Détection de vieux CMS (AMÉLIORÉ)
-        if 'joomla! 1.' in body_lower or 'joomla! 2.' in body_lower:
-            score += 25
-            reasons.append("Joomla! 1.x/2.x (très ancien, vulnérable)")
-        elif 'joomla! 3.0' in body_lower or 'joomla! 3.1' in body_lower or 'joomla! 3.2' in body_lower:
-            score += 20
-            reasons.append("Joomla! 3.0-3.2 (ancien)")
-        
-        if 'wordpress' in body_lower:
-            # Recherche de version
-            wp_version = re.search(r'wordpress[/\s]+(\d+\.\d+)', body_lower)
-            if wp_version:
-                try:
-                    version = float(wp_version.group(1))
-                    if version < 3.0:
-                        score += 30
-                        reasons.append(f"WordPress {version} (très ancien, vulnérable)")
-                    elif version < 4.0:
-                        score += 20
-                        reasons.append(f"WordPress {version} (ancien)")
-                    elif version < 5.0:
-                        score += 10
-                        reasons.append(f"WordPress {version} (dépassé)")
-                except:
-                    pass
-        
-        # Détecter d'autres vieux CMS
-        if 'typo3 4.' in body_lower:
-            score += 20
-            reasons.append("TYPO3 4.x (ancien)")
-        if 'drupal 6' in body_lower or 'drupal 7' in body_lower:
-            score += 20
-            reasons.append("Drupal 6/7 (ancien)")
-        
-        # Détecter du contenu réel (BONUS pour sites actifs)
-        has_real_content = False
-        content_indicators = ['<article', '<section', '<nav', '<main', '<p>', '<h1', '<h2']
-        content_count = sum(1 for indicator in content_indicators if indicator in body_lower)
-        if content_count >= 3:
-            has_real_content = True
-            score += 10
-            reasons.append("Site avec contenu structuré (actif)")
-        
-        # Détecter des images (signe de site actif)
-        img_count = body_lower.count('<img')
-        if img_count > 5:
-            score += 5
-            reasons.append(f"Site avec images ({img_count} images)")
-        
-        # Generator meta tag
-        generator_match = re.search(r'<meta\s+name=["\']generator["\']\s+content=["\']([^"\']+)', body_lower)
-        if generator_match:
-            gen = generator_match.group(1).lower()
-            if 'frontpage' in gen or 'dreamweaver' in gen or 'golive' in gen:
-                score += 20
-                reasons.append(f"Générateur ancien: {gen}")
+            for item in items:
+                if item is None:
+                    finished += 1
+                    continue
+                await sink(item)
+                scanned += 1
+    finally:
+        for proc in processes:
+            # Un process qui a envoyé sa fin peut encore vider sa file: le laisser sortir
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+
+    # SIGTERM envoyé par le parent lors d'un arrêt: pas une erreur
+    expected = (0, -signal.SIGTERM) if signalled else (0,)
+    failed = [(shard, proc.exitcode) for shard, proc in enumerate(processes) if proc.exitcode not in expected]
+    for shard, code in failed:
+        print(f"❌ Process worker du shard {shard} arrêté avec le code {code}: ses domaines restent à scanner")
+    if finished < workers and not failed:
+        print(f"❌ {workers - finished} process workers se sont arrêtés sans terminer")
+    return scanned, finished == workers and not failed
+
+
+async def _open_run(name, resume, size=0, mtime=0):
+    """
+    Crée un run de scan, ou reprend le dernier run interrompu de la source
+    (chemin du fichier, ou CatalogSource.name).
+
+    Returns:
+        tuple: (run_id, bitmap des domaines déjà terminés)
+    """
+    run = await db.last_unfinished_run(name) if resume else None
+    if resume and run is None:
+        print("ℹ️  Aucun run interrompu pour cette source: nouveau run")
+    elif run is not None and (run["file_size"], run["file_mtime"]) != (size, mtime):
+        print(f"⚠️  Fichier modifié depuis le run {run['id']}: reprise impossible, nouveau run")
+        run = None
+
+    if run is None:
+        return await db.start_run(name, size, mtime), bytearray()
+
+    await db.resume_run(run["id"])
+    done, count = await db.load_done(run["id"])
+    print(f"↩️  Reprise du run {run['id']}: {count} domaines déjà traités")
+    return run["id"], done
+
+
+async def _run_scan(source, limit=None, workers=1, run_id=None, done=b""):
+    """
+    Scanne une source de domaines (fichier, liste ou catalogue) jusqu'au bout ou jusqu'à SIGTERM.
+
+    SIGTERM (systemd, /api/job/stop) termine les scans en cours et écrit les
+    résultats en attente avant de rendre la main.
+
+    Returns:
+        tuple: (domaines scannés, True si la source a été entièrement traitée)
+    """
+    async def sink(result):
+        await record_result(result, run_id)
     
-    # 6. Absence de headers de sécurité modernes
-    security_headers = ['strict-transport-security', 'x-frame-options', 'x-content-type-options', 'content-security-policy']
-    missing_security = sum(1 for h in security_headers if h not in headers_lower)
-    if missing_security == 4:
-        score += 15
-        reasons.append("Aucun header de sécurité moderne")
-    elif missing_security >= 3:
-        score += 10
-        reasons.append(f"Manque {missing_security}/4 headers de sécurité")
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
     
-    # 7. Détecter les technologies modernes (PÉNALITÉ - site probablement récent)
-    modern_tech = ['react', 'vue.js', 'angular', 'next.js', 'nuxt', 'tailwind', 'bootstrap 5']
-    if body_sample:
-        body_lower = body_sample.lower()
-        for tech in modern_tech:
-            if tech in body_lower:
-                score -= 15
-                reasons.append(f"Technologie moderne détectée: {tech}")
-                break
+    def on_sigterm():
+        print("🛑 Arrêt demandé: fin des scans en cours et écriture des résultats")
+        stop.set()
+    
+    loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    completed = True
     
-    return score, "; ".join(reasons) if reasons else "Aucun critère d'ancienneté détecté"
+    # Métriques du process (writer DB, et pipeline sans --workers) pour /metrics
+    async with metrics.publishing():
+        # Writer unique: les résultats sont écrits par lots dans une seule connexion
+        await db.start_writer()
+        try:
+            if workers > 1:
+                # Un process mort laisse le run interrompu: --resume reprendra ses domaines
+                scanned, completed = await _scan_sharded(source, limit, workers, sink, done, stop)
+            else:
+                items = _iter_source(source, limit, done)
+                async with open_resolver() as resolver, scanner_session(resolver) as session:
+                    scanned = await scan_pipeline(session, items, sink, stop=stop, resolver=resolver)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            await db.stop_writer()
+    return scanned, completed and not stop.is_set()
 
 
-async def scan_domain(session, domain, semaphore):
-    """Scanne un domaine et retourne les résultats"""
-    async with semaphore:
-        start_time = time.time()
-        
-        # Essayer HTTPS d'abord, puis HTTP
-        for scheme in ['https', 'http']:
-            url = f"{scheme}://{domain}"
-            try:
-                # HEAD request pour les headers
-                async with session.head(url, timeout=aiohttp.ClientTimeout(total=config.HEAD_TIMEOUT), 
-                                       allow_redirects=True) as resp:
-                    headers = dict(resp.headers)
-                    http_code = resp.status
-                    
-                    # GET partiel pour le body
-                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=config.PARTIAL_GET_TIMEOUT),
-                                          allow_redirects=True) as resp2:
-                        body_bytes = await resp2.content.read(config.SAMPLE_BYTES)
-                        body_sample = body_bytes.decode('utf-8', errors='ignore')
-                    
-                    latency_ms = int((time.time() - start_time) * 1000)
-                    
-                    # Scoring (passer le code HTTP)
-                    score, reasons = score_site(headers, body_sample, http_code)
-                    
-                    # Bonus si pas HTTPS
-                    if scheme == 'http':
-                        score += 25
-                        reasons = f"Pas de HTTPS; {reasons}"
-                    
-                    # Sauvegarder si score suffisant
-                    if score >= config.SCORE_THRESHOLD:
-                        headers_str = "\n".join(f"{k}: {v}" for k, v in headers.items())
-                        await db.add_scan(domain, http_code, headers_str, body_sample, score, reasons, latency_ms)
-                        print(f"✓ {domain} - Score: {score} - {reasons[:80]}")
-                    else:
-                        print(f"○ {domain} - Score: {score} (trop faible)")
-                    
-                    return
-                    
-            except asyncio.TimeoutError:
-                print(f"⏱ {domain} - Timeout")
-                continue
-            except aiohttp.ClientError as e:
-                print(f"✗ {domain} - Erreur: {type(e).__name__}")
-                continue
-            except Exception as e:
-                print(f"✗ {domain} - Erreur inattendue: {e}")
-                continue
-        
-        # Si aucun schéma n'a fonctionné
-        print(f"✗ {domain} - Inaccessible")
+def _print_header(label, workers):
+    if config.ADAPTIVE_CONCURRENCY:
+        concurrency = f"{config.CONCURRENCY} (adaptative {config.CONCURRENCY_MIN}-{config.CONCURRENCY_MAX})"
+    else:
+        concurrency = config.CONCURRENCY
+    if workers > 1:
+        print(f"🔍 Scan {label} sur {workers} process, concurrence={concurrency} par process")
+    else:
+        print(f"🔍 Scan {label} avec concurrence={concurrency}")
+    print(f"📊 Seuil de score: {config.SCORE_THRESHOLD}")
+    print("-" * 80)
+
 
+async def scan_domains_from_file(domains_file, limit=None, workers=1, resume=False):
+    """
+    Scanne une liste de domaines depuis un fichier (lue en streaming).
 
-async def scan_domains_from_file(domains_file, limit=None):
-    """Scanne une liste de domaines depuis un fichier"""
+    Avec workers > 1, le scan est réparti sur plusieurs process (un par cœur).
+    Chaque run est enregistré (scan_runs) et chaque domaine terminé est marqué
+    au fil de l'eau: avec resume=True, le dernier run interrompu est repris
+    sans rescanner ses domaines.
+    """
     # Initialiser la DB
     await db.init_db()
     
-    # Lire les domaines
-    try:
-        with open(domains_file, 'r') as f:
-            domains = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-    except FileNotFoundError:
+    if not os.path.exists(domains_file):
         print(f"❌ Fichier {domains_file} introuvable")
         return
     
-    if limit:
-        domains = domains[:limit]
+    stat = os.stat(domains_file)
+    run_id, done = await _open_run(os.path.abspath(domains_file), resume, stat.st_size, int(stat.st_mtime))
+    _print_header(f"des domaines .ch de {domains_file} (run {run_id})", workers)
+    await _scan_run(domains_file, limit, workers, run_id, done)
+
+
+async def scan_catalog(source=None, limit=None, workers=1, resume=False):
+    """
+    Scanne tout le catalogue (table domains), ou les domaines d'une source.
+
+    Le catalogue est lu par pages (db.iter_catalog) au fil du scan, sans
+    relire de liste; comme pour un fichier, le run est enregistré et peut
+    être repris avec resume=True.
+    """
+    await db.init_db()
+    catalog = CatalogSource(source)
+    if await db.catalog_empty():
+        print("❌ Catalogue vide (voir python -m backend.ingest)")
+        return
     
-    print(f"🔍 Scan de {len(domains)} domaines .ch avec concurrence={config.CONCURRENCY}")
-    print(f"📊 Seuil de score: {config.SCORE_THRESHOLD}")
-    print("-" * 80)
+    run_id, done = await _open_run(catalog.name, resume)
+    _print_header(f"du catalogue ({source or 'toutes sources'}, run {run_id})", workers)
+    await _scan_run(catalog, limit, workers, run_id, done)
+
+
+async def _scan_run(source, limit, workers, run_id, done):
+    """Scan d'un run enregistré, clôturé même en cas d'interruption"""
+    completed = False
+    try:
+        scanned, completed = await _run_scan(source, limit, workers, run_id, done)
+    finally:
+        await db.finish_run(run_id, "completed" if completed else "interrupted")
     
-    # Scanner avec concurrence limitée
-    semaphore = asyncio.Semaphore(config.CONCURRENCY)
-    connector = aiohttp.TCPConnector(limit=config.CONCURRENCY, limit_per_host=2)
+    print("-" * 80)
+    if completed:
+        print(f"✅ Scan terminé: {scanned} domaines")
+    else:
+        print(f"⏸️  Scan interrompu: {scanned} domaines (reprendre avec --resume)")
+
+
+async def import_domains_file(domains_file, source="import"):
+    """
+    Ajoute les domaines d'un fichier (.dset ou texte) au catalogue, pour
+    --schedule et --catalog (voir db.ingest_domains).
+
+    Returns:
+        dict: {"seen", "added"} (None si le fichier est introuvable)
+    """
+    await db.init_db()
+    if not os.path.exists(domains_file):
+        print(f"❌ Fichier {domains_file} introuvable")
+        return None
+    with domainset.open_domains(domains_file) as lines:
+        stats = await db.ingest_domains(iter_domains(lines), source)
+    print(f"📥 {domains_file} ({source}): {stats['seen']} domaines lus, {stats['added']} nouveaux dans le catalogue")
+    return stats
+
+
+async def scan_scheduled(budget=None, workers=1):
+    """
+    Scanne les `budget` prochains domaines choisis par le planificateur.
+
+    Les domaines viennent du catalogue (voir backend.ingest et
+    db.next_domains): re-scans dus en priorité, puis domaines jamais scannés.
+    Un scan interrompu n'a pas besoin de --resume: les domaines déjà traités
+    ont été replanifiés et ne sont plus dus.
+    """
+    await db.init_db()
+    budget = budget or config.SCHEDULE_BUDGET
+    domains = await db.next_domains(budget)
+    if not domains:
+        print("✅ Aucun domaine à scanner (importer une liste avec --import ou backend.ingest)")
+        return
     
-    async with aiohttp.ClientSession(
-        connector=connector,
-        headers={'User-Agent': config.USER_AGENT}
-    ) as session:
-        tasks = [scan_domain(session, domain, semaphore) for domain in domains]
-        await asyncio.gather(*tasks)
+    _print_header(f"planifié de {len(domains)} domaines (budget {budget})", workers)
+    scanned, completed = await _run_scan(domains, None, workers)
     
     print("-" * 80)
-    print("✅ Scan terminé")
+    if completed:
+        print(f"✅ Scan terminé: {scanned} domaines")
+    else:
+        print(f"⏸️  Scan interrompu: {scanned} domaines")
 
 
 async def generate_sample_domains():
-    """Génère un fichier d'exemple avec des domaines .ch"""
+    """Génère un fichier d'exemple (.dset) avec des domaines .ch"""
     sample_domains = [
-        "# Fichier d'exemple de domaines .ch à scanner",
-        "# Un domaine par ligne, les lignes commençant par # sont ignorées",
-        "",
         "admin.ch",
         "sbb.ch",
         "cff.ch",
@@ -325,8 +883,7 @@ async def generate_sample_domains():
         "watson.ch",
     ]
     
-    with open(config.DOMAINS_FILE, 'w') as f:
-        f.write("\n".join(sample_domains))
+    domainset.write(config.DOMAINS_FILE, sorted(sample_domains))
     
     print(f"✅ Fichier d'exemple créé: {config.DOMAINS_FILE}")
 
@@ -337,15 +894,39 @@ def main():
     parser.add_argument('--limit', type=int, help='Nombre maximum de domaines à scanner')
     parser.add_argument('--generate-sample', action='store_true', 
                        help='Génère un fichier d\'exemple de domaines')
-    parser.add_argument('--domains-file', default=config.DOMAINS_FILE,
-                       help='Fichier contenant la liste des domaines')
+    parser.add_argument('--domains-file',
+                       help=f'Fichier contenant la liste des domaines (défaut: {config.DOMAINS_FILE}, sinon {config.LEGACY_DOMAINS_FILE})')
+    parser.add_argument('--store-all', action='store_true',
+                       help='Stocke headers et échantillon de tous les domaines (pas seulement au-dessus du seuil)')
+    parser.add_argument('--workers', type=int, default=config.SCAN_WORKERS,
+                       help='Nombre de process de scan (un par cœur; 1 = un seul process)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Reprendre le dernier scan interrompu de ce fichier sans rescanner les domaines terminés')
+    parser.add_argument('--import', dest='import_domains', action='store_true',
+                       help='Ajoute le fichier de domaines au catalogue (source import) pour le scan planifié')
+    parser.add_argument('--catalog', nargs='?', const='all', choices=('all',) + db.SOURCES,
+                       help='Scanne le catalogue (toutes sources, ou une seule) au lieu d\'un fichier')
+    parser.add_argument('--schedule', action='store_true',
+                       help=f'Scan planifié: --limit domaines choisis dans la base (défaut: {config.SCHEDULE_BUDGET})')
     
     args = parser.parse_args()
     
+    if args.store_all:
+        config.STORE_ALL_SCANS = True
+    
+    workers = max(1, args.workers)
     if args.generate_sample:
         asyncio.run(generate_sample_domains())
+    elif args.import_domains:
+        asyncio.run(import_domains_file(args.domains_file or domainset.default_file()))
+    elif args.schedule:
+        asyncio.run(scan_scheduled(args.limit, workers))
+    elif args.catalog:
+        source = None if args.catalog == 'all' else args.catalog
+        asyncio.run(scan_catalog(source, args.limit, workers, args.resume))
     else:
-        asyncio.run(scan_domains_from_file(args.domains_file, args.limit))
+        domains_file = args.domains_file or domainset.default_file()
+        asyncio.run(scan_domains_from_file(domains_file, args.limit, workers, args.resume))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,374 @@
+"""
+Moteur de règles du scoring d'ancienneté.
+
+Les signatures (versions Apache/IIS/PHP, DOCTYPE, mots-clés parking, balises
+obsolètes, CMS, frameworks modernes...) et leurs poids sont décrits dans un
+fichier JSON versionné (config.SCORING_RULES_FILE), compilé une seule fois
+au chargement et rechargeable à chaud (reload / reload_if_changed). À l'évaluation, le body est mis en
+minuscules une seule fois; les littéraux qui partagent un préfixe (ex: les
+cinq signatures "joomla! ...") sont précédés d'une recherche unique de ce
+préfixe, mémorisée pour la page: s'il est absent, aucun d'eux n'est cherché.
+
+Types de règles (évaluées dans l'ordre):
+    status           code HTTP dans [min, max]
+    header           la valeur d'un header contient un des littéraux de `any`
+    missing_headers  au moins `min_missing` headers de `headers` sont absents
+    short_body       body vide ou plus court que `min_length`
+    body             littéraux `any` (au moins `min_matches`), `absent`,
+                     `count` (au moins `min_count` occurrences) ou `regex`
+                     (avec `capture_any` ou `below` sur le premier groupe)
+
+Options communes: `score`, `reason` (gabarit: {status}, {value}, {match},
+{count}, {capture}, {version}), `group` (seule la première règle d'un groupe
+qui correspond est appliquée) et `stop` (arrête le scoring).
+"""
+
+import json
+import os
+import re
+import time
+from backend import config
+
+
+# Longueur des préfixes utilisés pour regrouper les littéraux
+GATE_PREFIX_LEN = 4
+
+DEFAULT_REASON = "Aucun critère d'ancienneté détecté"
+
+# Ensemble de règles actif (chargé au premier appel de current())
+_current = None
+_last_check = 0.0
+
+
+class _Sample:
+    """Body mis en minuscules une fois, avec mémoïsation des préfixes et regex"""
+
+    __slots__ = ("raw", "text", "gates", "_matches")
+
+    def __init__(self, raw):
+        self.raw = raw or ""
+        self.text = self.raw.lower()
+        self.gates = {}
+        self._matches = {}
+
+    def search(self, regex):
+        """Première correspondance de la regex (mémorisée si plusieurs règles la partagent)"""
+        if regex in self._matches:
+            return self._matches[regex]
+        match = self._matches[regex] = regex.search(self.text)
+        return match
+
+
+class Rule:
+    """Règle compilée: check(http_code, headers_lower, sample) -> raison ou None"""
+
+    __slots__ = ("id", "score", "group", "stop", "check")
+
+    def __init__(self, spec, check):
+        self.id = spec["id"]
+        self.score = spec.get("score", 0)
+        self.group = spec.get("group")
+        self.stop = spec.get("stop", False)
+        self.check = check
+
+
+def _compile_status(spec, gates):
+    low = spec.get("min", 0)
+    high = spec.get("max", 999)
+    reason = spec["reason"]
+
+    def check(http_code, headers, sample):
+        if low <= http_code <= high:
+            return reason.format(status=http_code)
+        return None
+    return check
+
+
+def _compile_header(spec, gates):
+    name = spec["header"].lower()
+    literals = tuple(p.lower() for p in spec["any"])
+    reason = spec["reason"]
+
+    def check(http_code, headers, sample):
+        value = headers.get(name, "").lower()
+        for literal in literals:
+            if literal in value:
+                return reason.format(value=value, match=literal)
+        return None
+    return check
+
+
+def _compile_missing_headers(spec, gates):
+    names = tuple(h.lower() for h in spec["headers"])
+    minimum = spec.get("min_missing", len(names))
+    reason = spec["reason"]
+
+    def check(http_code, headers, sample):
+        missing = sum(1 for h in names if h not in headers)
+        if missing >= minimum:
+            return reason.format(count=missing)
+        return None
+    return check
+
+
+def _compile_short_body(spec, gates):
+    minimum = spec["min_length"]
+    reason = spec["reason"]
+
+    def check(http_code, headers, sample):
+        if len(sample.raw) < minimum:
+            return reason
+        return None
+    return check
+
+
+def _compile_body(spec, gates):
+    reason = spec["reason"]
+
+    if "any" in spec:
+        literals = tuple((p.lower(), gates.get(p.lower())) for p in spec["any"])
+        needed = spec.get("min_matches", 1)
+
+        def check(http_code, headers, sample):
+            text = sample.text
+            seen = sample.gates
+            found = 0
+            first = None
+            for literal, gate in literals:
+                if gate is not None:
+                    present = seen.get(gate)
+                    if present is None:
+                        present = seen[gate] = gate in text
+                    if not present:
+                        continue
+                if literal in text:
+                    found += 1
+                    if first is None:
+                        first = literal
+                    if found >= needed:
+                        return reason.format(match=first, count=found)
+            return None
+        return check
+
+    if "absent" in spec:
+        literals = tuple(p.lower() for p in spec["absent"])
+
+        def check(http_code, headers, sample):
+            text = sample.text
+            for literal in literals:
+                if literal in text:
+                    return None
+            return reason
+        return check
+
+    if "count" in spec:
+        literal = spec["count"].lower()
+        minimum = spec.get("min_count", 1)
+
+        def check(http_code, headers, sample):
+            count = sample.text.count(literal)
+            if count >= minimum:
+                return reason.format(count=count)
+            return None
+        return check
+
+    if "regex" in spec:
+        # Les regex commençant par un littéral sont déjà parcourues rapidement par re
+        regex = re.compile(spec["regex"])
+        capture_any = tuple(p.lower() for p in spec.get("capture_any", ()))
+        below = spec.get("below")
+
+        def check(http_code, headers, sample):
+            match = sample.search(regex)
+            if match is None:
+                return None
+            if capture_any:
+                capture = match.group(1).lower()
+                if not any(p in capture for p in capture_any):
+                    return None
+                return reason.format(capture=capture)
+            if below is not None:
+                try:
+                    version = float(match.group(1))
+                except ValueError:
+                    return None
+                if version >= below:
+                    return None
+                return reason.format(version=version)
+            return reason
+        return check
+
+    raise ValueError(f"Règle body sans critère: {spec['id']}")
+
+
+def _build_gates(rules):
+    """
+    Associe à chaque littéral de body le préfixe commun de son groupe.
+
+    Les littéraux sont regroupés par leurs GATE_PREFIX_LEN premiers caractères;
+    un groupe d'au moins deux littéraux partage une recherche de leur plus long
+    préfixe commun.
+    """
+    groups = {}
+    for spec in rules:
+        if spec.get("type") != "body":
+            continue
+        for literal in spec.get("any", ()):
+            literal = literal.lower()
+            if len(literal) > GATE_PREFIX_LEN:
+                groups.setdefault(literal[:GATE_PREFIX_LEN], set()).add(literal)
+
+    gates = {}
+    for literals in groups.values():
+        if len(literals) < 2:
+            continue
+        gate = os.path.commonprefix(sorted(literals))
+        for literal in literals:
+            gates[literal] = gate
+    return gates
+
+
+_COMPILERS = {
+    "status": _compile_status,
+    "header": _compile_header,
+    "missing_headers": _compile_missing_headers,
+    "short_body": _compile_short_body,
+    "body": _compile_body,
+}
+
+
+class RuleSet:
+    """Ensemble de règles compilées, évaluées dans l'ordre"""
+
+    def __init__(self, rules, default_reason=DEFAULT_REASON, version=None,
+                 no_https=None, path=None, mtime=None):
+        self.version = version
+        self.default_reason = default_reason
+        self.no_https = no_https
+        self.path = path
+        self.mtime = mtime
+        gates = _build_gates(rules)
+        # Headers lus par les règles (empreinte du contenu, voir scan_ch_sites.fingerprint)
+        names = set()
+        for spec in rules:
+            if spec.get("type") == "header":
+                names.add(spec["header"].lower())
+            elif spec.get("type") == "missing_headers":
+                names.update(h.lower() for h in spec["headers"])
+        self.header_names = tuple(sorted(names))
+        self.rules = []
+        for spec in rules:
+            compiler = _COMPILERS.get(spec.get("type"))
+            if compiler is None:
+                raise ValueError(f"Type de règle inconnu pour {spec.get('id')}: {spec.get('type')}")
+            self.rules.append(Rule(spec, compiler(spec, gates)))
+        # Plan d'évaluation à plat (évite les accès d'attributs dans la boucle)
+        self._plan = tuple((r.check, r.score, r.group, r.stop) for r in self.rules)
+
+    def score(self, headers, body_sample, http_code, scheme="https"):
+        """Retourne (score, raisons) pour une réponse HTTP"""
+        score, reasons = self._score(headers, body_sample, http_code)
+        # Bonus si le site n'a répondu qu'en HTTP
+        if scheme == "http" and self.no_https:
+            score += self.no_https["score"]
+            reasons = f"{self.no_https['reason']}; {reasons}"
+        return score, reasons
+
+    def _score(self, headers, body_sample, http_code):
+        headers_lower = {k.lower(): v for k, v in headers.items()}
+        sample = _Sample(body_sample)
+        score = 0
+        reasons = []
+        matched_groups = set()
+
+        for check, points, group, stop in self._plan:
+            if group is not None and group in matched_groups:
+                continue
+            reason = check(http_code, headers_lower, sample)
+            if reason is None:
+                continue
+            score += points
+            reasons.append(reason)
+            if group is not None:
+                matched_groups.add(group)
+            if stop:
+                return score, "; ".join(reasons)
+
+        return score, "; ".join(reasons) if reasons else self.default_reason
+
+
+def load_rules(path=None):
+    """
+    Charge et compile un fichier de règles JSON.
+
+    Lève ValueError si le fichier est invalide (JSON, type de règle, regex).
+    """
+    path = path or config.SCORING_RULES_FILE
+    mtime = os.stat(path).st_mtime
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON invalide dans {path}: {e}")
+    if "version" not in data or "rules" not in data:
+        raise ValueError(f"{path}: les clés 'version' et 'rules' sont obligatoires")
+    try:
+        return RuleSet(
+            data["rules"],
+            default_reason=data.get("default_reason", DEFAULT_REASON),
+            version=str(data["version"]),
+            no_https=data.get("no_https"),
+            path=path,
+            mtime=mtime,
+        )
+    except (KeyError, re.error) as e:
+        raise ValueError(f"Règle invalide dans {path}: {e}")
+
+
+def current():
+    """Retourne l'ensemble de règles actif (chargé au premier appel)"""
+    global _current
+    if _current is None:
+        _current = load_rules()
+    return _current
+
+
+def reload(path=None):
+    """
+    Recharge les règles depuis le fichier.
+
+    En cas d'erreur, l'ensemble actif est conservé et l'erreur est levée.
+    """
+    global _current
+    _current = load_rules(path)
+    return _current
+
+
+def reload_if_changed():
+    """
+    Recharge les règles si le fichier a changé depuis le dernier chargement.
+
+    Le fichier est vérifié au plus une fois toutes les SCORING_RELOAD_CHECK
+    secondes: l'appel est assez léger pour être fait avant chaque scoring.
+    """
+    global _last_check
+    ruleset = current()
+    now = time.monotonic()
+    if now - _last_check < config.SCORING_RELOAD_CHECK:
+        return ruleset
+    _last_check = now
+    try:
+        mtime = os.stat(ruleset.path).st_mtime
+        if mtime == ruleset.mtime:
+            return ruleset
+        ruleset = reload(ruleset.path)
+        print(f"🔄 Règles de scoring rechargées (version {ruleset.version})")
+        return ruleset
+    except (OSError, ValueError) as e:
+        # Ne pas réessayer tant que le fichier n'est pas modifié à nouveau
+        try:
+            ruleset.mtime = os.stat(ruleset.path).st_mtime
+        except OSError:
+            pass
+        print(f"⚠️  Règles de scoring non rechargées: {e}")
+        return ruleset
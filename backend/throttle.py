@@ -0,0 +1,195 @@
+"""
+Limitation du débit par adresse IP (ou par préfixe) pendant un scan.
+
+Des milliers de domaines .ch sont hébergés sur les mêmes IP mutualisées: la
+limite de connexions d'aiohttp, par nom d'hôte, ne les protège pas. La file
+du pipeline de scan est donc répartie par clé (IP résolue, ou réseau
+/IP_PREFIX pour regrouper un hébergeur), avec un token bucket par clé:
+au plus IP_BURST domaines d'affilée, puis IP_RATE domaines par seconde.
+Les workers prennent toujours le prochain domaine dont la clé a un jeton, ce
+qui entrelace les hébergeurs au lieu de les solliciter en rafale.
+
+Une clé n'occupe pas plus de IP_KEY_PENDING places de la file: au-delà, ses
+domaines sont mis de côté (jusqu'à IP_SPILL_SIZE domaines, toutes clés
+confondues) et rejoignent la file à mesure qu'elle se vide. Un hébergeur qui
+porte une grande part de la zone ne bloque donc pas la lecture des domaines
+des autres IP: son débit reste limité sans imposer le rythme de tout le scan.
+"""
+
+import asyncio
+import heapq
+import ipaddress
+import itertools
+import time
+from collections import deque
+from backend import config
+
+
+def ip_key(address, prefix=None):
+    """Clé de limitation d'une adresse: l'IP elle-même ou son réseau /prefix (IPv6: /64 au plus)"""
+    prefix = config.IP_PREFIX if prefix is None else prefix
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        # Pas d'IP connue (résolution laissée à aiohttp): limitation par nom d'hôte
+        return address
+    if ip.version == 6:
+        prefix = min(prefix * 2, 64)
+    if prefix >= ip.max_prefixlen:
+        return address
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class TokenBucket:
+    """Seau à jetons: `burst` jetons au plus, rechargé de `rate` jetons par seconde"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Secondes avant qu'un jeton soit disponible"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class IPQueue:
+    """
+    File bornée de domaines répartie par clé IP, avec un token bucket par clé.
+
+    put(item, key) attend s'il y a déjà `maxsize` éléments en attente (ou,
+    pour une clé qui a déjà `key_size` éléments, si `spill_size` éléments
+    sont déjà mis de côté); get() retourne le prochain élément dont la clé a un jeton (en attendant
+    le premier jeton disponible), ou None quand la file est fermée et vide.
+    abort() (arrêt du scan) vide la file et réveille put() et get() en attente.
+    """
+
+    def __init__(self, maxsize=None, rate=None, burst=None, key_size=None, spill_size=None):
+        self.maxsize = maxsize or config.QUEUE_SIZE
+        self.rate = rate or config.IP_RATE
+        self.burst = burst or config.IP_BURST
+        self.key_size = key_size or config.IP_KEY_PENDING
+        self.spill_size = spill_size or config.IP_SPILL_SIZE
+        self._pending = {}      # clé -> deque d'éléments
+        self._spill = {}        # clé -> deque d'éléments en surplus (la clé a déjà key_size éléments en attente)
+        self._spilled = 0
+        self._buckets = {}      # clé -> TokenBucket (gardé après vidage pour ne pas offrir de nouvelle rafale)
+        self._ready = []        # tas (disponible_à, compteur, clé) des clés ayant des éléments
+        self._counter = itertools.count()
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._changed = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def __len__(self):
+        return self._size + self._spilled
+
+    def _schedule(self, key, now):
+        heapq.heappush(self._ready, (now + self._buckets[key].delay(now), next(self._counter), key))
+
+    def _prune(self, now):
+        """Oublie les seaux pleins des clés sans élément en attente"""
+        for key in [k for k, b in self._buckets.items() if k not in self._pending and b.full(now)]:
+            del self._buckets[key]
+
+    async def put(self, item, key):
+        while not self._aborted:
+            pending = self._pending.get(key)
+            if pending is not None and len(pending) >= self.key_size:
+                if self._spilled < self.spill_size:
+                    # Clé saturée: mis de côté sans bloquer les domaines des autres clés
+                    self._spill.setdefault(key, deque()).append(item)
+                    self._spilled += 1
+                    return
+            elif self._size < self.maxsize:
+                break
+            self._not_full.clear()
+            await self._not_full.wait()
+        if self._aborted:
+            return
+        now = time.monotonic()
+        if pending is None:
+            if key not in self._buckets:
+                if len(self._buckets) >= 4 * self.maxsize:
+                    self._prune(now)
+                self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            pending = self._pending[key] = deque()
+            self._schedule(key, now)
+        pending.append(item)
+        self._size += 1
+        self._changed.set()
+
+    def close(self):
+        """Plus aucun put: get() retournera None une fois la file vide"""
+        self._closed = True
+        self._changed.set()
+
+    def abort(self):
+        """Abandonne les éléments en attente: get() retourne None, put() ne bloque plus"""
+        self._pending.clear()
+        self._spill.clear()
+        self._ready.clear()
+        self._size = self._spilled = 0
+        self._closed = self._aborted = True
+        self._changed.set()
+        self._not_full.set()
+
+    async def get(self):
+        while True:
+            now = time.monotonic()
+            timeout = None
+            if self._ready:
+                available_at, _, key = self._ready[0]
+                if available_at <= now:
+                    heapq.heappop(self._ready)
+                    pending = self._pending[key]
+                    item = pending.popleft()
+                    self._buckets[key].take(now)
+                    spill = self._spill.get(key)
+                    if spill:
+                        pending.append(spill.popleft())
+                        self._spilled -= 1
+                        self._size += 1
+                        if not spill:
+                            del self._spill[key]
+                    if pending:
+                        self._schedule(key, now)
+                        # Les workers en attente dormaient jusqu'à une échéance plus tardive
+                        if self._ready[0][2] == key:
+                            self._changed.set()
+                    else:
+                        del self._pending[key]
+                    self._size -= 1
+                    self._not_full.set()
+                    return item
+                timeout = available_at - now
+            elif self._closed:
+                return None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def depths(self, count=5):
+        """Clés ayant le plus de domaines en attente: liste de (clé, nombre)"""
+        return heapq.nlargest(count, ((k, len(v) + len(self._spill.get(k, ()))) for k, v in self._pending.items()),
+                              key=lambda kv: kv[1])
@@ -221,7 +221,8 @@ else
 fi
 echo ""
 log_info "📝 Prochaines étapes:"
-log_info "  1. Ajouter vos domaines dans: $INSTALL_DIR/domains_ch.txt"
+log_info "  1. Ajouter vos domaines dans: $INSTALL_DIR/domains_ch.txt (lu par défaut tant que domains_ch.dset n'existe pas;"
+log_info "     conversion: venv/bin/python -m backend.domainset import domains_ch.txt domains_ch.dset)"
 log_info "  2. Lancer un premier scan: sudo systemctl start oldsites-scan.service"
 log_info "  3. Consulter les résultats sur: http://$DOMAIN"
 echo ""
@@ -40,10 +40,10 @@ echo "✓ Dépendances installées"
 echo ""
 
 # Générer un fichier de domaines d'exemple si nécessaire
-if [ ! -f "domains_ch.txt" ]; then
+if [ ! -f "domains_ch.dset" ]; then
     echo "📝 Génération d'un fichier de domaines d'exemple..."
     python -m backend.scan_ch_sites --generate-sample
-    echo "✓ Fichier domains_ch.txt créé"
+    echo "✓ Fichier domains_ch.dset créé"
     echo ""
 fi
 
@@ -0,0 +1,6 @@
+"""Configuration pytest: le package backend est importé depuis la racine du projet"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
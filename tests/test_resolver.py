@@ -0,0 +1,151 @@
+"""
+Tests du résolveur DNS (backend/resolver.py) contre un serveur DNS local.
+
+Le serveur de test répond selon le nom demandé: adresse, NXDOMAIN, pas
+d'adresse (NODATA), SERVFAIL, aucune réponse (timeout), ou une réponse
+usurpée (question différente) avant la vraie.
+"""
+
+import asyncio
+import socket
+import struct
+
+from backend import config, scan_ch_sites
+from backend.resolver import NEGATIVE_ERRORS, QTYPE_A, DNSResolver, _read_name
+
+
+ADDRESS = "192.0.2.10"
+
+
+def _response(query, rcode=0, address=None, question=None):
+    """Réponse à une requête: en-tête, question (celle de la requête ou `question`), enregistrement A"""
+    qid = struct.unpack_from("!H", query)[0]
+    qname_end = query.index(b"\0", 12) + 1
+    qtype = struct.unpack_from("!H", query, qname_end)[0]
+    if question is None:
+        question = query[12:qname_end + 4]
+    answer = b""
+    if address is not None and qtype == QTYPE_A:
+        answer = b"\xc0\x0c" + struct.pack("!HHIH", QTYPE_A, 1, 300, 4) + socket.inet_aton(address)
+    header = struct.pack("!HHHHHH", qid, 0x8180 | rcode, 1, 1 if answer else 0, 0, 0)
+    return header + question + answer
+
+
+def _question(name):
+    labels = name.encode().split(b".")
+    return b"".join(bytes([len(label)]) + label for label in labels) + b"\0" + struct.pack("!HH", QTYPE_A, 1)
+
+
+class StubServer(asyncio.DatagramProtocol):
+    """Serveur DNS de test: réponse selon le premier label du nom demandé (chiffres finaux ignorés)"""
+
+    def __init__(self):
+        self.ports = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, query, addr):
+        self.ports.add(addr[1])
+        name, _ = _read_name(query, 12)
+        kind = name.split(b".")[0].rstrip(b"0123456789")
+        if kind == b"ok":
+            self.transport.sendto(_response(query, address=ADDRESS), addr)
+        elif kind == b"dead":
+            self.transport.sendto(_response(query, rcode=3), addr)
+        elif kind == b"empty":
+            self.transport.sendto(_response(query), addr)
+        elif kind == b"broken":
+            self.transport.sendto(_response(query, rcode=2), addr)
+        elif kind == b"spoof":
+            # NXDOMAIN pour une autre question (même identifiant), puis la vraie réponse
+            self.transport.sendto(_response(query, rcode=3, question=_question("other.ch")), addr)
+            self.transport.sendto(_response(query, address=ADDRESS), addr)
+        # slow: pas de réponse
+
+
+async def _with_resolver(test):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(StubServer, local_addr=("127.0.0.1", 0))
+    port = transport.get_extra_info("sockname")[1]
+    resolver = DNSResolver(servers=[f"127.0.0.1:{port}"], timeout=0.2, retries=1)
+    try:
+        return await test(resolver, server)
+    finally:
+        await resolver.close()
+        transport.close()
+
+
+def test_resolve_answers():
+    async def test(resolver, server):
+        return await resolver.resolve_many(["ok.ch", "dead.ch", "empty.ch", "broken.ch", "slow.ch"])
+
+    answers = asyncio.run(_with_resolver(test))
+    assert answers == {
+        "ok.ch": ([ADDRESS], None),
+        "dead.ch": ([], "NXDOMAIN"),
+        "empty.ch": ([], "NODATA"),
+        "broken.ch": ([], "SERVFAIL"),
+        "slow.ch": ([], "Timeout"),
+    }
+
+
+def test_negative_cache_only_definitive_errors():
+    async def test(resolver, server):
+        await resolver.resolve_many(["ok.ch", "dead.ch", "empty.ch", "broken.ch", "slow.ch"])
+        return dict(resolver._cache)
+
+    cache = asyncio.run(_with_resolver(test))
+    assert {host: entry[2] for host, entry in cache.items()} == {
+        "ok.ch": None, "dead.ch": "NXDOMAIN", "empty.ch": "NODATA"}
+
+
+def test_pipeline_negative_results(monkeypatch):
+    # Seuls les domaines morts (NEGATIVE_ERRORS) sont rendus en erreur DNS (cache négatif en base);
+    # SERVFAIL et timeout passent par le scan HTTP
+    scanned = []
+
+    async def scan_domain(session, domain, state):
+        scanned.append(domain)
+        return {"domain": domain, "error": "Inaccessible"}
+
+    monkeypatch.setattr(scan_ch_sites, "scan_domain", scan_domain)
+    monkeypatch.setattr(config, "ADAPTIVE_CONCURRENCY", False)
+
+    async def test(resolver, server):
+        results = []
+
+        async def sink(result):
+            results.append(result)
+
+        items = list(enumerate(["ok.ch", "dead.ch", "empty.ch", "broken.ch", "slow.ch"]))
+        await scan_ch_sites.scan_pipeline(None, items, sink, workers=2, lookup=None, resolver=resolver)
+        return results
+
+    results = asyncio.run(_with_resolver(test))
+    negative = {r["domain"]: r["dns_error"] for r in results if "dns_error" in r}
+    assert negative == {"dead.ch": "NXDOMAIN", "empty.ch": "NODATA"}
+    assert set(negative.values()) <= set(NEGATIVE_ERRORS)
+    assert sorted(scanned) == ["broken.ch", "ok.ch", "slow.ch"]
+
+
+def test_spoofed_question_ignored():
+    async def test(resolver, server):
+        return await resolver.resolve("spoof.ch")
+
+    assert asyncio.run(_with_resolver(test)) == ([ADDRESS], None)
+
+
+def test_source_ports_rotate(monkeypatch):
+    monkeypatch.setattr(config, "DNS_SOCKETS", 4)
+    monkeypatch.setattr(config, "DNS_SOCKET_QUERIES", 5)
+
+    async def test(resolver, server):
+        answers = await resolver.resolve_many([f"ok{i}.ch" for i in range(40)])
+        return answers, server.ports, len(resolver._open)
+
+    answers, ports, still_open = asyncio.run(_with_resolver(test))
+    assert all(answer == ([ADDRESS], None) for answer in answers.values())
+    # 40 requêtes, 5 au plus par socket: au moins 8 ports source
+    assert len(ports) >= 8
+    assert still_open <= 4